@@ -0,0 +1,144 @@
+# Database backends. quest.engine does all of its talking to the DB through
+# one of these, picked by config.db_backend, so Quest isn't tied to MySQL.
+#
+#  "mysql": a MySQL server, through MySQLdb (the default).
+#  "sqlite": a SQLite file, or an in-memory DB if config.db_name is
+#            ":memory:". Needs no DB server at all, which is handy for
+#            tests and benchmarks.
+#
+# To add a backend, subclass Backend and add it to backend_modules.
+
+# Maps config.db_backend to (module, class name). Modules are only
+# imported when they're asked for, so e.g. MySQLdb doesn't need to be
+# installed to use SQLite.
+backend_modules = {
+        'mysql': ('quest.backends.mysql', 'MySQLBackend'),
+        'sqlite': ('quest.backends.sqlite', 'SQLiteBackend'),
+        }
+
+class UnknownBackendError(Exception):
+    def __init__(self, value):
+        self.parameter = value
+    def __str__(self):
+        return "Unknown db_backend %s, pick one of: %s" % (repr(self.parameter), ", ".join(sorted(backend_modules.keys())))
+
+def get_backend(name):
+    """Returns a new instance of the backend called name (e.g. "mysql")."""
+    if name not in backend_modules:
+        raise UnknownBackendError(name)
+    module_name, class_name = backend_modules[name]
+    module = __import__(module_name, fromlist = [class_name])
+    return getattr(module, class_name)()
+
+class Backend:
+    """
+    Everything quest.engine needs to know about a particular kind of DB.
+    Methods that take a connection are given one that engine checked out
+    of its pool.
+    """
+
+    # The exception class the DB driver raises
+    Error = Exception
+    # Whether 'abc' = 'ABC' (quest.query.predicate compares strings like
+    # the DB does)
+    case_insensitive_strings = False
+
+    # The most connections engine's pool should open at once
+    def max_connections(self):
+        raise NotImplementedError
+
+    def connect(self):
+        """Opens and returns a new DB-API connection, using config."""
+        raise NotImplementedError
+
+    def ping(self, connection):
+        """Raises self.Error if connection is no longer usable."""
+        raise NotImplementedError
+
+    def is_stale_connection_error(self, error):
+        """
+        Returns True if error means the connection died under us (as
+        opposed to e.g. a syntax error in the SQL), False otherwise.
+        """
+        return False
+
+    def cursor(self, connection):
+        """Returns a cursor that reads the whole result in one go."""
+        return connection.cursor()
+
+    def streaming_cursor(self, connection):
+        """Returns a cursor that reads results from the DB as they're fetched."""
+        raise NotImplementedError
+
+    def abandon_streaming_cursor(self, connection, cursor):
+        """
+        Cleans up a streaming cursor that still has unread rows. Returns True
+        if connection can go back in the pool afterwards, False if it should
+        be thrown away.
+        """
+        raise NotImplementedError
+
+    def prepare(self, sql, params):
+        """
+        Returns (sql, params), rewritten for the driver. Quest writes
+        placeholders as %s.
+        """
+        return (sql, params)
+
+    def info(self, connection):
+        """Returns the DB's message about the last statement, or None."""
+        return None
+
+    def cancel_handle(self, connection):
+        """
+        Called (on the thread using connection) before it runs anything
+        that might need cancelling. Returns whatever cancel needs to
+        find the statement again.
+        """
+        return connection
+
+    def cancel(self, handle):
+        """
+        Interrupts the statement running on the connection that
+        cancel_handle gave handle for. Called from another thread. The
+        interrupted statement raises self.Error.
+        """
+        raise NotImplementedError
+
+    def describe_sql(self, sql):
+        """
+        Returns a statement that's as cheap as possible to run, but still lets
+        column_types work out sql's column types. sql has no LIMIT.
+        """
+        return sql + " LIMIT 0"
+
+    def column_types(self, cursor):
+        """
+        Given a cursor that has executed describe_sql's statement, returns a
+        list of (column_name, python_type) tuples. python_type is None if we
+        can't tell.
+        """
+        raise NotImplementedError
+
+    def explain_sql(self, sql):
+        """Returns the statement that asks the DB how it would run sql."""
+        return "EXPLAIN " + sql
+
+    def full_scans(self, cursor):
+        """
+        Given a cursor that has executed explain_sql's statement, returns
+        a set of the (lowercased) names of the tables the DB would read
+        every row of.
+        """
+        raise NotImplementedError
+
+    def quote(self, value):
+        """Returns value as a SQL literal."""
+        if value is None:
+            return "NULL"
+        elif isinstance(value, (int, long, float)):
+            return str(value)
+        elif not isinstance(value, (str, unicode)):
+            # e.g. a date
+            value = str(value)
+        return "'%s'" % value.replace("'", "''")
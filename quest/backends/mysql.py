@@ -0,0 +1,121 @@
+# The MySQL backend, which talks to a MySQL server through MySQLdb.
+
+import decimal
+import datetime
+
+import MySQLdb
+import MySQLdb.cursors
+from MySQLdb.constants import FIELD_TYPE
+
+import quest.config as config
+from quest.backends import Backend
+
+# MySQL client error codes that mean the connection itself went away,
+# so it's safe to reconnect and try the statement again.
+# 2006: MySQL server has gone away
+# 2013: Lost connection to MySQL server during query
+STALE_CONNECTION_ERRORS = (2006, 2013)
+
+# Maps a MySQL column type code (cursor.description[i][1]) to the Python
+# type MySQLdb converts values of that column to.
+type_code_to_python_type = {
+        FIELD_TYPE.TINY: int,
+        FIELD_TYPE.SHORT: int,
+        FIELD_TYPE.LONG: int,
+        FIELD_TYPE.INT24: int,
+        FIELD_TYPE.YEAR: int,
+        FIELD_TYPE.LONGLONG: long,
+        FIELD_TYPE.FLOAT: float,
+        FIELD_TYPE.DOUBLE: float,
+        FIELD_TYPE.DECIMAL: decimal.Decimal,
+        FIELD_TYPE.NEWDECIMAL: decimal.Decimal,
+        FIELD_TYPE.DATE: datetime.date,
+        FIELD_TYPE.NEWDATE: datetime.date,
+        FIELD_TYPE.DATETIME: datetime.datetime,
+        FIELD_TYPE.TIMESTAMP: datetime.datetime,
+        FIELD_TYPE.TIME: datetime.timedelta,
+        FIELD_TYPE.VARCHAR: str,
+        FIELD_TYPE.VAR_STRING: str,
+        FIELD_TYPE.STRING: str,
+        FIELD_TYPE.ENUM: str,
+        FIELD_TYPE.SET: str,
+        FIELD_TYPE.TINY_BLOB: str,
+        FIELD_TYPE.MEDIUM_BLOB: str,
+        FIELD_TYPE.LONG_BLOB: str,
+        FIELD_TYPE.BLOB: str,
+        }
+
+class MySQLBackend(Backend):
+    Error = MySQLdb.MySQLError
+    # True for MySQL's default (_ci) collations
+    case_insensitive_strings = True
+
+    def max_connections(self):
+        return config.db_pool_size
+
+    def connect(self):
+        connection = MySQLdb.connect(host = config.db_host,
+                user = config.db_user,
+                passwd = config.db_password,
+                db = config.db_name)
+        # MySQLdb turns autocommit off, and nothing commits: an UPDATE
+        # would stay invisible to every other pooled connection, and
+        # each connection would keep reading its own InnoDB snapshot.
+        connection.autocommit(True)
+        return connection
+
+    def ping(self, connection):
+        connection.ping()
+
+    def is_stale_connection_error(self, error):
+        if not isinstance(error, MySQLdb.OperationalError):
+            return False
+        return len(error.args) > 0 and error.args[0] in STALE_CONNECTION_ERRORS
+
+    def streaming_cursor(self, connection):
+        # SSCursor leaves the result on the server and reads it row by row
+        return connection.cursor(MySQLdb.cursors.SSCursor)
+
+    def abandon_streaming_cursor(self, connection, cursor):
+        # Closing an SSCursor makes MySQL send us every unread row, which
+        # is far slower than closing the connection.
+        return False
+
+    def info(self, connection):
+        return connection.info()
+
+    def cancel_handle(self, connection):
+        # The server's id for the connection, which is what KILL takes
+        return connection.thread_id()
+
+    def cancel(self, handle):
+        # The connection running the query is busy waiting for it, so the
+        # KILL has to come from a new one. KILL QUERY only stops the
+        # statement; the connection itself is fine afterwards.
+        killer = self.connect()
+        try:
+            cursor = killer.cursor()
+            cursor.execute("KILL QUERY %d" % handle)
+            cursor.close()
+        finally:
+            killer.close()
+
+    def full_scans(self, cursor):
+        # One row per table read; type ALL is a full table scan. Derived
+        # tables show up as e.g. <derived2>, which we can't index.
+        columns = [d[0].lower() for d in cursor.description]
+        table_index = columns.index('table')
+        type_index = columns.index('type')
+        return set([row[table_index].lower() for row in cursor.fetchall()
+            if row[type_index] == 'ALL' and row[table_index] and not row[table_index].startswith('<')])
+
+    def column_types(self, cursor):
+        # MySQL answers LIMIT 0 from the query plan alone, and the type
+        # codes in cursor.description tell us everything we need.
+        return [(d[0], type_code_to_python_type.get(d[1])) for d in cursor.description]
+
+    def quote(self, value):
+        # Unlike standard SQL, MySQL treats backslashes in strings as escapes
+        if isinstance(value, (str, unicode)):
+            value = value.replace('\\', '\\\\')
+        return Backend.quote(self, value)
@@ -0,0 +1,96 @@
+# The SQLite backend. config.db_name is the path to the DB file, or
+# ":memory:" for a throwaway in-memory DB. SQLite has no server, so this
+# needs nothing but Python's own sqlite3 module.
+
+import re
+import sqlite3
+
+import quest.config as config
+from quest.backends import Backend
+
+# Matches a full table scan in EXPLAIN QUERY PLAN's output
+rFullScan = re.compile(r"^SCAN (?:TABLE )?(\w+)", re.I)
+# A quoted string or identifier, where a %s is just text
+rQuoted = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`)""")
+
+class SQLiteBackend(Backend):
+    Error = sqlite3.Error
+
+    def is_memory(self):
+        return config.db_name == ':memory:'
+
+    def max_connections(self):
+        # Every connection to ":memory:" gets its own, separate DB, so
+        # everyone has to share the one connection.
+        if self.is_memory():
+            return 1
+        return config.db_pool_size
+
+    def connect(self):
+        # The pool hands connections from thread to thread, but only ever
+        # to one thread at a time, which is safe. isolation_level = None
+        # is autocommit (the MySQL backend turns it on too): otherwise
+        # nothing ever commits the transactions sqlite3 opens for
+        # UPDATE/INSERT.
+        return sqlite3.connect(config.db_name, check_same_thread = False, isolation_level = None)
+
+    def ping(self, connection):
+        connection.execute("SELECT 1")
+
+    def streaming_cursor(self, connection):
+        # SQLite cursors already step through the result as it's fetched
+        return connection.cursor()
+
+    def abandon_streaming_cursor(self, connection, cursor):
+        cursor.close()
+        # Don't throw away a ":memory:" DB just because someone stopped
+        # reading early.
+        return True
+
+    def cancel(self, handle):
+        # handle is the connection itself. interrupt() is safe to call
+        # from another thread.
+        handle.interrupt()
+
+    def prepare(self, sql, params):
+        if params is None:
+            return (sql, params)
+        # sqlite3 wants ? placeholders. split() puts the quoted pieces
+        # at the odd indexes.
+        pieces = rQuoted.split(sql)
+        for index in range(0, len(pieces), 2):
+            pieces[index] = pieces[index].replace('%s', '?')
+        return (''.join(pieces), params)
+
+    def describe_sql(self, sql):
+        # SQLite doesn't report column types in cursor.description, so
+        # we need an actual row to look at.
+        return sql + " LIMIT 1"
+
+    def explain_sql(self, sql):
+        return "EXPLAIN QUERY PLAN " + sql
+
+    def full_scans(self, cursor):
+        # The last column says e.g. "SCAN TABLE players" (or "SCAN
+        # players" in newer SQLite) for a full scan, and "SEARCH ..." when
+        # an index narrows it down. Scanning a whole index (e.g. "SCAN
+        # players USING INDEX ...", to avoid a sort) still reads every row.
+        tables = set()
+        for row in cursor.fetchall():
+            match = rFullScan.match(row[-1])
+            if match and match.group(1).lower() != 'subquery':
+                tables.add(match.group(1).lower())
+        return tables
+
+    def column_types(self, cursor):
+        row = cursor.fetchone()
+        column_names = [d[0] for d in cursor.description]
+        if row is None:
+            return [(column_name, None) for column_name in column_names]
+        types = []
+        for column_name, value in zip(column_names, row):
+            if value is None:
+                types.append((column_name, None))
+            else:
+                types.append((column_name, type(value)))
+        return types
@@ -21,6 +21,25 @@ ALWAYS_SHOW = True
 # show, we show this many rows. Can be either ALL_ROWS or an integer.
 ROWS_TO_SHOW = 10
 
+# Streaming mode. If True, SHOW and raw SQL results are read from the DB
+# with a server-side cursor and printed STREAM_BATCH_SIZE rows at a
+# time, instead of being loaded into memory all at once. Turn this on
+# if you're going to look at very large results with ROWS_TO_SHOW set
+# to ALL_ROWS.
+STREAM_RESULTS = False
+STREAM_BATCH_SIZE = 1000
+# A streamed result of at most STREAM_KEEP_ROWS rows is kept once it's
+# been read, just like a shown one: for the result cache, and for local
+# evaluation of its query's children (see KEEP_RESULT_ROWS, below).
+# The web app streams every SHOW, so this is what lets it use them.
+STREAM_KEEP_ROWS = 10000
+
+# Most queries with autogenerated names (A, B, ..., AA, ...) to keep.
+# When there are more, the least recently used ones are forgotten.
+# Queries you named with INITIALIZE are never forgotten. None means keep
+# everything.
+QUERY_CACHE_SIZE = 1000
+
 
 # DB configuration. You should change this in your local config.py, by
 # doing:
@@ -28,11 +47,138 @@ ROWS_TO_SHOW = 10
 #  quest.config.db_user = "my_db_user"
 #  quest.config.db_password = "my_db_password"
 #  ...etc.
+#
+# db_backend picks the kind of DB (see quest.backends):
+#  "mysql": a MySQL server (needs MySQLdb, i.e. mysql-python)
+#  "sqlite": a SQLite DB, where db_name is the path to the DB file, or
+#            ":memory:" for a throwaway in-memory DB. db_host, db_user
+#            and db_password are ignored.
+# If you change these after Quest has talked to the DB, call
+# quest.engine.reset() so it reconnects.
+db_backend = 'mysql'
 db_host = 'localhost'
 db_user = 'root'
 db_password = 'CHANGE_ME'
 db_name = 'test'
 
+# Result cache. If RESULT_CACHE_ENABLED is True, SHOW remembers the rows
+# each query returned, and showing the same query again (e.g. re-running
+# Q3.show()) doesn't go back to the DB. Cached results are dropped after
+# RESULT_CACHE_TTL seconds (None keeps them until they're evicted), when
+# there are more than RESULT_CACHE_SIZE of them, and whenever Quest runs
+# an UPDATE/INSERT or STORE that touches a table they read from. Changes
+# made to the DB behind Quest's back aren't noticed until the TTL runs
+# out.
+RESULT_CACHE_ENABLED = False
+RESULT_CACHE_SIZE = 100
+RESULT_CACHE_TTL = 300
+
+# Connection pool. Each statement checks a connection out of the pool
+# and returns it when it's done, so web requests on different threads
+# don't share a cursor.
+# db_pool_size: most connections that will ever be open at once
+# db_pool_timeout: seconds to wait for a free connection before giving
+#                  up, or None to wait forever
+# db_pool_recycle: a connection idle for longer than this many seconds
+#                  is pinged (and reopened if it's dead) before it's
+#                  reused. None pings every time.
+db_pool_size = 10
+db_pool_timeout = 30
+db_pool_recycle = 60
+
+# How RSHIFT/LSHIFT find the next/previous value of a string attribute.
+# NEIGHBOR_SEEK asks the DB for it (SELECT MIN(col) ... WHERE col > value),
+# which is a single index seek if the column is indexed.
+# NEIGHBOR_MEMORY fetches and caches the column's sorted distinct values
+# once, then looks values up in memory. Good for small, unindexed columns.
+NEIGHBOR_SEEK = "seek"
+NEIGHBOR_MEMORY = "memory"
+SHIFT_NEIGHBOR_LOOKUP = NEIGHBOR_SEEK
+
+# How many parsed statements ROLLUP/DRILLDOWN keep around, so that
+# rewriting the same statement again doesn't have to run sqlparse.
+SQLPARSE_CACHE_SIZE = 128
+
+# Summary tables. If SUMMARY_TABLES_ENABLED is True, queries that group
+# by hierarchy attributes are answered from the smallest precomputed
+# summary table that can answer them, instead of the table they name.
+# Summaries have to be built first, with e.g.
+#  quest.query.summaries.build("players", ["salary", "hr"])
+# where the list is the columns you'll aggregate. Summaries aren't used
+# once Quest changes their table, until quest.query.summaries.refresh().
+SUMMARY_TABLES_ENABLED = False
+
+# Local evaluation. A query that has been shown keeps its rows (as long as
+# it got all of them, and there are at most KEEP_RESULT_ROWS; 0 keeps
+# none) for its children; showing the query itself again still asks the
+# DB. If LOCAL_ROLLUP is True, showing a ROLLUP of such a query works
+# out the coarser groups from those rows in memory, rather than asking the
+# DB, whenever its aggregates allow (SUM, COUNT, MIN, MAX, and AVG if SUM
+# and COUNT of the same column are there too). If LOCAL_NARROW is True,
+# showing a NARROW of such a query filters those rows in memory, whenever
+# the predicate is simple enough (comparisons, BETWEEN, IN, LIKE and
+# IS NULL on columns of the result).
+# Every cached query can keep that many rows, so this is all off unless
+# you ask for it.
+KEEP_RESULT_ROWS = 0
+LOCAL_ROLLUP = False
+LOCAL_NARROW = False
+
+# Shift prefetching (see quest.query.prefetch). If PREFETCH_SHIFTS is
+# True, showing a query made by RSHIFT/LSHIFT/SHIFT starts fetching the
+# PREFETCH_DEPTH queries further along in the same direction, and as many
+# back the other way, in the background, so shifting again is instant.
+# Prefetched rows take up at most (roughly) PREFETCH_MEMORY_BUDGET bytes,
+# and are thrown away after PREFETCH_TTL seconds (None keeps them until
+# they're used or pushed out), so changes made to the DB behind Quest's
+# back show up.
+PREFETCH_SHIFTS = False
+PREFETCH_DEPTH = 1
+PREFETCH_MEMORY_BUDGET = 50 * 1024 * 1024
+PREFETCH_TTL = 60
+
+# Materialization (see quest.query.materialize). If MATERIALIZE_ENABLED
+# is True, RELATE stores its query's result in a quest_mat_ table (indexed
+# on the join columns) and the join, and anything derived from it, reads
+# from that table rather than working the query out again. STORE's tables
+# are reused the same way. At most MATERIALIZE_MAX_TABLES quest_mat_
+# tables are kept (None keeps them all); they're dropped when Quest exits.
+MATERIALIZE_ENABLED = False
+MATERIALIZE_MAX_TABLES = 20
+
+# Index advisor (see quest.query.advisor, and the "advise" command). If
+# INDEX_ADVISOR_ENABLED is True, Quest remembers which columns of which
+# tables RSHIFT/LSHIFT/SHIFT, NARROW and ROLLUP find or group rows by, and
+# "advise" recommends indexes for the ones the DB has to scan a whole
+# table for. If INDEX_ADVISOR_CREATE is True, Quest creates such an index
+# itself once the same columns have been used INDEX_ADVISOR_THRESHOLD
+# times.
+INDEX_ADVISOR_ENABLED = True
+INDEX_ADVISOR_CREATE = False
+INDEX_ADVISOR_THRESHOLD = 3
+
+# Statement statistics (see quest.stats, and the "stats" command). If
+# STATS_ENABLED is True, Quest remembers the timing, row count and
+# operator lineage of the last STATS_HISTORY_SIZE statements it ran.
+# Statements that take at least SLOW_QUERY_SECONDS are also appended to
+# the file SLOW_QUERY_LOG, unless it's None.
+STATS_ENABLED = True
+STATS_HISTORY_SIZE = 1000
+SLOW_QUERY_SECONDS = 1.0
+SLOW_QUERY_LOG = None
+
+# Web app jobs (see quest.web.jobs). Queries submitted from the browser
+# run on WEB_JOB_WORKERS background threads, and a finished job's state
+# and rows are kept for WEB_JOB_RETENTION seconds for the page to fetch.
+# The page fetches a job's rows at most WEB_PAGE_SIZE at a time, and a
+# job reads at most WEB_JOB_BUFFER_PAGES pages ahead of it. Unfinished
+# jobs the page hasn't fetched rows from for WEB_JOB_RETENTION seconds are
+# cancelled.
+WEB_JOB_WORKERS = 4
+WEB_JOB_RETENTION = 600
+WEB_PAGE_SIZE = 1000
+WEB_JOB_BUFFER_PAGES = 3
+
 # ROLLUP/DRILLDOWN hierarchies. Please use the convenience method
 # create_hierarchy (below) instead of accessing them directly.
 rollup_child2parent = {}
@@ -1,13 +1,19 @@
 """The actual engine that interfaces with and sends SQL code to the DB."""
 
+import re
 import sys
-
-import MySQLdb
+import time
+import array
+import itertools
+import threading
+import Queue
+from contextlib import contextmanager
 
 import config
 import util
+import quest.backends
 
-class QuestConnectionError(MySQLdb.MySQLError):
+class QuestConnectionError(Exception):
     def __init__(self, db_host, db_user, db_password, db_name):
         self.db_host = db_host
         self.db_user = db_user
@@ -25,69 +31,1137 @@ class QuestConnectionError(MySQLdb.MySQLError):
     def __repr__(self):
         return __str__()
 
-# run_sql sets these the first time it's run. This enables us to import
+class QuestPoolTimeoutError(Exception):
+    """
+    Raised when every connection in the pool is checked out and none
+    was returned within config.db_pool_timeout seconds.
+    """
+    def __init__(self, pool_size, timeout):
+        self.pool_size = pool_size
+        self.timeout = timeout
+
+    def __str__(self):
+        return "All %d pooled connections are busy (waited %s seconds)" % (self.pool_size, self.timeout)
+
+# backend is created the first time it's needed, from config.db_backend
+# (see quest.backends). Everything that depends on which DB we're talking
+# to goes through it.
+backend = None
+
+def get_backend():
+    """Returns the module-wide quest.backends.Backend, creating it if need be."""
+    global backend
+    if backend is None:
+        with pool_lock:
+            if backend is None:
+                backend = quest.backends.get_backend(config.db_backend)
+    return backend
+
+def connect():
+    """
+    Opens a brand new DB connection using the settings in config.
+    Raises QuestConnectionError if we couldn't connect.
+    """
+    db_backend = get_backend()
+    try:
+        return db_backend.connect()
+    except db_backend.Error as e:
+        raise QuestConnectionError(config.db_host,
+                config.db_user,
+                config.db_password,
+                config.db_name)
+
+def is_stale_connection_error(error):
+    """
+    Returns True if error means the connection died under us (as
+    opposed to e.g. a syntax error in the SQL), False otherwise.
+    """
+    return get_backend().is_stale_connection_error(error)
+
+def quote(value):
+    """Returns value as a SQL literal for the current DB, e.g. 'O''Neil'."""
+    return get_backend().quote(value)
+
+class ConnectionPool:
+    """
+    A bounded, thread-safe pool of DB connections.
+
+    Connections are opened lazily, up to max_size of them. checkout()
+    hands a connection to exactly one caller at a time, so two threads
+    never share a connection (or a cursor). A connection that has sat
+    idle for longer than recycle seconds is pinged before it is handed
+    out, and reopened if the ping fails.
+    """
+
+    def __init__(self, max_size, timeout = None, recycle = None):
+        """
+        max_size is the most connections that will ever be open at once.
+        timeout is how many seconds checkout() waits for a free
+        connection before raising QuestPoolTimeoutError (None waits
+        forever). recycle is how many idle seconds a connection may have
+        before checkout() health-checks it (None checks every time).
+        """
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        # Idle connections, as (connection, time it was checked in)
+        self.idle = Queue.LifoQueue(max_size)
+        # How many connections we've opened and not yet discarded
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def checkout(self):
+        """Returns a healthy connection, opening one if need be."""
+        try:
+            connection, checked_in_at = self.idle.get_nowait()
+        except Queue.Empty:
+            connection = self._open_or_wait()
+            if connection is not None:
+                return connection
+            # The pool is full, wait for another thread to check one in
+            connection, checked_in_at = self._wait_for_idle()
+
+        if self.recycle is None or time.time() - checked_in_at > self.recycle:
+            connection = self._ensure_alive(connection)
+        return connection
+
+    def checkin(self, connection):
+        """Returns a connection to the pool so someone else can use it."""
+        self.idle.put_nowait((connection, time.time()))
+
+    def discard(self, connection):
+        """
+        Closes a connection that's no longer usable (e.g. the server went
+        away) and frees up its slot in the pool.
+        """
+        try:
+            connection.close()
+        except Exception:
+            # It's already dead, that's why we're discarding it.
+            pass
+        with self.lock:
+            self.size -= 1
+
+    def close_all(self):
+        """Closes every idle connection. Checked-out ones are left alone."""
+        while True:
+            try:
+                connection, checked_in_at = self.idle.get_nowait()
+            except Queue.Empty:
+                break
+            self.discard(connection)
+
+    def _open_or_wait(self):
+        """
+        Opens a new connection if we're below max_size and returns it,
+        otherwise returns None so the caller waits for an idle one.
+        """
+        with self.lock:
+            if self.size >= self.max_size:
+                return None
+            self.size += 1
+        try:
+            return connect()
+        except Exception:
+            with self.lock:
+                self.size -= 1
+            raise
+
+    def _wait_for_idle(self):
+        try:
+            return self.idle.get(True, self.timeout)
+        except Queue.Empty:
+            raise QuestPoolTimeoutError(self.max_size, self.timeout)
+
+    def _ensure_alive(self, connection):
+        """Pings connection and returns it, or a fresh one if it was stale."""
+        db_backend = get_backend()
+        try:
+            db_backend.ping(connection)
+            return connection
+        except db_backend.Error:
+            self.discard(connection)
+            with self.lock:
+                self.size += 1
+            try:
+                return connect()
+            except Exception:
+                with self.lock:
+                    self.size -= 1
+                raise
+
+class BufferedCursor:
+    """
+    A read-only snapshot of an executed cursor. run_sql hands one of
+    these back so that the pooled connection the statement ran on can go
+    straight back to the pool, while callers still get the familiar
+    fetchone()/fetchmany()/fetchall()/description/rowcount interface.
+
+    rows is whatever run_sql's read function made of the cursor's rows
+    (by default, a list of all of them).
+    """
+
+    def __init__(self, cursor, info = None, rows = ()):
+        self.description = cursor.description
+        self.rowcount = cursor.rowcount
+        self.lastrowid = getattr(cursor, 'lastrowid', None)
+        self.info = info
+        self.rows = rows
+        self.position = 0
+
+    def fetchone(self):
+        if self.position >= len(self.rows):
+            return None
+        row = self.rows[self.position]
+        self.position += 1
+        return row
+
+    def fetchmany(self, size = 1):
+        rows = self.rows[self.position:self.position+size]
+        self.position += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.rows[self.position:]
+        self.position = len(self.rows)
+        return rows
+
+# pool is created the first time it's needed. This enables us to import
 # this file before setting config parameters
-db = None
-cursor = None
+pool = None
+# Reentrant: get_pool creates the backend (which takes this lock too) if
+# nothing has yet
+pool_lock = threading.RLock()
+
+def get_pool():
+    """Returns the module-wide ConnectionPool, creating it if need be."""
+    global pool
+    if pool is None:
+        with pool_lock:
+            if pool is None:
+                pool = ConnectionPool(get_backend().max_connections(),
+                        timeout = config.db_pool_timeout,
+                        recycle = config.db_pool_recycle)
+    return pool
 
-def run_sql(sql):
+def reset():
     """
-    Sends a pure SQL expression to the DB and returns the DB cursor object.
+    Closes every idle pooled connection and forgets the pool and backend,
+    so the next statement uses whatever config says now. Call this after
+    changing config.db_backend or the connection settings.
+
+    Careful: with SQLite's ":memory:", this throws the DB away.
+    """
+    global pool
+    global backend
+    with pool_lock:
+        if pool is not None:
+            pool.close_all()
+        pool = None
+        backend = None
+
+@contextmanager
+def checkout_connection():
+    """
+    Checks a connection out of the pool for the duration of a with
+    block, and puts it back afterwards. If the block raised a "server
+    went away" error, the connection is thrown away instead.
+
+    If the current thread is running inside a cancellable block, the
+    connection can be interrupted by cancelling its CancelToken.
+    """
+    connection_pool = get_pool()
+    connection = connection_pool.checkout()
+    token = current_cancel_token()
+    try:
+        if token is not None:
+            token.attach(connection)
+        try:
+            yield connection
+        finally:
+            if token is not None:
+                token.detach(connection)
+    except Exception as e:
+        if is_stale_connection_error(e):
+            connection_pool.discard(connection)
+        else:
+            connection_pool.checkin(connection)
+        raise
+    else:
+        connection_pool.checkin(connection)
+
+def with_semicolon(sql):
+    """We need a semicolon or pure SQL won't work."""
+    if not sql.endswith(';'):
+        sql += ';'
+    return sql
+
+# Statement events. Whenever Quest runs a statement (or answers one
+# without the DB), every listener added with add_statement_listener is
+# called with a StatementEvent describing it. quest.stats keeps them.
+statement_listeners = []
+# The lineage of whatever the current thread is running (see
+# statement_lineage)
+statement_context = threading.local()
+
+def add_statement_listener(listener):
+    """Arranges for listener(event) to be called after every statement."""
+    if listener not in statement_listeners:
+        statement_listeners.append(listener)
+
+@contextmanager
+def statement_lineage(lineage):
+    """
+    Marks the statements run in a with block as coming from a query made
+    by the given operators (e.g. ('narrow', 'rollup'); see Query.lineage).
+    """
+    previous = current_lineage()
+    statement_context.lineage = tuple(lineage)
+    try:
+        yield
+    finally:
+        statement_context.lineage = previous
+
+def current_lineage():
+    return getattr(statement_context, 'lineage', ())
+
+def estimate_bytes(rows):
+    """Roughly how many bytes of values rows holds."""
+    total = 0
+    for row in rows:
+        for value in row:
+            if isinstance(value, basestring):
+                total += len(value)
+            elif value is not None:
+                total += 8
+    return total
+
+class StatementEvent:
+    """
+    One statement Quest ran. source is where the rows came from:
+      "db": run_sql
+      "stream": a RowStream
+      "cache": show(), from result_cache
+      "local": a Query, worked out in memory (see quest.query.local)
+      "prefetch": a Query, from quest.query.prefetch
+    Times are in seconds; execute_seconds is how long the DB took to run
+    the statement, fetch_seconds how long reading its rows took.
+    """
+
+    def __init__(self, sql, source, lineage = None):
+        self.sql = sql
+        self.source = source
+        if lineage is None:
+            lineage = current_lineage()
+        self.lineage = lineage
+        self.started_at = time.time()
+        self.execute_seconds = 0.0
+        self.fetch_seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        # The error message, if it failed
+        self.error = None
+
+    def executed(self):
+        """Call once the statement has run, before fetching anything."""
+        self.execute_seconds = time.time() - self.started_at
+
+    def fetched(self, rows, seconds):
+        """Call with each batch of rows read, and how long that took."""
+        self.rows += len(rows)
+        self.bytes += estimate_bytes(rows)
+        self.fetch_seconds += seconds
+
+    def finished(self, error = None):
+        """Call when it's all done, to tell the listeners."""
+        if error is not None:
+            self.error = str(error)
+        for listener in statement_listeners:
+            listener(self)
+
+    def total_seconds(self):
+        return self.execute_seconds + self.fetch_seconds
+
+def start_event(sql, source, lineage = None):
+    """A new StatementEvent, or None if nobody's listening."""
+    if not statement_listeners:
+        return None
+    return StatementEvent(sql, source, lineage)
+
+class QueryCancelled(Exception):
+    """Raised when a statement is started after its CancelToken was cancelled."""
+    def __str__(self):
+        return "The query was cancelled"
+
+class CancelToken:
+    """
+    Lets another thread stop the statements run inside a
+    cancellable(token) block: cancel() interrupts whatever is running
+    right now (see Backend.cancel), and makes any later statement raise
+    QueryCancelled before it starts.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self.lock = threading.Lock()
+        # Maps each connection in use inside the block to its
+        # Backend.cancel_handle
+        self.handles = {}
+
+    def attach(self, connection):
+        with self.lock:
+            if self.cancelled:
+                raise QueryCancelled()
+            self.handles[connection] = get_backend().cancel_handle(connection)
+
+    def detach(self, connection):
+        # Blocks while cancel() is interrupting connection
+        with self.lock:
+            self.handles.pop(connection, None)
+
+    def cancel(self):
+        # The interrupts go out with the lock held: detach() waits for it,
+        # and a connection only goes back to the pool after detach(), so
+        # none of them can land on someone else's statement.
+        with self.lock:
+            self.cancelled = True
+            for handle in self.handles.values():
+                get_backend().cancel(handle)
+
+@contextmanager
+def cancellable(token):
+    """Runs a with block's statements so that token.cancel() stops them."""
+    previous = current_cancel_token()
+    statement_context.cancel_token = token
+    try:
+        yield token
+    finally:
+        statement_context.cancel_token = previous
+
+def current_cancel_token():
+    return getattr(statement_context, 'cancel_token', None)
+
+def run_sql(sql, params = None, read = None):
+    """
+    Sends a pure SQL expression to the DB and returns a BufferedCursor.
     May raise an error, which it intentionally does not handle.
 
+    If params is given, sql should have a %s placeholder for each of
+    them, and the DB driver quotes and fills them in (whatever placeholder
+    style the backend actually uses).
+
+    The rows are read while the statement's connection is still checked
+    out, by calling read with the executed cursor; whatever it returns
+    becomes the BufferedCursor's rows. By default that's a list of every
+    row, but e.g. show() reads straight into a ResultRows, and only as
+    many rows as it wants, rather than copying them all first.
+
+    The statement runs on its own pooled connection, so it's safe to call
+    this from several threads at once. If the connection turns out to be
+    stale, we reconnect and try once more -- but only if the statement
+    is a read (see is_read_statement), or never got as far as the server,
+    since a write may have happened before the connection died.
+
     After running this, use the returned cursor object to run
     cursor.fetchone() or cursor.fetchall() to fetch results.
     """
-    global db, cursor
-
-    if db is None:
-        # Not yet set, do so
+    sql = with_semicolon(sql)
+    if read is None:
+        read = fetch_all
+    # Set once sql has been handed to the driver
+    progress = {'sent': False}
+    try:
+        return _run_sql_once(sql, params, read, progress)
+    except Exception as e:
+        if is_stale_connection_error(e) and (not progress['sent'] or is_read_statement(sql)):
+            # checkout_connection already threw the dead connection
+            # away, so this gets a fresh one.
+            return _run_sql_once(sql, params, read, {'sent': False})
+        raise
 
+def _run_sql_once(sql, params, read, progress):
+    db_backend = get_backend()
+    event = start_event(sql, 'db')
+    with checkout_connection() as connection:
+        cursor = db_backend.cursor(connection)
         try:
-            db = MySQLdb.connect(host = config.db_host,
-                    user = config.db_user,
-                    passwd = config.db_password,
-                    db = config.db_name)
-        except MySQLdb.MySQLError as e:
-            raise QuestConnectionError(config.db_host,
-                    config.db_user,
-                    config.db_password,
-                    config.db_name)
-        cursor = db.cursor()
-    try:
-        if not sql.endswith(';'):
-            # We need a semicolon or pure SQL won't work
-            sql += ';'
+            try:
+                progress['sent'] = True
+                execute(cursor, sql, params)
+                if event is not None:
+                    event.executed()
+                fetch_started = time.time()
+                buffered = BufferedCursor(cursor, db_backend.info(connection), read(cursor))
+                if event is not None:
+                    event.fetched(buffered.rows, time.time() - fetch_started)
+            except Exception as e:
+                if event is not None:
+                    event.finished(e)
+                raise
+            if event is not None:
+                event.finished()
+            return buffered
+        finally:
+            cursor.close()
+
+def fetch_all(cursor):
+    """run_sql's default read function: a list of every row, if any."""
+    if cursor.description is None:
+        # Not a SELECT, nothing to fetch
+        return ()
+    return cursor.fetchall()
+
+# Statements that only read, so running one twice is harmless
+rReadStatement = re.compile(r"^[\s(]*(select|show|describe|desc|explain|with)\b", re.I)
+
+def is_read_statement(sql):
+    """
+    True if sql only reads (e.g. a SELECT), so it's safe to run it again
+    after its connection died. Anything we're not sure about counts as a
+    write.
+    """
+    return rReadStatement.match(sql) is not None and not written_tables(sql)
+
+def execute(cursor, sql, params = None):
+    """Executes sql on cursor, translating %s placeholders for the backend."""
+    sql, params = get_backend().prepare(sql, params)
+    if params is None:
         cursor.execute(sql)
-        return cursor
-    except Exception as e:
-        # Re-raise the error
-        raise e
+    else:
+        cursor.execute(sql, params)
 
-def show(query, number_of_rows = None):
-    """Actually sends the given query to the database and returns the resulting
-    rows as a list. A wrapper around run_sql.
+rWhitespace = re.compile(r"\s+")
+# Matches a trailing "LIMIT 10", "LIMIT 5, 10" or "LIMIT 10 OFFSET 5"
+rTrailingLimit = re.compile(r"\s+limit\s+\d+(?:\s*,\s*\d+)?(?:\s+offset\s+\d+)?\s*;?\s*$", re.I)
+
+def describe(sql):
+    """
+    Returns the column metadata for sql without fetching (more than one
+    of) its rows: a list of (column_name, python_type) tuples, one per
+    column in sql's result. python_type is None if we can't tell the
+    column's type.
+
+    This sends sql with a small LIMIT tacked on (LIMIT 0 for MySQL, which
+    answers it from the query plan alone), so it's cheap even on huge
+    tables.
+    """
+    sql = rTrailingLimit.sub('', sql.strip().rstrip(';'))
+    db_backend = get_backend()
+    with checkout_connection() as connection:
+        cursor = db_backend.cursor(connection)
+        try:
+            execute(cursor, with_semicolon(db_backend.describe_sql(sql)))
+            return db_backend.column_types(cursor)
+        finally:
+            cursor.close()
+
+def full_scans(sql):
+    """
+    Asks the DB how it would run sql (without running it), and returns a
+    set of the (lowercased) names of the tables it would read every row
+    of.
+    """
+    sql = sql.strip().rstrip(';')
+    db_backend = get_backend()
+    with checkout_connection() as connection:
+        cursor = db_backend.cursor(connection)
+        try:
+            execute(cursor, with_semicolon(db_backend.explain_sql(sql)))
+            return db_backend.full_scans(cursor)
+        finally:
+            cursor.close()
+
+def rows_to_fetch(number_of_rows = None):
+    """
+    Works out how many rows show() and stream() should fetch. Returns an
+    int, or None to fetch every row.
     If number_of_rows is None, then it checks config settings. For more
     information, see the documentation in the config module.
     """
-    if query is None:
-        raise ValueError("query cannot be None!")
-
-    run_sql(query)
-    # Fetch the correct number of rows
-    if number_of_rows is None:
+    if number_of_rows == config.ALL_ROWS:
+        return None
+    elif number_of_rows is None:
         # Nothing specified, consult config.
         if config.ROWS_TO_SHOW == config.ALL_ROWS:
-            return cursor.fetchall()
+            return None
         else:
             if util.is_integer(config.ROWS_TO_SHOW):
-                fetched_rows = cursor.fetchmany(config.ROWS_TO_SHOW)
-                return fetched_rows
+                return int(config.ROWS_TO_SHOW)
             else:
-                raise ValueError("number_of_rows (%d) is not an int!" % number_of_rows)
+                raise ValueError("number_of_rows (%s) is not an int!" % config.ROWS_TO_SHOW)
     else:
         if util.is_integer(number_of_rows):
-            fetched_rows = cursor.fetchmany(int(number_of_rows))
-            return fetched_rows
+            return int(number_of_rows)
+        else:
+            raise ValueError("number_of_rows (%s) is not an int!" % number_of_rows)
+
+# ResultRows stores columns of ints and floats compactly: as NumPy arrays if
+# NumPy is installed, and as array.array ones otherwise.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The array.array typecode for columns holding only values of these types
+ARRAY_TYPECODES = {int: 'l', long: 'l', float: 'd'}
+# How many rows show() fetches from the cursor at a time while it builds
+# the columns
+FETCH_BATCH_SIZE = 10000
+
+class Column:
+    """
+    One column of a ResultRows. values is an array (with a 0 standing in
+    for each NULL, which nulls marks) if every value is an int, long or
+    float, and a plain list otherwise.
+    """
+
+    def __init__(self, values):
+        self.nulls = None
+        # The type array values are turned back into, or None for a list
+        self.python_type = None
+        types = set([type(value) for value in values if value is not None])
+        if len(types) == 1 and list(types)[0] in ARRAY_TYPECODES:
+            python_type = list(types)[0]
+            filled = values
+            if None in values:
+                filled = [python_type() if value is None else value for value in values]
+            try:
+                if numpy is not None:
+                    self.values = numpy.array(filled, dtype = (python_type is float) and numpy.float64 or numpy.int64)
+                else:
+                    self.values = array.array(ARRAY_TYPECODES[python_type], filled)
+            except OverflowError:
+                # A long too big for 64 bits
+                pass
+            else:
+                self.python_type = python_type
+                if filled is not values:
+                    self.nulls = bytearray([value is None for value in values])
+                return
+        self.values = list(values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if self.nulls is not None and self.nulls[index]:
+            return None
+        if self.python_type is None:
+            return self.values[index]
+        return self.python_type(self.values[index])
+
+    def to_list(self):
+        """This column's values, as a list of Python values."""
+        if self.python_type is None:
+            return list(self.values)
+        # Both kinds of array have tolist()
+        values = self.values.tolist()
+        if self.python_type is long:
+            values = [long(value) for value in values]
+        if self.nulls is not None:
+            values = [None if null else value for value, null in zip(values, self.nulls)]
+        return values
+
+    def take(self, indexes):
+        """A Column of the values at indexes (a list of ints), in order."""
+        column = Column([])
+        column.python_type = self.python_type
+        if self.nulls is None:
+            column.nulls = None
+        else:
+            column.nulls = bytearray([self.nulls[index] for index in indexes])
+        if self.python_type is not None and numpy is not None:
+            column.values = self.values[numpy.array(indexes, dtype = numpy.intp)]
+        elif self.python_type is not None:
+            column.values = array.array(self.values.typecode, [self.values[index] for index in indexes])
+        else:
+            column.values = [self.values[index] for index in indexes]
+        return column
+
+    def sort_indexes(self, descending = False):
+        """
+        The row indexes in order of this column's values, like ORDER BY:
+        NULLs come first (last if descending), and ties keep their order.
+        """
+        if self.python_type is not None and numpy is not None and self.nulls is None:
+            if descending:
+                return numpy.argsort(-self.values, kind = 'mergesort').tolist()
+            return numpy.argsort(self.values, kind = 'mergesort').tolist()
+        values = self.to_list()
+        # (False, ...) sorts before (True, ...), so NULLs go first
+        keys = [(value is not None, value) for value in values]
+        return sorted(range(len(values)), key = keys.__getitem__, reverse = descending)
+
+    def minimum(self):
+        """The smallest non-NULL value, or None if there aren't any."""
+        return self.extreme(min)
+
+    def maximum(self):
+        """The largest non-NULL value, or None if there aren't any."""
+        return self.extreme(max)
+
+    def extreme(self, function):
+        """function (min or max) of the non-NULL values."""
+        if self.python_type is not None and self.nulls is None:
+            if len(self.values) == 0:
+                return None
+            if numpy is not None:
+                # numpy's own min/max, rather than a Python loop
+                return self.python_type(getattr(self.values, function.__name__)())
+            return self.python_type(function(self.values))
+        values = [value for value in self.to_list() if value is not None]
+        if not values:
+            return None
+        return function(values)
+
+class ResultRows(object):
+    """
+    The rows show() returns, stored column by column (see Column), along
+    with the columns' description (in DB-API cursor.description form).
+    Ints and floats are kept in arrays instead of one Python object per
+    value, and there's no tuple per row, so a big result takes a fraction
+    of the memory a list of row tuples would.
+
+    It still acts like a list of row tuples: rows[i], iterating, slicing,
+    len(), == and str() all work as before, building each row tuple only
+    when it's asked for.
+    """
+
+    def __init__(self, rows = (), description = None, columns = None):
+        self.description = description
+        if columns is None:
+            rows = list(rows)
+            if rows:
+                width = len(rows[0])
+            elif description is not None:
+                width = len(description)
+            else:
+                width = 0
+            columns = [Column(values) for values in zip(*rows)] or [Column([]) for index in range(width)]
+        self.columns = columns
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(self.columns[0])
+
+    def __iter__(self):
+        if not self.columns:
+            return iter([])
+        return itertools.izip(*[column.to_list() for column in self.columns])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(range(*index.indices(len(self))))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ResultRows index out of range")
+        return tuple([column[index] for column in self.columns])
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def column_names(self):
+        if self.description is None:
+            return []
+        return [column[0] for column in self.description]
+
+    def column(self, index):
+        """The values of the index'th column, as a list."""
+        return self.columns[index].to_list()
+
+    def take(self, indexes):
+        """A ResultRows of the rows at indexes (a list of ints), in order."""
+        return ResultRows(description = self.description,
+                columns = [column.take(indexes) for column in self.columns])
+
+    def sorted_by(self, index, descending = False):
+        """These rows sorted by the index'th column (see Column.sort_indexes)."""
+        if not self.columns:
+            return self
+        return self.take(self.columns[index].sort_indexes(descending))
+
+def fetch_result_rows(cursor, limit = None):
+    """
+    Reads cursor's rows (at most limit of them, if limit isn't None) into
+    a ResultRows, a batch at a time. show() hands this to run_sql as its
+    read function, so the rows come straight from the DB's cursor and
+    there's never a tuple per row of the whole result in memory (unless
+    the driver itself buffers them, like MySQLdb's default cursor).
+    """
+    values = None
+    remaining = limit
+    while remaining is None or remaining > 0:
+        if remaining is None:
+            batch = cursor.fetchmany(FETCH_BATCH_SIZE)
+        else:
+            batch = cursor.fetchmany(min(FETCH_BATCH_SIZE, remaining))
+            remaining -= len(batch)
+        if not batch:
+            break
+        if values is None:
+            values = [[] for value in batch[0]]
+        for column_values, batch_values in zip(values, zip(*batch)):
+            column_values.extend(batch_values)
+    if values is None:
+        return ResultRows((), cursor.description)
+    return ResultRows(description = cursor.description,
+            columns = [Column(column_values) for column_values in values])
+
+def describe_columns(column_names):
+    """A cursor.description for rows we made up ourselves."""
+    return tuple([(name, None, None, None, None, None, None) for name in column_names])
+
+def show(query, number_of_rows = None):
+    """Actually sends the given query to the database and returns the resulting
+    rows as a ResultRows list. A wrapper around run_sql.
+    If number_of_rows is None, then it checks config settings. For more
+    information, see the documentation in the config module.
+
+    If config.RESULT_CACHE_ENABLED is True, an identical query (with the
+    same number of rows) that ran recently is answered from result_cache
+    without going to the DB.
+    """
+    if query is None:
+        raise ValueError("query cannot be None!")
+
+    limit = rows_to_fetch(number_of_rows)
+    cached_rows = cached_result(query, limit)
+    if cached_rows is not None:
+        return cached_rows
+
+    rows = run_sql(query, read = lambda cursor: fetch_result_rows(cursor, limit)).rows
+
+    if config.RESULT_CACHE_ENABLED:
+        get_result_cache().store(query, limit, rows)
+    return rows
+
+def cached_result(query, limit):
+    """
+    The rows show() would return for query and limit (see rows_to_fetch)
+    if config.RESULT_CACHE_ENABLED is True and they're in result_cache,
+    otherwise None.
+    """
+    if not config.RESULT_CACHE_ENABLED:
+        return None
+    event = start_event(query, 'cache')
+    cached_rows = get_result_cache().lookup(query, limit)
+    if cached_rows is not None and event is not None:
+        event.executed()
+        event.rows = len(cached_rows)
+        event.finished()
+    return cached_rows
+
+# Matches a string literal, so normalize_sql can leave it alone
+rStringLiteral = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")""")
+# The pieces of a statement referenced_tables looks at: (possibly
+# qualified) names, parentheses and commas
+rTableToken = re.compile(r"[\w.]+|[(),;]")
+# Words after which the next name is a table
+TABLE_KEYWORDS = set(['from', 'join', 'update', 'into', 'table'])
+# Words that end a FROM list
+AFTER_FROM_KEYWORDS = set(['where', 'group', 'having', 'order', 'limit',
+    'union', 'set', 'values', 'select', 'procedure', 'for'])
+# Matches the name of a table a statement writes to
+rWrittenTable = re.compile(r"\b(?:update|into|table|delete\s+from)\s+`?(\w+)`?", re.I)
+
+def normalize_sql(sql):
+    """
+    Returns sql with runs of whitespace collapsed, everything outside of
+    string literals lowercased and any trailing semicolon removed, so that
+    trivially different spellings of a statement compare equal.
+    """
+    pieces = rStringLiteral.split(sql.strip().rstrip(';').strip())
+    # split() puts the literals at the odd indexes
+    for index in range(0, len(pieces), 2):
+        pieces[index] = rWhitespace.sub(' ', pieces[index]).lower()
+    return ''.join(pieces)
+
+def referenced_tables(sql):
+    """
+    Returns a set of the (lowercased) names of the tables sql reads from or
+    writes to. The set is empty if we couldn't find any.
+
+    Every table in a FROM list counts, e.g. both of FROM players, teams,
+    as do tables in subqueries and JOINs.
+    """
+    tokens = rTableToken.findall(rStringLiteral.sub("''", sql).replace('`', '').lower())
+    tables = set()
+    # in_from_list[depth] is True while we're in a FROM list at that depth
+    # of parentheses
+    in_from_list = [False]
+    expect_table = False
+    for token in tokens:
+        if token == '(':
+            in_from_list.append(False)
+            expect_table = False
+        elif token == ')':
+            if len(in_from_list) > 1:
+                in_from_list.pop()
+            expect_table = False
+        elif token == ',':
+            expect_table = in_from_list[-1]
+        elif token in TABLE_KEYWORDS:
+            expect_table = True
+            if token == 'from':
+                in_from_list[-1] = True
+        elif token in AFTER_FROM_KEYWORDS or token == ';':
+            in_from_list[-1] = False
+            expect_table = False
+        elif expect_table:
+            # db.table is the table
+            tables.add(token.split('.')[-1])
+            expect_table = False
+    return tables
+
+def written_tables(sql):
+    """
+    Like referenced_tables, but only the tables sql writes to (e.g. not
+    the ones an INSERT ... SELECT reads from).
+    """
+    return set([name.lower() for name in rWrittenTable.findall(rStringLiteral.sub("''", sql))])
+
+class ResultCache:
+    """
+    Remembers the rows show() fetched, keyed by normalized SQL and row
+    limit. Holds at most max_size results, and forgets each one after ttl
+    seconds (None keeps them until they're evicted). Results are also
+    thrown away when a statement writes to a table they read from (see
+    invalidate_statement).
+    """
+
+    def __init__(self, max_size, ttl = None):
+        self.ttl = ttl
+        # Maps (normalized sql, limit) to (rows, time stored, set of tables)
+        self.results = util.LRUCache(max_size)
+
+    def lookup(self, sql, limit):
+        """Returns the cached rows for sql and limit, or None."""
+        key = (normalize_sql(sql), limit)
+        entry = self.results.get(key)
+        if entry is None:
+            return None
+        rows, stored_at, tables = entry
+        if self.ttl is not None and time.time() - stored_at > self.ttl:
+            self.results.delete(key)
+            return None
+        return rows
+
+    def store(self, sql, limit, rows):
+        key = (normalize_sql(sql), limit)
+        self.results.put(key, (rows, time.time(), referenced_tables(sql)))
+
+    def invalidate_tables(self, tables):
+        """Forgets every result that read from any of the given tables."""
+        tables = set([table.lower() for table in tables])
+        for key in self.results.keys():
+            entry = self.results.peek(key)
+            if entry is not None and (entry[2] & tables or not entry[2]):
+                self.results.delete(key)
+
+    def invalidate_statement(self, sql):
+        """
+        Forgets every result that could have been changed by running sql.
+        If we can't tell which tables sql touches, forgets everything.
+        """
+        tables = referenced_tables(sql)
+        if tables:
+            self.invalidate_tables(tables)
         else:
-            raise ValueError("number_of_rows (%d) is not an int!" % number_of_rows)
+            self.clear()
+
+    def clear(self):
+        self.results.clear()
+
+# result_cache is created the first time it's needed, like pool
+result_cache = None
+
+def get_result_cache():
+    """Returns the module-wide ResultCache, creating it if need be."""
+    global result_cache
+    if result_cache is None:
+        with pool_lock:
+            if result_cache is None:
+                result_cache = ResultCache(config.RESULT_CACHE_SIZE, config.RESULT_CACHE_TTL)
+    return result_cache
+
+# Functions to call with the set of tables a data-changing statement
+# wrote to (empty if we couldn't tell which), so whatever they've derived
+# from those tables can be thrown away. See add_invalidation_listener.
+invalidation_listeners = []
+
+def add_invalidation_listener(listener):
+    """
+    Arranges for listener(tables) to be called whenever
+    invalidate_statement is. tables is a set of lowercased table names,
+    or an empty set if any table could have changed.
+    """
+    if listener not in invalidation_listeners:
+        invalidation_listeners.append(listener)
+
+def invalidate_statement(sql):
+    """
+    Call this after running a statement that changes data (UPDATE, INSERT,
+    CREATE TABLE ... SELECT), so show() doesn't serve stale cached rows.
+    """
+    if result_cache is not None:
+        result_cache.invalidate_statement(sql)
+    if invalidation_listeners:
+        tables = written_tables(sql)
+        for listener in invalidation_listeners:
+            listener(tables)
+
+class RowStream:
+    """
+    The result of stream(): an iterable over the rows of a query that
+    never holds more than batch_size of them in memory at once.
+
+    Nothing is sent to the DB until you start iterating. The rows come
+    from a server-side (unbuffered) cursor, which keeps its pooled
+    connection checked out until every row has been read. If you stop
+    early, the backend decides whether the connection can go back in the
+    pool; MySQL's is closed instead, so it doesn't have to send us the
+    rows we didn't want.
+
+    header is an optional message for printers to show before the rows
+    (input_handler uses it for the "New query: ..." text).
+
+    If every row has been read and there were at most
+    config.STREAM_KEEP_ROWS of them, each function in
+    completion_listeners is called with them (as a ResultRows), so they
+    can be cached just like show()'s.
+    """
+
+    def __init__(self, query, number_of_rows = None, batch_size = None):
+        self.query = query
+        self.limit = rows_to_fetch(number_of_rows)
+        if batch_size is None:
+            batch_size = config.STREAM_BATCH_SIZE
+        self.batch_size = batch_size
+        self.header = None
+        # Set once the query has been executed
+        self.description = None
+        # Whatever made the query, for statement events; the rows are
+        # read later, maybe outside of any statement_lineage block
+        self.lineage = current_lineage()
+        self.completion_listeners = []
+
+    def batches(self):
+        """Yields lists of at most batch_size rows each."""
+        db_backend = get_backend()
+        connection_pool = get_pool()
+        connection = connection_pool.checkout()
+        token = current_cancel_token()
+        if token is not None:
+            try:
+                token.attach(connection)
+            except Exception:
+                # Already cancelled: nothing ran, the connection is fine
+                connection_pool.checkin(connection)
+                raise
+        cursor = None
+        finished = False
+        event = start_event(self.query, 'stream', self.lineage)
+        error = None
+        # Every row read so far, until there are too many to keep
+        kept = None
+        if self.completion_listeners:
+            kept = []
+        try:
+            cursor = db_backend.streaming_cursor(connection)
+            execute(cursor, with_semicolon(self.query))
+            if event is not None:
+                event.executed()
+            self.description = cursor.description
+            remaining = self.limit
+            while remaining is None or remaining > 0:
+                fetch_started = time.time()
+                if remaining is None:
+                    batch = cursor.fetchmany(self.batch_size)
+                else:
+                    batch = cursor.fetchmany(min(self.batch_size, remaining))
+                    remaining -= len(batch)
+                if event is not None:
+                    event.fetched(batch, time.time() - fetch_started)
+                if not batch:
+                    break
+                if kept is not None:
+                    if len(kept) + len(batch) <= config.STREAM_KEEP_ROWS:
+                        kept.extend(batch)
+                    else:
+                        kept = None
+                yield batch
+            cursor.close()
+            finished = True
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if token is not None:
+                token.detach(connection)
+            if event is not None:
+                event.finished(error)
+            if finished:
+                connection_pool.checkin(connection)
+            elif cursor is not None and db_backend.abandon_streaming_cursor(connection, cursor):
+                # Either an error, or the consumer stopped early, and the
+                # backend cleaned up after it.
+                connection_pool.checkin(connection)
+            else:
+                connection_pool.discard(connection)
+        if kept is not None:
+            rows = ResultRows(kept, self.description)
+            for listener in self.completion_listeners:
+                listener(rows)
+
+    def __iter__(self):
+        for batch in self.batches():
+            for row in batch:
+                yield row
+
+    def __str__(self):
+        return "<RowStream for %s>" % self.query
+
+class KeptRowStream(RowStream):
+    """
+    A RowStream over rows we already have (e.g. from result_cache), so
+    callers that stream can skip the DB when they don't need it.
+    """
+
+    def __init__(self, query, rows, batch_size = None):
+        RowStream.__init__(self, query, config.ALL_ROWS, batch_size)
+        self.rows = rows
+        self.description = rows.description
+
+    def batches(self):
+        for start in range(0, len(self.rows), self.batch_size):
+            yield list(self.rows[start:start + self.batch_size])
+
+def stream(query, number_of_rows = None, batch_size = None):
+    """
+    Like show(), but returns a RowStream instead of a list, so memory use
+    stays flat no matter how many rows the query returns. Like show(), it
+    uses result_cache if config.RESULT_CACHE_ENABLED is True: cached rows
+    are streamed from memory, and a result small enough to keep (see
+    RowStream) is cached once it's been read.
+    """
+    if query is None:
+        raise ValueError("query cannot be None!")
+    limit = rows_to_fetch(number_of_rows)
+    cached_rows = cached_result(query, limit)
+    if cached_rows is not None:
+        return KeptRowStream(query, cached_rows, batch_size)
+    rows = RowStream(query, number_of_rows, batch_size)
+    if config.RESULT_CACHE_ENABLED:
+        rows.completion_listeners.append(lambda result: get_result_cache().store(query, limit, result))
+    return rows
@@ -4,7 +4,11 @@
 import re
 
 import quest.engine
-from quest.query import query_cache
+import quest.stats
+import quest.query.advisor
+import quest.query.prefetch
+import quest.query.shifter
+from quest.session import default_session
 import quest.config as config
 
 # Returned by handle() when user indicated they want to quit
@@ -13,7 +17,7 @@ QUIT = "quit"
 rSql = re.compile(r"^(select|update|insert) .+", re.IGNORECASE)
 
 # Quest-specific operators
-rQuestOperator = r"\.(rollup|drilldown|store|relax|narrow|relate|show|rshift|lshift)"
+rQuestOperator = r"\.(rollup|drilldown|store|relax|narrow|relate|show|rshift|lshift|shift)"
 rInitialize = re.compile(r"initialize\(\s*(.+?)\s*,\s*(.+)\s*\)", re.IGNORECASE)
 # A query variable has to be word characters, so "my_query_variable" works
 # but "so awesome!!" doesn't. The query variable is optional; if the user
@@ -55,16 +59,46 @@ def help():
     \t[Q.]relate(other_query): Perform a natural join with other_query
     \t[Q.]store(table_name): Store the result of running Q in a table with the given name.
     \t[Q.]show(): Actually send the query Q to the database and print the result.
+    \t[Q.]rshift(attr[, n]): shift the range of attr in Q up (n steps, default 1)
+    \t[Q.]lshift(attr[, n]): shift the range of attr in Q down (n steps, default 1)
+    \t[Q.]shift(attr1+n, attr2-m, ...): shift several attributes of Q at once
+    \tstats: how long recent statements took, and which operators made them. stats(clear) forgets them.
+    \tadvise: indexes that would stop shifts, narrows and rollups scanning whole tables. advise(create) creates them.
     """.strip()
 
-def handle(user_input):
-    """Handle user input."""
+def handle(user_input, session = None, stream = None):
+    """
+    Handle user input. session is the quest.session.Session whose query
+    variables the input works with; if it's None, the REPL's
+    default_session is used. If stream is True (False), results are
+    (aren't) returned as a quest.engine.RowStream; if it's None,
+    config.STREAM_RESULTS decides.
+    """
+    if session is None:
+        session = default_session
+    # Prefetching (see quest.query.prefetch) is per session
+    with quest.query.prefetch.for_session(session):
+        return handle_in_session(user_input, session, stream)
+
+def handle_in_session(user_input, session, stream):
+    """handle(), once session has been worked out."""
     # Change '"I am some text"' to 'I am some text'
     user_input = rBeginOrEndQuotes.sub('', user_input).strip()
     quit_words = ["exit", "exit()", "quit", "quit()"]
     help_words = ["help", "help()"]
+    stats_words = ["stats", "stats()"]
+    advise_words = ["advise", "advise()"]
     if user_input.lower() in help_words:
         return help()
+    elif user_input.lower() in stats_words:
+        return quest.stats.summary()
+    elif user_input.lower() == "stats(clear)":
+        quest.stats.clear()
+        return "Forgot every statement's stats."
+    elif user_input.lower() in advise_words:
+        return quest.query.advisor.advise()
+    elif user_input.lower() == "advise(create)":
+        return quest.query.advisor.advise(True)
     elif user_input.lower() in quit_words:
         return QUIT
     elif user_input == "":
@@ -79,12 +113,20 @@ def handle(user_input):
         if sql_match:
             # user_input is pure SQL
             #print "** SQL DETECTED **"
+            if should_stream_results(stream) and sql_match.group(1).lower() == "select":
+                # Don't pull the whole result into memory, let the
+                # caller print it a batch at a time.
+                return quest.engine.stream(user_input, config.ALL_ROWS)
             try:
                 cursor = quest.engine.run_sql(user_input)
             except Exception as e:
                 # Re-raise exception
                 raise e
 
+            if sql_match.group(1).lower() in ("update", "insert"):
+                # Cached results of SHOW may be out of date now
+                quest.engine.invalidate_statement(user_input)
+
             # rowcount is -1 or None if no query was run or number
             # of rows can't be determined
             if cursor.rowcount and cursor.rowcount > 0:
@@ -100,13 +142,13 @@ def handle(user_input):
             # `INITIALIZE("Q", "SELECT * FROM table")`
             query_variable = rBeginOrEndQuotes.sub('', initialize_match.group(1))
             sql = rBeginOrEndQuotes.sub('', initialize_match.group(2))
-            query_cache.put(query_variable, sql)
+            session.query_cache.put(query_variable, sql)
             return "Initialized %s to %s" % (query_variable, sql)
         elif bare_variable_match:
             # User entered just a Quest variable, sans operator
             user_query_variable = bare_variable_match.group(1)
             try:
-                query_key, query = extract_query_key_and_query(user_query_variable)
+                query_key, query = extract_query_key_and_query(user_query_variable, session)
                 return str(query)
             except Exception as e:
                 return str(e)
@@ -118,12 +160,12 @@ def handle(user_input):
 
             # Initialize to None in case we fail to set a valid +query+ below
             query = None
-            # a key in query_cache.cache that is associated with a
+            # a key in session.query_cache that is associated with a
             # Query instance
             query_key = None
 
             try:
-                query_key, query = extract_query_key_and_query(user_query_variable)
+                query_key, query = extract_query_key_and_query(user_query_variable, session)
             except Exception as e:
                 return str(e)
 
@@ -144,12 +186,15 @@ def handle(user_input):
                     if quest_operator.lower() == "show":
                         # Special handling because show can take 0 arguments
                         arguments = quest_command_match.group(3)
+                        show = query.show
+                        if should_stream_results(stream):
+                            show = query.stream
                         if arguments is None:
-                            return query.show()
+                            return show()
                         else:
                             arguments = [rBeginOrEndQuotes.sub('', str(arg).strip()) for arg in arguments.split(',')]
                             # Only take the first argument
-                            return query.show(arguments[0])
+                            return show(arguments[0])
                     else:
                         arguments = quest_command_match.group(3)
                         if arguments is None:
@@ -165,7 +210,10 @@ def handle(user_input):
                                 query_function = getattr(query, quest_operator.lower())
                             except TypeError as te:
                                 raise te
-                            new_query = query_function(*arguments)
+                            try:
+                                new_query = query_function(*arguments)
+                            except quest.query.shifter.EndOfDataException as e:
+                                return str(e)
                             returned_string = ""
                             if quest_operator.lower() == 'store':
                                 # Don't save the query
@@ -174,9 +222,13 @@ def handle(user_input):
                                 returned_string += "New query: %s" % new_query
                                 # Give the new query a unique name and put it in the
                                 # query cache.
-                                key, query = query_cache.put(None, new_query)
+                                key, query = session.query_cache.put(None, new_query)
                                 returned_string += "\n** New query put in cache as %s" % key
                                 if should_show_query():
+                                    if should_stream_results(stream):
+                                        rows = new_query.stream()
+                                        rows.header = returned_string
+                                        return rows
                                     rows = new_query.show()
                                     returned_string += "\n" + str(rows)
                             return returned_string
@@ -192,25 +244,37 @@ def should_show_query():
     """
     return config.ALWAYS_SHOW is True
 
-def extract_query_key_and_query(variable):
+def should_stream_results(stream = None):
+    """
+    Returns True if Quest is configured to stream results a batch at a
+    time (see config.STREAM_RESULTS), False otherwise. stream overrides
+    the config setting, unless it's None.
+    """
+    if stream is not None:
+        return stream
+    return config.STREAM_RESULTS is True
+
+def extract_query_key_and_query(variable, session = None):
     """
     Given a variable like "Q", get the query key ("Q") and the
-    associated query instance from the cache. If variable is None, then
-    gets the most recent query and its key from the cache.
+    associated query instance from the session's cache. If variable is
+    None, then gets the most recent query and its key from the cache.
 
     Returns a tuple of (key, query_instance), or raises an Exception.
     """
+    if session is None:
+        session = default_session
 
     if variable is None:
         # No query variable specified, so use most recent query
-        query_key, query = query_cache.most_recent_key_and_query
+        query_key, query = session.most_recent_key_and_query()
         return (query_key, query)
     else:
         # User is calling an operator on a specific query.
         # Try to look up the query in the query cache.
         query_key = variable
         try:
-            query = query_cache.get(query_key)
+            query = session.query_cache.get(query_key)
             return (query_key, query)
         except KeyError:
             # User is trying to use a non-initialized
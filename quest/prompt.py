@@ -4,6 +4,7 @@ import os
 import re
 
 from quest import input_handler
+from quest.engine import RowStream
 
 class Prompt:
     """
@@ -43,11 +44,27 @@ class Prompt:
                 # Catch everything
                 print e
             else:
-                if handle_value != input_handler.QUIT:
+                if isinstance(handle_value, RowStream):
+                    self.print_stream(handle_value)
+                elif handle_value != input_handler.QUIT:
                     print handle_value
 
         print "Bye!"
 
+    def print_stream(self, row_stream):
+        """
+        Prints a RowStream one batch at a time, so we never hold more than
+        one batch of rows in memory.
+        """
+        if row_stream.header:
+            print row_stream.header
+        try:
+            for batch in row_stream.batches():
+                for row in batch:
+                    print row
+        except Exception as e:
+            print e
+
     def get_input(self, prompt):
         """Prompts for user input using given prompt string and returns input."""
         text = raw_input(prompt)
@@ -0,0 +1,184 @@
+# Index advice for the columns people shift, narrow and roll up on.
+#
+# Every RSHIFT/LSHIFT/SHIFT, NARROW and ROLLUP of a query on a single
+# table tells us which of its columns the DB will have to find rows by
+# (the shifted ranges, the narrowing predicate) or group rows by. When
+# config.INDEX_ADVISOR_ENABLED is True, Query's operators note() those
+# columns here, along with the statement they made.
+#
+# Nothing is sent to the DB until advise() (the "advise" command). It
+# EXPLAINs the latest statement for each set of columns, most used first,
+# and recommends an index (a composite one, if there are several columns)
+# wherever the DB would scan the whole table. advise(True) creates them.
+#
+# If config.INDEX_ADVISOR_CREATE is True, a set of columns is checked as
+# soon as it's been used config.INDEX_ADVISOR_THRESHOLD times, and its
+# index is created then and there if the DB would scan the whole table.
+
+import hashlib
+import sys
+import threading
+
+import quest.engine
+import quest.config as config
+import statement
+import summaries
+
+# Maps (lowercased table, tuple of lowercased columns) to a Usage
+usages = {}
+# Keys of usages whose index we've created
+created = set()
+lock = threading.Lock()
+
+class Usage:
+    """One set of columns of a table, and how often operators used it."""
+
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = columns
+        self.count = 0
+        # Maps operator name (e.g. "narrow") to how many times it used them
+        self.operators = {}
+        # The most recent statement that used them
+        self.sql = None
+
+    def describe_operators(self):
+        """e.g. "narrow x4, rshift x2"."""
+        by_use = sorted(self.operators.items(), key = lambda item: (-item[1], item[0]))
+        return ", ".join(["%s x%d" % (operator, count) for operator, count in by_use])
+
+def predicate_columns(clause):
+    """
+    The words in a NARROW clause that could be column names, in order.
+    Function names and the like get through too; recommendations() only
+    keeps real columns.
+    """
+    columns = []
+    for word in summaries.rWord.findall(clause):
+        if word[0] in "'\"" or word.lower() in summaries.SQL_WORDS or '.' in word:
+            continue
+        columns.append(word)
+    return columns
+
+def note(query, operator, columns):
+    """Records that operator made query by finding or grouping rows by columns."""
+    if not config.INDEX_ADVISOR_ENABLED or query.parsed is None:
+        return
+    table = query.parsed.from_clause.strip()
+    if not statement.rColumn.match(table):
+        # A join or subquery; we can't tell which table a column is in
+        return
+    unique_columns = []
+    for column in columns:
+        if statement.rColumn.match(column) and column.lower() not in [seen.lower() for seen in unique_columns]:
+            unique_columns.append(column)
+    if not unique_columns:
+        return
+    key = (table.lower(), tuple([column.lower() for column in unique_columns]))
+    with lock:
+        usage = usages.get(key)
+        if usage is None:
+            usage = usages[key] = Usage(table, tuple(unique_columns))
+        usage.count += 1
+        usage.operators[operator] = usage.operators.get(operator, 0) + 1
+        usage.sql = query.statement
+        check_now = (config.INDEX_ADVISOR_CREATE and key not in created
+                and usage.count == config.INDEX_ADVISOR_THRESHOLD)
+    if check_now:
+        try:
+            for recommendation in recommendations([usage]):
+                create(recommendation)
+        except quest.engine.get_backend().Error as e:
+            # Advice is optional; the user's query isn't
+            sys.stderr.write("Couldn't create an index on %s (%s): %s\n" % (table, ", ".join(unique_columns), e))
+
+class Recommendation:
+    """An index that would save the DB a full table scan."""
+
+    def __init__(self, usage, columns):
+        self.usage = usage
+        self.table = usage.table
+        self.columns = columns
+
+    def key(self):
+        return (self.table.lower(), tuple([column.lower() for column in self.columns]))
+
+    def index_name(self):
+        name = "quest_idx_%s_%s" % (self.table, "_".join(self.columns))
+        # MySQL allows at most 64 characters
+        if len(name) > 64:
+            name = "quest_idx_%s" % hashlib.md5(name).hexdigest()[:16]
+        return name
+
+    def sql(self):
+        return "CREATE INDEX %s ON %s (%s)" % (self.index_name(), self.table, ", ".join(self.columns))
+
+    def __str__(self):
+        return "%s;  -- %s; full scan of %s" % (self.sql(), self.usage.describe_operators(), self.table)
+
+def recommendations(chosen_usages = None):
+    """
+    Returns a Recommendation for each usage (by default every one, most
+    used first) whose statement makes the DB scan its whole table.
+    """
+    if chosen_usages is None:
+        with lock:
+            chosen_usages = sorted(usages.values(), key = lambda usage: -usage.count)
+    db_backend = quest.engine.get_backend()
+    # Maps lowercased table name to its lowercased column names
+    table_columns = {}
+    recommended = []
+    seen = set()
+    for usage in chosen_usages:
+        table = usage.table.lower()
+        try:
+            if table not in table_columns:
+                table_columns[table] = set([name.lower() for name, python_type in quest.engine.describe("SELECT * FROM %s" % usage.table)])
+            columns = tuple([column for column in usage.columns if column.lower() in table_columns[table]])
+            if not columns:
+                continue
+            recommendation = Recommendation(usage, columns)
+            if recommendation.key() in seen or recommendation.key() in created:
+                continue
+            if table not in quest.engine.full_scans(usage.sql):
+                continue
+        except db_backend.Error:
+            # e.g. the table's been dropped since
+            continue
+        seen.add(recommendation.key())
+        recommended.append(recommendation)
+    return recommended
+
+def create(recommendation):
+    quest.engine.run_sql(recommendation.sql())
+    with lock:
+        created.add(recommendation.key())
+        # Keyed on the usage's own columns too, so note() doesn't try again
+        created.add((recommendation.usage.table.lower(), tuple([column.lower() for column in recommendation.usage.columns])))
+
+def advise(create_indexes = False):
+    """
+    Returns the recommended indexes as text, creating them first if
+    create_indexes is True.
+    """
+    if not config.INDEX_ADVISOR_ENABLED:
+        return "The index advisor is off (see config.INDEX_ADVISOR_ENABLED)."
+    recommended = recommendations()
+    if not recommended:
+        return "No indexes to recommend."
+    lines = []
+    if create_indexes:
+        lines.append("Created:")
+        for recommendation in recommended:
+            create(recommendation)
+            lines.append("  %s" % recommendation)
+    else:
+        lines.append("Recommended (run advise(create) to create them):")
+        for recommendation in recommended:
+            lines.append("  %s" % recommendation)
+    return "\n".join(lines)
+
+def clear():
+    """Forgets every usage."""
+    with lock:
+        usages.clear()
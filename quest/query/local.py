@@ -0,0 +1,370 @@
+# Working out a query's result in memory, from its parent's.
+#
+# A Query keeps the rows of its last SHOW if it got all of them (see
+# Query.keep_result). When one of its children is shown, evaluate() tries
+# to answer it from those rows instead of going back to the DB:
+#
+#  ROLLUP: if the parent grouped by the attribute being rolled up, and
+#          every other SELECT item is a group-by column or an aggregate
+#          that can be re-aggregated (SUM, COUNT, MIN, MAX, and AVG when
+#          the parent also has SUM and COUNT of the same column), the
+#          parent's groups are merged into the coarser ones. Not when the
+#          DB compares strings case-insensitively and a GROUP BY column
+#          holds strings, though, since it would group and sort those
+#          differently (see Backend.case_insensitive_strings).
+#
+#  NARROW: if the predicate only uses columns of the parent's result (and
+#          only GROUP BY columns, for a grouped result), and
+#          quest.query.predicate can evaluate it, the parent's rows are
+#          filtered.
+#
+# Anything else returns None, and the query is sent to the DB as usual.
+#
+# Kept rows go stale when Quest changes the DB, so every write bumps
+# generation, and rows kept in an older generation are ignored.
+
+import decimal
+
+import quest.engine
+import quest.config as config
+from quest.util import LRUCache
+import statement
+import predicate
+
+# NumPy groups and re-aggregates kept columns a lot faster, but isn't
+# required
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Bumped whenever Quest changes the DB; see Query.complete_result
+generation = 0
+
+def data_changed(tables):
+    global generation
+    generation += 1
+    # Hierarchy mappings read from the tables that changed could be out of
+    # date
+    for key in hierarchy_mappings.keys():
+        from_tables = quest.engine.referenced_tables("SELECT * FROM %s" % key[0])
+        if not tables or not from_tables or from_tables & tables:
+            hierarchy_mappings.delete(key)
+
+quest.engine.add_invalidation_listener(data_changed)
+
+# Maps (FROM clause, attribute, parent attribute) to a dict of each value
+# of attribute to its parent value. See hierarchy_mapping.
+hierarchy_mappings = LRUCache(100)
+
+def evaluate(query):
+    """
+    Returns query's complete result as a quest.engine.ResultRows, worked
+    out from its parent's kept rows, or None if we can't.
+    """
+    if query.derivation is None or query.parent is None or query.parsed is None:
+        return None
+    operation = query.derivation[0]
+    if operation == 'rollup' and config.LOCAL_ROLLUP:
+        attribute, parent_attribute = query.derivation[1:]
+        return rollup(query.parent, query.parsed, attribute, parent_attribute)
+    if operation == 'narrow' and config.LOCAL_NARROW:
+        return narrow(query.parent, query.derivation[1])
+    return None
+
+def narrow(parent, clause):
+    """
+    Returns the rows of parent's kept result for which clause holds, or
+    None if we can't tell which those are without the DB.
+    """
+    rows = parent.complete_result()
+    parsed = parent.parsed
+    if rows is None or parsed is None or parsed.limit is not None:
+        return None
+    if parsed.having is not None and not parsed.group_by:
+        return None
+
+    # Which columns of a result row the predicate could use. Narrowing a
+    # grouped result drops whole groups, which is only the same as
+    # filtering the rows before grouping for GROUP BY columns. Without a
+    # GROUP BY, any aggregate makes the result a single summary row.
+    column_positions = {}
+    if parsed.select == ('*',) and not parsed.group_by:
+        names = rows.column_names()
+        for index, name in enumerate(names):
+            if names.count(name) == 1:
+                column_positions[name] = index
+    else:
+        for index, item in enumerate(parsed.select):
+            expression, alias = statement.split_alias(item)
+            if statement.rColumn.match(expression):
+                # A WHERE can't use aliases
+                if alias in (None, expression) and (not parsed.group_by or expression in parsed.group_by):
+                    column_positions.setdefault(expression, index)
+            elif not parsed.group_by:
+                return None
+
+    try:
+        test = predicate.compile_predicate(clause, column_positions)
+        kept = [index for index, row in enumerate(rows) if test(row)]
+    except predicate.CannotEvaluate:
+        return None
+    return rows.take(kept)
+
+def rollup(parent, child_parsed, attribute, parent_attribute):
+    """
+    Merges the groups of parent's kept rows, which are grouped by
+    attribute, into groups by parent_attribute. child_parsed is the
+    rolled-up statement.
+    """
+    rows = parent.complete_result()
+    parsed = parent.parsed
+    if rows is None or parsed is None:
+        return None
+    if parsed.having is not None or parsed.limit is not None or parsed.select_modifier:
+        # HAVING and LIMIT drop some of the finer groups, DISTINCT merges
+        # some of them
+        return None
+    if attribute not in parsed.group_by:
+        return None
+
+    # What each item of the SELECT list is: ('key', column name) for a
+    # GROUP BY column, ('aggregate', function, argument) otherwise
+    items = []
+    key_positions = {}
+    for index, item in enumerate(parsed.select):
+        expression, alias = statement.split_alias(item)
+        function_and_argument = statement.aggregate(expression)
+        if expression in parsed.group_by:
+            items.append(('key', expression))
+            key_positions.setdefault(expression, index)
+        elif function_and_argument is not None:
+            items.append(('aggregate',) + function_and_argument)
+        else:
+            return None
+    # We need the value of every group-by column to know which group a
+    # row goes in
+    if [column for column in parsed.group_by if column not in key_positions]:
+        return None
+
+    attribute_column = rows.columns[key_positions[attribute]]
+    if parent_attribute in parsed.group_by:
+        parent_column = rows.columns[key_positions[parent_attribute]]
+    else:
+        mapping = hierarchy_mapping(parsed.from_clause, attribute, parent_attribute)
+        if mapping is None:
+            return None
+        try:
+            parent_column = quest.engine.Column([mapping[value] for value in attribute_column.to_list()])
+        except KeyError:
+            return None
+
+    # The new value of each of the parent's key columns (only the
+    # rolled-up one changes)
+    def key_column(name):
+        if name == attribute:
+            return parent_column
+        return rows.columns[key_positions[name]]
+    key_columns = [key_column(name) for name in parsed.group_by]
+    if quest.engine.get_backend().case_insensitive_strings and [column for column in key_columns if has_strings(column)]:
+        # The DB would put e.g. 'NYA' and 'nya' in the same group (and
+        # sort them its own way), we'd put them in two
+        return None
+    groups = Groups(key_columns)
+
+    output_columns = []
+    for index, item in enumerate(items):
+        if item[0] == 'key':
+            output_columns.append(groups.first(key_column(item[1])))
+            continue
+        function, argument = item[1:]
+        if function == 'avg':
+            sum_index = find_aggregate(items, 'sum', argument)
+            count_index = find_aggregate(items, 'count', argument)
+            if sum_index is None or count_index is None:
+                return None
+            sums = groups.reaggregate('sum', rows.columns[sum_index])
+            counts = groups.reaggregate('count', rows.columns[count_index])
+            output_columns.append([average(total, count) for total, count in zip(sums, counts)])
+        else:
+            output_columns.append(groups.reaggregate(function, rows.columns[index]))
+
+    new_rows = order(zip(*output_columns), child_parsed, rows.column_names(), attribute, parent_attribute)
+    if new_rows is None:
+        return None
+    column_names = [parent_attribute if name == attribute else name for name in rows.column_names()]
+    return quest.engine.ResultRows(new_rows, quest.engine.describe_columns(column_names))
+
+def has_strings(column):
+    """True if column (a quest.engine.Column) holds any strings."""
+    if column.python_type is not None:
+        # An array of numbers
+        return False
+    for value in column.values:
+        if isinstance(value, basestring):
+            return True
+    return False
+
+def value_codes(column):
+    """
+    Numbers the distinct values of column (a quest.engine.Column) in
+    sorted order, NULL first like ORDER BY. Returns (the number of each
+    row's value, how many distinct values there are).
+    """
+    if numpy is not None and column.python_type is not None and column.nulls is None:
+        distinct, codes = numpy.unique(column.values, return_inverse = True)
+        return (codes, len(distinct))
+    values = column.to_list()
+    numbers = {}
+    for number, value in enumerate(sorted(set(values))):
+        numbers[value] = number
+    codes = [numbers[value] for value in values]
+    if numpy is not None:
+        codes = numpy.array(codes, dtype = numpy.int64)
+    return (codes, len(numbers))
+
+class Groups:
+    """
+    The groups a rollup merges the parent's rows into, given the new
+    value of each GROUP BY column (quest.engine.Columns, in key_columns).
+    Groups are numbered in the order of their keys, which is the order
+    MySQL and SQLite return a GROUP BY's rows in when there's no ORDER BY.
+
+    With NumPy, grouping and re-aggregating numeric columns are array
+    operations; without it, they're Python loops.
+    """
+
+    def __init__(self, key_columns):
+        # Each row's key, as one number: the numbers of its values,
+        # combined so that they sort like the keys themselves
+        combined = None
+        for column in key_columns:
+            codes, number_of_codes = value_codes(column)
+            if combined is None:
+                combined = codes
+            elif numpy is not None:
+                combined = combined * number_of_codes + codes
+                # Renumber, so the next column can't overflow it
+                combined = numpy.unique(combined, return_inverse = True)[1]
+            else:
+                combined = [key * number_of_codes + code for key, code in zip(combined, codes)]
+
+        if numpy is not None:
+            distinct, self.first_rows, self.ids = numpy.unique(combined, return_index = True, return_inverse = True)
+            self.count = len(distinct)
+            # The row numbers, grouped together, and where each group
+            # starts among them (see reaggregate)
+            self.grouped_rows = numpy.argsort(self.ids, kind = 'mergesort')
+            self.starts = numpy.searchsorted(self.ids[self.grouped_rows], numpy.arange(self.count))
+        else:
+            numbers = {}
+            for number, key in enumerate(sorted(set(combined))):
+                numbers[key] = number
+            self.ids = [numbers[key] for key in combined]
+            self.count = len(numbers)
+            self.first_rows = [None] * self.count
+            for row, group_id in enumerate(self.ids):
+                if self.first_rows[group_id] is None:
+                    self.first_rows[group_id] = row
+
+    def first(self, column):
+        """The value of column in the first row of each group."""
+        return column.take(self.first_rows).to_list()
+
+    def reaggregate(self, function, column):
+        """
+        Combines per-row aggregates (column, a quest.engine.Column) into
+        per-group ones, ignoring NULLs like SQL does: SUM and MIN/MAX of
+        nothing are NULL, COUNT of nothing is 0.
+        """
+        if numpy is not None and column.python_type is not None and column.nulls is None and self.count:
+            # Every group has at least one row, so reduceat never sees an
+            # empty slice
+            ufunc = {'sum': numpy.add, 'count': numpy.add, 'min': numpy.minimum, 'max': numpy.maximum}[function]
+            values = ufunc.reduceat(column.values[self.grouped_rows], self.starts).tolist()
+            if column.python_type is long:
+                values = [long(value) for value in values]
+            return values
+        return reaggregate(function, column.to_list(), self.ids, self.count)
+
+def reaggregate(function, values, group_ids, number_of_groups):
+    """Groups.reaggregate, for values (a list) without NumPy."""
+    if function == 'count':
+        result = [0] * number_of_groups
+        for value, group_id in zip(values, group_ids):
+            result[group_id] += value
+        return result
+    result = [None] * number_of_groups
+    for value, group_id in zip(values, group_ids):
+        if value is None:
+            continue
+        current = result[group_id]
+        if current is None:
+            result[group_id] = value
+        elif function == 'sum':
+            result[group_id] = current + value
+        elif function == 'min':
+            if value < current:
+                result[group_id] = value
+        elif value > current:
+            # max
+            result[group_id] = value
+    return result
+
+def find_aggregate(items, function, argument):
+    """The index in items of function(argument), or None."""
+    for index, item in enumerate(items):
+        if item[0] == 'aggregate' and item[1:] == (function, argument):
+            return index
+    return None
+
+def average(total, count):
+    if total is None or not count:
+        return None
+    if isinstance(total, decimal.Decimal):
+        # Decimal can't be divided by a float
+        return total / count
+    return total / float(count)
+
+def order(rows, parsed, column_names, attribute, parent_attribute):
+    """
+    Sorts rows (which are in group key order; see Groups) by parsed's
+    ORDER BY, if it has one. Returns None if we don't understand the
+    ORDER BY.
+    """
+    if not parsed.order_by:
+        return rows
+    column_names = [parent_attribute if name == attribute else name for name in column_names]
+    for item in reversed(parsed.order_by):
+        match = statement.rOrderItem.match(item)
+        if not match or match.group(1) not in column_names:
+            return None
+        index = column_names.index(match.group(1))
+        descending = (match.group(2) or '').lower() == 'desc'
+        # Sorts are stable, so sorting by the last key first works
+        rows = sorted(rows, key = lambda row: row[index], reverse = descending)
+    return rows
+
+def hierarchy_mapping(from_clause, attribute, parent_attribute):
+    """
+    Returns a dict mapping each value of attribute in from_clause to its
+    value of parent_attribute, or None if some value of attribute has more
+    than one parent. The mapping is cached until Quest changes a table
+    in from_clause, so this only costs a (small, DISTINCT) query the first
+    time.
+    """
+    key = (from_clause.strip().lower(), attribute, parent_attribute)
+    mapping = hierarchy_mappings.get(key)
+    if mapping is None:
+        cursor = quest.engine.run_sql("SELECT DISTINCT %s, %s FROM %s" % (attribute, parent_attribute, from_clause))
+        mapping = {}
+        for value, parent_value in cursor.fetchall():
+            if value in mapping and mapping[value] != parent_value:
+                mapping = False
+                break
+            mapping[value] = parent_value
+        hierarchy_mappings.put(key, mapping)
+    if mapping is False:
+        # Not a real hierarchy
+        return None
+    return mapping
@@ -0,0 +1,261 @@
+# Materializing derived queries as tables.
+#
+# RELATE joins its query's whole SQL as a subquery, so every SHOW of the
+# join (or of anything narrowed from it) works the subquery out again.
+# When config.MATERIALIZE_ENABLED is True, relate() first stores its
+# query's result once, in a table called quest_mat_<hash of the SQL>, with
+# an index on the columns the natural join will match on. STORE registers
+# the table it creates the same way.
+#
+# Query.executable_statement asks route() to swap any materialized query
+# that appears in a statement, as a parenthesized subquery or as the whole
+# statement, for a read from its table, e.g.
+#   SELECT * FROM (SELECT ... GROUP BY teamid) AS quest_left NATURAL INNER JOIN teams
+# runs as
+#   SELECT * FROM quest_mat_1f2e3d4c5b6a AS quest_left NATURAL INNER JOIN teams
+# Like summaries, the query itself is unchanged.
+#
+# Materializations are looked up by their SQL, so the same query reached by
+# different operators shares one table; the lineage of the query that made
+# each one is kept for describe(). A materialization is stale (and isn't
+# used) once Quest changes a table its query reads from, or the table
+# itself. Stale quest_mat_ tables are dropped the next time anything is
+# materialized, as are the least recently used ones when there are more
+# than config.MATERIALIZE_MAX_TABLES, and all of them when Quest exits.
+# Tables made by STORE belong to the user and are never dropped.
+#
+# The tables are ordinary tables rather than TEMPORARY ones: a temporary
+# table is only visible on the connection that made it, and statements
+# run on whichever pooled connection is free.
+
+import atexit
+import hashlib
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import quest.engine
+import quest.config as config
+import statement
+
+rOrderBy = re.compile(r"\border\s+by\b", re.I)
+
+# Maps normalized SQL to its Materialization, least recently used first
+materializations = OrderedDict()
+lock = threading.RLock()
+
+class Materialization:
+    """A table holding the result of one query."""
+
+    def __init__(self, name, sql, lineage, owned):
+        self.name = name
+        self.sql = sql
+        self.lineage = lineage
+        # True if we made the table (and so may drop it), False if STORE did
+        self.owned = owned
+        # The tables sql reads from
+        self.tables = quest.engine.referenced_tables(sql)
+        # Tuples of columns we've indexed
+        self.indexes = []
+        self.stale = False
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.pattern = subquery_pattern(sql)
+
+    def matches(self, text):
+        """True if text (part of another statement) is this one's SQL."""
+        return quest.engine.normalize_sql(text) == quest.engine.normalize_sql(self.sql)
+
+def subquery_pattern(sql):
+    """
+    A regexp matching sql in another statement, whitespace and case aside,
+    either in parentheses or as the whole statement.
+    """
+    words = sql.strip().rstrip(';').split()
+    body = r"\s+".join([re.escape(word) for word in words])
+    return re.compile(r"\(\s*(%s)\s*\)|^\s*(%s)\s*;?\s*$" % (body, body), re.I)
+
+def table_name(sql):
+    return "quest_mat_%s" % hashlib.md5(quest.engine.normalize_sql(sql)).hexdigest()[:12]
+
+def find(sql):
+    """The fresh Materialization of sql, or None."""
+    if not config.MATERIALIZE_ENABLED:
+        return None
+    with lock:
+        materialization = materializations.get(quest.engine.normalize_sql(sql))
+        if materialization is None or materialization.stale:
+            return None
+        return materialization
+
+def worth_materializing(query):
+    """
+    False for queries that just read a table (e.g. SELECT * FROM players),
+    where a copy wouldn't save the DB any work.
+    """
+    parsed = query.parsed
+    if parsed is None:
+        return True
+    return not (parsed.select == ('*',) and statement.rColumn.match(parsed.from_clause)
+            and parsed.where is None and not parsed.group_by and parsed.limit is None)
+
+def common_columns(left_sql, right):
+    """
+    The (indexable) columns a NATURAL JOIN of left_sql's result and right
+    (a table name, or a parenthesized subquery with an alias) matches on.
+    """
+    left_columns = [name for name, python_type in quest.engine.describe(left_sql)]
+    right_columns = [name.lower() for name, python_type in quest.engine.describe("SELECT * FROM %s" % right)]
+    return tuple([name for name in left_columns
+        if name.lower() in right_columns and statement.rColumn.match(name)])
+
+def materialize(query, index_columns = ()):
+    """
+    Returns the Materialization holding query's result, creating its table
+    if there isn't a fresh one already, and making sure index_columns are
+    indexed.
+    """
+    sql = query.statement
+    key = quest.engine.normalize_sql(sql)
+    with lock:
+        drop_stale()
+        materialization = materializations.get(key)
+        if materialization is None or materialization.stale:
+            name = table_name(sql)
+            quest.engine.run_sql("DROP TABLE IF EXISTS %s" % name)
+            # executable_statement, so it can read from other
+            # materializations (or summaries) itself
+            quest.engine.run_sql("CREATE TABLE %s AS %s" % (name, query.executable_statement().strip().rstrip(';')))
+            materialization = Materialization(name, sql, query.lineage(), True)
+            materializations[key] = materialization
+            evict()
+        else:
+            # Most recently used goes last
+            del materializations[key]
+            materializations[key] = materialization
+        materialization.last_used = time.time()
+        add_index(materialization, index_columns)
+        return materialization
+
+def add_index(materialization, columns):
+    """Indexes columns of materialization's table, if they aren't already."""
+    columns = tuple(columns)
+    if not columns or columns in materialization.indexes or not materialization.owned:
+        return
+    index_name = "%s_%d" % (materialization.name, len(materialization.indexes))
+    try:
+        quest.engine.run_sql("CREATE INDEX %s ON %s (%s)" % (index_name, materialization.name, ", ".join(columns)))
+    except quest.engine.get_backend().Error as e:
+        # e.g. MySQL can't index a TEXT column without a prefix length.
+        # The join still works, just more slowly.
+        sys.stderr.write("Couldn't index %s (%s): %s\n" % (materialization.name, ", ".join(columns), e))
+        return
+    materialization.indexes.append(columns)
+
+def register(query, name):
+    """Notes that STORE put query's result in the table called name."""
+    if not config.MATERIALIZE_ENABLED:
+        return
+    key = quest.engine.normalize_sql(query.statement)
+    with lock:
+        if key in materializations:
+            # Drops our own table, if we'd made one
+            forget(key)
+        materializations[key] = Materialization(name, query.statement, query.lineage(), False)
+
+def route(sql):
+    """
+    Returns sql with every materialized query in it read from its table
+    instead, or None if there aren't any (or materialization is off).
+    """
+    if not config.MATERIALIZE_ENABLED or not materializations:
+        return None
+    with lock:
+        routed = sql
+        # Longest first, so a subquery that contains another materialized
+        # one is replaced whole
+        candidates = sorted([materialization for materialization in materializations.values() if not materialization.stale],
+                key = lambda materialization: -len(materialization.sql))
+        for materialization in candidates:
+            match = materialization.pattern.search(routed)
+            # The pattern ignores case, which is too lenient inside strings
+            if match is None or not materialization.matches(match.group(1) or match.group(2)):
+                continue
+            if match.group(1) is None and rOrderBy.search(routed):
+                # A table doesn't keep its rows in order
+                continue
+            materialization.last_used = time.time()
+            if match.group(1) is not None:
+                replacement = materialization.name
+            else:
+                replacement = "SELECT * FROM %s" % materialization.name
+            routed = routed[:match.start()] + replacement + routed[match.end():]
+        if routed == sql:
+            return None
+        return routed
+
+def mark_stale(tables):
+    """
+    quest.engine calls this when tables changed. If tables is empty, any
+    table could have changed.
+    """
+    stale_names = set()
+    with lock:
+        for materialization in materializations.values():
+            if not tables or materialization.tables & tables or materialization.name.lower() in tables:
+                materialization.stale = True
+                stale_names.add(materialization.name.lower())
+    # Cached results were read through the old tables
+    if stale_names and quest.engine.result_cache is not None:
+        quest.engine.result_cache.invalidate_tables(stale_names)
+
+quest.engine.add_invalidation_listener(mark_stale)
+
+def drop_stale():
+    """Drops the tables of stale materializations, and forgets them."""
+    with lock:
+        for key, materialization in materializations.items():
+            if materialization.stale:
+                forget(key)
+
+def evict():
+    """Drops the least recently used tables we made, past config.MATERIALIZE_MAX_TABLES."""
+    with lock:
+        owned = [key for key, materialization in materializations.items() if materialization.owned]
+        if config.MATERIALIZE_MAX_TABLES is None:
+            return
+        for key in owned[:max(len(owned) - config.MATERIALIZE_MAX_TABLES, 0)]:
+            forget(key)
+
+def forget(key):
+    """Call with lock held."""
+    materialization = materializations.pop(key)
+    if materialization.owned:
+        quest.engine.run_sql("DROP TABLE IF EXISTS %s" % materialization.name)
+
+def drop_all():
+    """Drops every table we made, and forgets every materialization."""
+    with lock:
+        for key in materializations.keys():
+            forget(key)
+
+def drop_all_at_exit():
+    try:
+        drop_all()
+    except Exception as e:
+        # The DB may already be gone
+        sys.stderr.write("Couldn't drop materialized tables: %s\n" % e)
+
+atexit.register(drop_all_at_exit)
+
+def describe():
+    """One line per materialization: its table, state and lineage."""
+    with lock:
+        lines = []
+        for materialization in materializations.values():
+            lineage = materialization.lineage and " > ".join(materialization.lineage) or "query"
+            lines.append("%s%s (%s): %s" % (materialization.name,
+                materialization.stale and " [stale]" or "", lineage, materialization.sql))
+        return "\n".join(lines)
@@ -0,0 +1,152 @@
+# Finds the value that comes right after (or right before) a given value
+# in a column. RSHIFT/LSHIFT use this to move a string attribute to its
+# next/previous distinct value, e.g. "David" -> "Eric".
+#
+# There are two ways of doing the lookup (see config.SHIFT_NEIGHBOR_LOOKUP):
+#  NEIGHBOR_SEEK: ask the DB, e.g. SELECT MIN(col) FROM t WHERE col > 'David'.
+#                 With an index on col, that's a single B-tree seek.
+#  NEIGHBOR_MEMORY: fetch the sorted distinct values of the column once,
+#                   cache them, and bisect.
+# NEIGHBOR_MEMORY is also the fallback when we can't work out which
+# table(s) a query reads from.
+
+import re
+import bisect
+
+import quest.engine
+import quest.config as config
+
+# Captures the FROM clause of a query (i.e. the table(s) it reads from)
+rFromClause = re.compile(r"\sfrom\s+(.+?)(?:\s+(?:where|group\s+by|having|order\s+by|limit)\s|;?\s*$)", re.I | re.S)
+rWhitespace = re.compile(r"\s+")
+
+# Maps (normalized FROM clause, column) to (a sorted list of that column's
+# distinct values, the set of tables they came from), for NEIGHBOR_MEMORY
+# lookups. Entries are dropped when those tables change (see data_changed).
+distinct_values_cache = {}
+
+def from_clause(query):
+    """
+    Returns the FROM clause of query (without the "FROM"), or None if we
+    couldn't find one.
+    """
+    match = rFromClause.search(query)
+    if match:
+        return match.group(1).strip()
+    else:
+        return None
+
+def clear_cache():
+    """Forget every cached list of distinct values."""
+    distinct_values_cache.clear()
+
+def data_changed(tables):
+    """
+    quest.engine calls this when tables changed, so shifts don't step to
+    values that are gone or over ones that are new. If tables is empty,
+    any table could have changed.
+    """
+    for key, (values, from_tables) in distinct_values_cache.items():
+        if not tables or not from_tables or from_tables & tables:
+            distinct_values_cache.pop(key, None)
+
+quest.engine.add_invalidation_listener(data_changed)
+
+def next_value(query, column, value, steps = 1):
+    """
+    Returns the value of column that comes steps distinct values after
+    value (by default, the smallest value greater than value). If there
+    aren't that many, returns the largest value. Returns None if value
+    is already the largest.
+    """
+    return find_neighbor(query, column, value, True, steps)
+
+def previous_value(query, column, value, steps = 1):
+    """
+    Returns the value of column that comes steps distinct values before
+    value (by default, the largest value smaller than value). If there
+    aren't that many, returns the smallest value. Returns None if value
+    is already the smallest.
+    """
+    return find_neighbor(query, column, value, False, steps)
+
+def find_neighbor(query, column, value, forward, steps = 1):
+    """
+    Looks up the neighbor of value in the column of the table(s) that
+    query reads from. If forward is True, finds the next value, otherwise
+    finds the previous one. steps says how many distinct values to skip
+    over. Returns None if there is no such value.
+    """
+    tables = from_clause(query)
+    if tables is not None and config.SHIFT_NEIGHBOR_LOOKUP == config.NEIGHBOR_SEEK:
+        return seek_neighbor(tables, column, value, forward, steps)
+    else:
+        return bisect_neighbor(query, tables, column, value, forward, steps)
+
+def seek_neighbor(tables, column, value, forward, steps = 1):
+    """
+    Finds the neighbor of value with a single query: a MIN/MAX for one
+    step, or an ORDER BY ... LIMIT steps for more.
+    """
+    if steps == 1:
+        if forward:
+            sql = "SELECT MIN(%s) FROM %s WHERE %s > %%s" % (column, tables, column)
+        else:
+            sql = "SELECT MAX(%s) FROM %s WHERE %s < %%s" % (column, tables, column)
+        row = quest.engine.run_sql(sql, (value,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+    else:
+        if forward:
+            sql = "SELECT DISTINCT %s FROM %s WHERE %s > %%s ORDER BY %s LIMIT %d" % (column, tables, column, column, steps)
+        else:
+            sql = "SELECT DISTINCT %s FROM %s WHERE %s < %%s ORDER BY %s DESC LIMIT %d" % (column, tables, column, column, steps)
+        rows = quest.engine.run_sql(sql, (value,)).fetchall()
+        if len(rows) == 0:
+            return None
+        # The furthest value we could get to
+        return rows[-1][0]
+
+def bisect_neighbor(query, tables, column, value, forward, steps = 1):
+    """Finds the neighbor of value in the cached sorted distinct values."""
+    values = sorted_distinct_values(query, tables, column)
+    if forward:
+        index = bisect.bisect_right(values, value)
+        if index < len(values):
+            return values[min(index+steps-1, len(values)-1)]
+    else:
+        index = bisect.bisect_left(values, value)
+        if index > 0:
+            return values[max(index-steps, 0)]
+    return None
+
+def sorted_distinct_values(query, tables, column):
+    """
+    Returns (and caches) the sorted distinct values of column. They come
+    from the whole of tables if we know what they are, and otherwise from
+    the result of query itself.
+    """
+    if tables is None:
+        key = (rWhitespace.sub(' ', query).strip().lower(), column)
+    else:
+        key = (rWhitespace.sub(' ', tables).strip().lower(), column)
+
+    entry = distinct_values_cache.get(key)
+    if entry is None:
+        if tables is None:
+            cursor = quest.engine.run_sql(query)
+            column_names = [d[0] for d in cursor.description]
+            if column in column_names:
+                column_index = column_names.index(column)
+                values = [row[column_index] for row in cursor.fetchall()]
+            else:
+                values = []
+        else:
+            cursor = quest.engine.run_sql("SELECT DISTINCT %s FROM %s" % (column, tables))
+            values = [row[0] for row in cursor.fetchall()]
+        # Sort in Python rather than with ORDER BY so the order matches
+        # the comparisons bisect makes.
+        entry = (sorted(set([v for v in values if v is not None])), quest.engine.referenced_tables(query))
+        distinct_values_cache[key] = entry
+    return entry[0]
@@ -0,0 +1,335 @@
+# Evaluating simple WHERE predicates in Python.
+#
+# compile_predicate() turns a predicate like
+#   year >= 2000 AND teamid IN ('BOS', 'NYA') AND NOT name LIKE 'A%'
+# into a function that takes a result row (a tuple) and returns whether
+# the predicate holds for it, so quest.query.local can narrow a result
+# without asking the DB. It understands:
+#   comparisons (=, !=, <>, <, <=, >, >=), [NOT] BETWEEN, [NOT] IN,
+#   [NOT] LIKE, IS [NOT] NULL, AND, OR, NOT and parentheses,
+# where every operand is a column of the row, a number, a 'string' or
+# NULL. (Double quotes mean different things to MySQL and SQLite.)
+# Anything else (functions, arithmetic, subqueries, ...) raises
+# CannotEvaluate, and so does comparing values the DB would convert
+# first (e.g. a string to a number, or a date to a string), so the caller
+# can fall back to SQL.
+#
+# NULLs work like in SQL: a comparison with NULL is unknown (None), and
+# only rows where the predicate is True pass.
+
+import datetime
+import decimal
+import re
+
+import quest.engine
+
+rToken = re.compile(r"""\s*(?:
+        (?P<string>'(?:[^'\\]|''|\\.)*')
+        |(?P<number>\d+(?:\.\d*)?|\.\d+)
+        |(?P<name>`[^`]+`|[A-Za-z_]\w*)
+        |(?P<operator><=|>=|<>|!=|=|<|>|\(|\)|,|-)
+        )""", re.X)
+
+# Keywords that can't be column names here
+KEYWORDS = set(['and', 'or', 'not', 'between', 'in', 'like', 'is', 'null'])
+
+class CannotEvaluate(Exception):
+    """Raised when a predicate (or a row) is beyond us."""
+    def __init__(self, value):
+        self.parameter = value
+    def __str__(self):
+        return repr(self.parameter)
+
+def tokenize(text):
+    """Returns text as a list of (kind, value) tuples."""
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = rToken.match(text, position)
+        if not match or match.end() == position:
+            raise CannotEvaluate("Don't understand %s" % text[position:])
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'name':
+            if value[0] == '`':
+                value = value[1:-1]
+            elif value.lower() in KEYWORDS:
+                kind = 'keyword'
+                value = value.lower()
+        tokens.append((kind, value))
+    return tokens
+
+def string_literal(token):
+    """The value of a quoted string token, as unicode."""
+    quote = token[0]
+    body = token[1:-1]
+    if '\\' in body:
+        # Backslash escapes mean different things to different DBs
+        raise CannotEvaluate("Backslash in %s" % token)
+    body = body.replace(quote * 2, quote)
+    try:
+        return body.decode('utf-8')
+    except UnicodeError:
+        raise CannotEvaluate("Not UTF-8: %s" % token)
+
+def number_literal(text):
+    if '.' in text:
+        return decimal.Decimal(text)
+    return int(text)
+
+class Parser:
+    """
+    A recursive-descent parser that builds the evaluation function as it
+    goes. Every node is compiled to a function of the row: operands
+    return a value, predicates return True, False or None (unknown).
+    """
+
+    def __init__(self, text, column_positions, fold_case):
+        self.tokens = tokenize(text)
+        self.position = 0
+        self.column_positions = column_positions
+        self.fold_case = fold_case
+
+    def peek(self, offset = 0):
+        if self.position + offset < len(self.tokens):
+            return self.tokens[self.position + offset]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise CannotEvaluate("Unexpected end of predicate")
+        self.position += 1
+        return token
+
+    def accept(self, kind, value):
+        """Consumes the next token and returns True if it's (kind, value)."""
+        if self.peek() == (kind, value):
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, kind, value):
+        if not self.accept(kind, value):
+            raise CannotEvaluate("Expected %s, got %s" % (value, self.peek()[1]))
+
+    def parse(self):
+        test = self.disjunction()
+        if self.peek()[0] is not None:
+            raise CannotEvaluate("Don't understand %s" % self.peek()[1])
+        return test
+
+    def disjunction(self):
+        tests = [self.conjunction()]
+        while self.accept('keyword', 'or'):
+            tests.append(self.conjunction())
+        if len(tests) == 1:
+            return tests[0]
+        return any_of(tests)
+
+    def conjunction(self):
+        tests = [self.negation()]
+        while self.accept('keyword', 'and'):
+            tests.append(self.negation())
+        if len(tests) == 1:
+            return tests[0]
+        return all_of(tests)
+
+    def negation(self):
+        if self.accept('keyword', 'not'):
+            return negate(self.negation())
+        if self.peek() == ('operator', '('):
+            self.next()
+            test = self.disjunction()
+            self.expect('operator', ')')
+            return test
+        return self.comparison()
+
+    def comparison(self):
+        left = self.operand()
+        kind, value = self.next()
+        if kind == 'operator' and value in COMPARISONS:
+            right = self.operand()
+            return compare_with(COMPARISONS[value], left, right, self.fold_case)
+        if (kind, value) == ('keyword', 'is'):
+            negated = self.accept('keyword', 'not')
+            self.expect('keyword', 'null')
+            if negated:
+                return lambda row: left(row) is not None
+            return lambda row: left(row) is None
+
+        negated = False
+        if (kind, value) == ('keyword', 'not'):
+            negated = True
+            kind, value = self.next()
+        if (kind, value) == ('keyword', 'between'):
+            low = self.operand()
+            self.expect('keyword', 'and')
+            high = self.operand()
+            test = all_of([compare_with(COMPARISONS['>='], left, low, self.fold_case),
+                    compare_with(COMPARISONS['<='], left, high, self.fold_case)])
+        elif (kind, value) == ('keyword', 'in'):
+            self.expect('operator', '(')
+            choices = [self.operand()]
+            while self.accept('operator', ','):
+                choices.append(self.operand())
+            self.expect('operator', ')')
+            test = any_of([compare_with(COMPARISONS['='], left, choice, self.fold_case) for choice in choices])
+        elif (kind, value) == ('keyword', 'like'):
+            kind, pattern = self.next()
+            if kind != 'string':
+                raise CannotEvaluate("LIKE needs a string pattern")
+            test = like(left, string_literal(pattern))
+        else:
+            raise CannotEvaluate("Don't understand %s" % value)
+        if negated:
+            return negate(test)
+        return test
+
+    def operand(self):
+        """Returns a function of the row giving the operand's value."""
+        kind, value = self.next()
+        if kind == 'name':
+            if value not in self.column_positions or self.peek() == ('operator', '('):
+                # Not a column of the result (or a function call)
+                raise CannotEvaluate("Can't see %s in the result" % value)
+            index = self.column_positions[value]
+            return lambda row: row[index]
+        if kind == 'operator' and value == '-' and self.peek()[0] == 'number':
+            constant = -number_literal(self.next()[1])
+        elif kind == 'number':
+            constant = number_literal(value)
+        elif kind == 'string':
+            constant = string_literal(value)
+        elif (kind, value) == ('keyword', 'null'):
+            constant = None
+        else:
+            raise CannotEvaluate("Don't understand %s" % value)
+        return lambda row: constant
+
+def negate(test):
+    def opposite(row):
+        value = test(row)
+        if value is None:
+            return None
+        return not value
+    return opposite
+
+def all_of(tests):
+    """AND, in SQL's three-valued logic."""
+    def both(row):
+        result = True
+        for test in tests:
+            value = test(row)
+            if value is False:
+                return False
+            if value is None:
+                result = None
+        return result
+    return both
+
+def any_of(tests):
+    """OR, in SQL's three-valued logic."""
+    def either(row):
+        result = False
+        for test in tests:
+            value = test(row)
+            if value:
+                return True
+            if value is None:
+                result = None
+        return result
+    return either
+
+COMPARISONS = {
+        '=': lambda a, b: a == b,
+        '!=': lambda a, b: a != b,
+        '<>': lambda a, b: a != b,
+        '<': lambda a, b: a < b,
+        '<=': lambda a, b: a <= b,
+        '>': lambda a, b: a > b,
+        '>=': lambda a, b: a >= b,
+        }
+
+NUMBER_TYPES = (int, long, float, decimal.Decimal)
+
+def comparable(value, fold_case):
+    """
+    Returns (kind, value) for a non-NULL value, with strings as unicode
+    (and lowercased if fold_case is True). Raises CannotEvaluate for
+    types we don't know how the DB compares.
+    """
+    if isinstance(value, bool):
+        return ('number', int(value))
+    if isinstance(value, NUMBER_TYPES):
+        return ('number', value)
+    if isinstance(value, str):
+        try:
+            value = value.decode('utf-8')
+        except UnicodeError:
+            raise CannotEvaluate("Not UTF-8: %r" % value)
+    if isinstance(value, unicode):
+        if fold_case:
+            value = value.lower()
+        return ('string', value)
+    # datetime is a subclass of date, and they can't be compared
+    if isinstance(value, datetime.datetime):
+        return ('datetime', value)
+    if isinstance(value, datetime.date):
+        return ('date', value)
+    if isinstance(value, datetime.timedelta):
+        return ('time', value)
+    raise CannotEvaluate("Don't know how to compare %r" % value)
+
+def compare_with(operator, left, right, fold_case):
+    def test(row):
+        a = left(row)
+        b = right(row)
+        if a is None or b is None:
+            return None
+        a_kind, a = comparable(a, fold_case)
+        b_kind, b = comparable(b, fold_case)
+        if a_kind != b_kind:
+            # The DB would convert one of them first
+            raise CannotEvaluate("Comparing a %s to a %s" % (a_kind, b_kind))
+        return operator(a, b)
+    return test
+
+def like_regexp(pattern):
+    """The regular expression for a LIKE pattern."""
+    parts = []
+    for char in pattern:
+        if char == '%':
+            parts.append('.*')
+        elif char == '_':
+            parts.append('.')
+        else:
+            parts.append(re.escape(char))
+    # LIKE ignores case in both MySQL's default collations and SQLite
+    return re.compile(''.join(parts) + r'\Z', re.I | re.S | re.U)
+
+def like(operand, pattern):
+    regexp = like_regexp(pattern)
+    def test(row):
+        value = operand(row)
+        if value is None:
+            return None
+        kind, value = comparable(value, False)
+        if kind != 'string':
+            raise CannotEvaluate("LIKE on a %s" % kind)
+        return regexp.match(value) is not None
+    return test
+
+def compile_predicate(text, column_positions):
+    """
+    Compiles the predicate text into a function that takes a row and
+    returns True if the predicate holds for it. column_positions maps each
+    column name the predicate may use to its index in the row. Raises
+    CannotEvaluate if the predicate isn't one we understand; the function
+    raises it too if a row has values we can't compare like the DB would.
+    """
+    fold_case = quest.engine.get_backend().case_insensitive_strings
+    test = Parser(text, column_positions, fold_case).parse()
+    return lambda row: test(row) is True
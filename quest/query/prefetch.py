@@ -0,0 +1,280 @@
+# Prefetching the neighbours of a shifted query.
+#
+# People tend to walk a window along a range one RSHIFT/LSHIFT at a time,
+# so when config.PREFETCH_SHIFTS is True and a shifted query is shown,
+# schedule() works out the next config.PREFETCH_DEPTH shifts in the same
+# direction, and as many back the other way, and runs them on a
+# background thread. Their rows are kept here (up to roughly
+# config.PREFETCH_MEMORY_BUDGET bytes of values), and Query.show takes
+# them instead of asking the DB when the user gets there.
+#
+# Each Session (see quest.session) runs at most one plan at a time:
+# scheduling a new one cancels its last (interrupting its statement, see
+# quest.engine.CancelToken), and so does showing any query that wasn't
+# prefetched, since the user has gone somewhere else. Other sessions'
+# plans are left alone. input_handler.handle tells us which session is
+# showing queries with for_session().
+#
+# Prefetched rows are thrown away after config.PREFETCH_TTL seconds, and
+# all of them (along with anything still being fetched) when Quest
+# changes the DB.
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import quest.engine
+import quest.config as config
+import shifter
+
+lock = threading.Lock()
+# Maps normalized SQL to a Prefetched, least recently stored first
+results = OrderedDict()
+# The total Prefetched.bytes of results
+used_bytes = 0
+# Every Plan that's still running, whatever its session
+running = set()
+# Goes up by one whenever Quest changes the DB; a Plan made in an older
+# generation doesn't store anything
+generation = 0
+# The Session whose commands this thread is running (see for_session)
+context = threading.local()
+
+class Prefetched:
+    """The rows of one prefetched statement."""
+
+    def __init__(self, rows, limit):
+        self.rows = rows
+        # The limit they were fetched with, and whether they're all of
+        # the statement's rows
+        self.limit = limit
+        self.complete = limit is None or len(rows) < limit
+        self.bytes = quest.engine.estimate_bytes(rows)
+        self.fetched_at = time.time()
+
+    def expired(self):
+        """True once these rows are older than config.PREFETCH_TTL seconds."""
+        return config.PREFETCH_TTL is not None and time.time() - self.fetched_at > config.PREFETCH_TTL
+
+    def answers(self, limit):
+        """True if these rows are what showing limit rows would get."""
+        if self.complete:
+            return True
+        return limit is not None and limit <= self.limit
+
+class Plan:
+    """The prefetching for one query a session showed."""
+
+    def __init__(self, session, query, limit):
+        self.session = session
+        self.generation = generation
+        self.query = query
+        self.limit = limit
+        self.token = quest.engine.CancelToken()
+        # The normalized SQL being fetched right now, and an Event that's
+        # set when it's done (whether or not it worked)
+        self.fetching = None
+        self.fetched = threading.Event()
+
+@contextmanager
+def for_session(session):
+    """Runs a with block's shows on behalf of session."""
+    previous = getattr(context, 'session', None)
+    context.session = session
+    try:
+        yield session
+    finally:
+        context.session = previous
+
+def current_session():
+    """The Session set by for_session, or the REPL's default_session."""
+    session = getattr(context, 'session', None)
+    if session is None:
+        # Import here, since quest.session imports the query package
+        from quest.session import default_session
+        session = default_session
+    return session
+
+def is_current(plan):
+    """
+    True if plan is still its session's plan, and Quest hasn't changed
+    the DB since it was made. Call with lock held.
+    """
+    return plan is plan.session.prefetch_plan and plan.generation == generation
+
+def inverse(shifts):
+    """shifts, in the other direction."""
+    opposite = {shifter.RSHIFT: shifter.LSHIFT, shifter.LSHIFT: shifter.RSHIFT}
+    return tuple([(attribute, opposite[shift_type], steps) for attribute, shift_type, steps in shifts])
+
+def schedule(query, number_of_rows = None):
+    """
+    Starts prefetching query's neighbours, if prefetching is on and query
+    was made by shifting its parent.
+    """
+    if not config.PREFETCH_SHIFTS or not config.PREFETCH_DEPTH:
+        return
+    if query.derivation is None or query.derivation[0] != 'shift':
+        return
+    session = current_session()
+    with lock:
+        plan = Plan(session, query, quest.engine.rows_to_fetch(number_of_rows))
+        if session.prefetch_plan is not None:
+            session.prefetch_plan.token.cancel()
+        session.prefetch_plan = plan
+        running.add(plan)
+    worker = threading.Thread(target = run, args = (plan,), name = "quest-prefetch")
+    worker.daemon = True
+    worker.start()
+
+def cancel(session = None):
+    """Stops session's plan (by default, the current session's), if it has one."""
+    if session is None:
+        session = current_session()
+    with lock:
+        plan = session.prefetch_plan
+        session.prefetch_plan = None
+    if plan is not None:
+        plan.token.cancel()
+
+def run(plan):
+    """Prefetches plan's neighbours, nearest first, alternating directions."""
+    try:
+        prefetch_neighbours(plan)
+    finally:
+        with lock:
+            running.discard(plan)
+
+def prefetch_neighbours(plan):
+    shifts = plan.query.derivation[1]
+    # The last query made in each direction, or None once that direction
+    # hits the end of the range
+    ends = [plan.query, plan.query]
+    directions = [shifts, inverse(shifts)]
+    for depth in range(config.PREFETCH_DEPTH):
+        for index in range(len(directions)):
+            if plan.token.cancelled:
+                return
+            if ends[index] is None:
+                continue
+            try:
+                # Looking up string neighbours can mean a statement too
+                with quest.engine.cancellable(plan.token):
+                    ends[index] = neighbour(ends[index], directions[index])
+            except Exception:
+                # Cancelled, or it didn't work
+                return
+            if ends[index] is not None and not fetch(plan, ends[index]):
+                # Out of memory budget (or cancelled)
+                return
+
+def neighbour(query, shifts):
+    """
+    query shifted by shifts, or None if it can't be (e.g. it's at the end
+    of the data).
+    """
+    # Import here, since query imports us
+    from query import Query
+    try:
+        if query.parsed is not None:
+            shifted = Query(shifter.shift_statement(query.parsed, shifts), query)
+        else:
+            shifted = Query(shifter.shift_many(query.statement, shifts), query)
+    except shifter.DidNotShiftException:
+        return None
+    # Not set_child_and_return: the user hasn't made this query
+    shifted.operator = 'prefetch'
+    shifted.derivation = ('shift', shifts)
+    return shifted
+
+def fetch(plan, query):
+    """
+    Runs query and keeps its rows, unless they're already here. Returns
+    False if we should stop prefetching.
+    """
+    sql = query.executable_statement()
+    key = quest.engine.normalize_sql(sql)
+    with lock:
+        if not is_current(plan):
+            return False
+        if key in results and results[key].answers(plan.limit) and not results[key].expired():
+            return True
+        plan.fetching = key
+        plan.fetched.clear()
+    try:
+        with quest.engine.cancellable(plan.token):
+            with quest.engine.statement_lineage(query.lineage()):
+                if plan.limit is None:
+                    rows = quest.engine.show(sql, config.ALL_ROWS)
+                else:
+                    rows = quest.engine.show(sql, plan.limit)
+    except Exception:
+        # Cancelled, or it didn't work; either way the user will find
+        # out for themselves if they go there
+        return False
+    finally:
+        with lock:
+            plan.fetching = None
+        plan.fetched.set()
+    return store(plan, key, Prefetched(rows, plan.limit))
+
+def store(plan, key, prefetched):
+    """
+    Keeps prefetched under key, making room by forgetting the oldest
+    other results. Returns False if it doesn't fit.
+    """
+    global used_bytes
+    with lock:
+        if not is_current(plan):
+            return False
+        old = results.pop(key, None)
+        if old is not None:
+            used_bytes -= old.bytes
+        for expired_key in [other_key for other_key, other in results.items() if other.expired()]:
+            used_bytes -= results.pop(expired_key).bytes
+        while results and used_bytes + prefetched.bytes > config.PREFETCH_MEMORY_BUDGET:
+            forgotten_key, forgotten = results.popitem(last = False)
+            used_bytes -= forgotten.bytes
+        if used_bytes + prefetched.bytes > config.PREFETCH_MEMORY_BUDGET:
+            return False
+        results[key] = prefetched
+        used_bytes += prefetched.bytes
+        return True
+
+def take(sql, limit):
+    """
+    Returns (rows, complete) if sql's result was prefetched and answers a
+    show of limit rows, and forgets it. If it's being fetched right now,
+    waits for it. Otherwise returns None and cancels the current session's
+    plan, since the user has gone somewhere it didn't expect.
+    """
+    global used_bytes
+    if not config.PREFETCH_SHIFTS:
+        return None
+    key = quest.engine.normalize_sql(sql)
+    with lock:
+        plan = current_session().prefetch_plan
+        waiting = plan is not None and plan.fetching == key
+    if waiting:
+        plan.fetched.wait()
+    with lock:
+        prefetched = results.pop(key, None)
+        if prefetched is not None:
+            used_bytes -= prefetched.bytes
+    if prefetched is not None and prefetched.answers(limit) and not prefetched.expired():
+        return (prefetched.rows, prefetched.complete)
+    cancel()
+    return None
+
+def data_changed(tables):
+    global used_bytes, generation
+    with lock:
+        generation += 1
+        plans = list(running)
+        results.clear()
+        used_bytes = 0
+    for plan in plans:
+        plan.token.cancel()
+
+quest.engine.add_invalidation_listener(data_changed)
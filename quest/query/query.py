@@ -1,52 +1,119 @@
 # The basic Query class
 
 import re
+import weakref
 
 import quest.engine
+import quest.config as config
+import quest.util as util
 # for RSHIFT/LSHIFT
 import shifter
 import rollup_drilldown
+import statement
+import summaries
+import local
+import prefetch
+import materialize
+import advisor
 
-class Query:
+class Query(object):
     rBeginsWithSelect = re.compile("^select", re.I)
+    # An argument to shift(), e.g. "year+5" or "name-"
+    rShiftSpec = re.compile(r"^\s*(\w+)\s*([+-])\s*(\d*)\s*$")
 
     def __init__(self, query_string, parent = None):
         """
-        query_string is the string representation of the query.
+        query_string is the string representation of the query, or an
+        already-parsed statement.Statement.
         parent is the "parent" Query class; as each Query evolves, it
         notes its parent and child. The "top" query has no parent.
+
+        The SQL is parsed once, here. Operators build their child's
+        statement out of self.parsed, so they never re-tokenize the SQL.
+        If it can't be parsed (e.g. a UNION), self.parsed is None and
+        operators fall back to working on the SQL text.
         """
-        self.statement = query_string.strip()
-        self.parent = parent
-        # self.child is explicitly set by operators
-        self.child = None
+        if isinstance(query_string, statement.Statement):
+            self.raw_statement = None
+            self.parsed = query_string
+        else:
+            self.raw_statement = query_string.strip()
+            try:
+                self.parsed = statement.parse(self.raw_statement)
+            except statement.UnparseableStatement:
+                self.parsed = None
+        # We hold on to our parent (quest.query.local may need its kept
+        # rows) until we get a child of our own; then it's only a weak
+        # reference, so a long chain of queries doesn't keep every
+        # ancestor (and its kept rows) alive. See parent.
+        self._parent = parent
+        self._weak_parent = None
+        # The operator that made this query from its parent (e.g.
+        # "narrow"), or None for a query the user typed in
+        self.operator = None
+        # The parent's lineage(), which we can't work out later if it's
+        # been garbage collected
+        if parent is None:
+            self.parent_lineage = ()
+        else:
+            self.parent_lineage = parent.lineage()
+        # self.child is explicitly set by operators. We only hold a weak
+        # reference to it, so a query that's been evicted from the query
+        # cache can be garbage collected even while its parent lives on.
+        self._child = None
+        # How this query was made from its parent, e.g. ('rollup',
+        # 'playerid', 'teamid'), if quest.query.local might be able to
+        # work out its result from the parent's, or quest.query.prefetch
+        # might want to fetch its neighbours
+        self.derivation = None
+        # Every row of this query's result, if we've seen them all (see
+        # keep_result), and local.generation when we got them
+        self.result = None
+        self.result_generation = None
 
-    def narrow(self, clause):
-        """AND's this query with the given predicate."""
-        query = self.statement.split()
-        i=0
+    @property
+    def parent(self):
+        """The query this one was derived from, or None (also if it's gone)."""
+        if self._parent is not None:
+            return self._parent
+        if self._weak_parent is not None:
+            return self._weak_parent()
+        return None
 
-        hasWhereOrHaving=False
-        hasFrom=False
+    @property
+    def child(self):
+        """The most recent query derived from this one, or None."""
+        if self._child is None:
+            return None
+        return self._child()
 
-        while i<len(query):
-            token = query[i]
-            lower_token = token.lower()
-            if lower_token == "from":
-                hasFrom=True
+    @property
+    def statement(self):
+        """The SQL text of this query, rendered on first use."""
+        if self.raw_statement is None:
+            self.raw_statement = self.parsed.sql()
+        return self.raw_statement
 
-            elif lower_token in ["where", "having"] and hasFrom:
-                hasWhereOrHaving=True
-                query[i] = " ".join([token, clause, "and"])
-            i+=1
-
-        if hasFrom and not hasWhereOrHaving:
-            query.append("where "+clause)
-
-        return self.set_child_and_return(' '.join(query))
+    def narrow(self, clause):
+        """AND's this query with the given predicate."""
+        if self.parsed is not None:
+            child = self.set_child_and_return(self.parsed.narrow(clause), 'narrow')
+            child.derivation = ('narrow', clause)
+            advisor.note(child, 'narrow', advisor.predicate_columns(clause))
+            return child
+        return self.set_child_and_return(self.combine_text(clause, "and"), 'narrow')
 
     def relax(self, clause):
         """OR's this query with the given predicate."""
+        if self.parsed is not None:
+            return self.set_child_and_return(self.parsed.relax(clause), 'relax')
+        return self.set_child_and_return(self.combine_text(clause, "or"), 'relax')
+
+    def combine_text(self, clause, conjunction):
+        """
+        narrow/relax for statements we couldn't parse: joins clause onto
+        every WHERE and HAVING in the SQL text with conjunction.
+        """
         query = self.statement.split()
         i=0
 
@@ -61,36 +128,158 @@ class Query:
 
             elif lower_token in ["where", "having"] and hasFrom:
                 hasWhereOrHaving=True
-                query[i] = " ".join([token, clause, "or"])
+                query[i] = " ".join([token, clause, conjunction])
             i+=1
 
         if hasFrom and not hasWhereOrHaving:
             query.append("where "+clause)
 
-        return self.set_child_and_return(' '.join(query))
+        return ' '.join(query)
 
     def show(self, number_of_rows = None):
         """
         Actually sends the query to the DB. If number_of_rows is None (the
         default), then the query gets all results.
+
+        If this query's result can be worked out in memory from its
+        parent's (see quest.query.local), or was prefetched (see
+        quest.query.prefetch), the DB isn't touched at all. The rows this
+        query kept itself are only for its children: showing it again
+        always asks the DB, so it sees changes made outside Quest.
         """
-        result = quest.engine.show(self.statement, number_of_rows)
+        rows = self.rows_in_memory(number_of_rows)
+        if rows is not None:
+            return rows
+        limit = quest.engine.rows_to_fetch(number_of_rows)
+        with quest.engine.statement_lineage(self.lineage()):
+            result = quest.engine.show(self.executable_statement(), number_of_rows)
+        # If we got fewer rows than we asked for, we got all of them
+        self.keep_result(result, limit is None or len(result) < limit)
+        prefetch.schedule(self, number_of_rows)
         return result
 
+    def rows_in_memory(self, number_of_rows = None):
+        """
+        The rows show() would return, if they can be worked out without
+        the DB: from the parent's (see quest.query.local), or because they
+        were prefetched (see quest.query.prefetch). Otherwise None.
+        """
+        limit = quest.engine.rows_to_fetch(number_of_rows)
+        event = quest.engine.start_event(self.statement, 'local', self.lineage())
+        with quest.engine.statement_lineage(self.lineage()):
+            rows = local.evaluate(self)
+        if rows is not None:
+            if event is not None:
+                event.executed()
+                event.rows = len(rows)
+                event.finished()
+            self.keep_result(rows, True)
+            prefetch.schedule(self, number_of_rows)
+            if limit is not None and len(rows) > limit:
+                rows = rows[:limit]
+            return rows
+
+        prefetched = prefetch.take(self.executable_statement(), limit)
+        if prefetched is not None:
+            rows, complete = prefetched
+            if event is not None:
+                event.source = 'prefetch'
+                event.executed()
+                event.rows = len(rows)
+                event.finished()
+            self.keep_result(rows, complete)
+            prefetch.schedule(self, number_of_rows)
+            if limit is not None and len(rows) > limit:
+                rows = rows[:limit]
+            return rows
+        return None
+
+    def keep_result(self, rows, complete):
+        """
+        Holds on to rows (a quest.engine.ResultRows) if they're this
+        query's complete result and there aren't more than
+        config.KEEP_RESULT_ROWS of them, so children can use them.
+        """
+        if complete and config.KEEP_RESULT_ROWS and len(rows) <= config.KEEP_RESULT_ROWS:
+            self.result = rows
+            self.result_generation = local.generation
+
+    def complete_result(self):
+        """
+        Returns this query's complete result, if we've kept it and the DB
+        hasn't changed since, otherwise None.
+        """
+        if self.result is None or self.result_generation != local.generation:
+            return None
+        return self.result
+
+    def stream(self, number_of_rows = None):
+        """
+        Like show(), but returns a quest.engine.RowStream that reads the
+        result from the DB a batch at a time. Rows show() wouldn't need
+        the DB for are streamed from memory instead, and a small enough
+        result is kept for children once it's been read, like show()'s.
+        """
+        rows = self.rows_in_memory(number_of_rows)
+        if rows is not None:
+            return quest.engine.KeptRowStream(self.statement, rows)
+        limit = quest.engine.rows_to_fetch(number_of_rows)
+        with quest.engine.statement_lineage(self.lineage()):
+            rows = quest.engine.stream(self.executable_statement(), number_of_rows)
+        # The rows are read later, maybe after input_handler is done
+        # with this session
+        session = prefetch.current_session()
+        def streamed(result):
+            self.keep_result(result, limit is None or len(result) < limit)
+            with prefetch.for_session(session):
+                prefetch.schedule(self, number_of_rows)
+        rows.completion_listeners.append(streamed)
+        return rows
+
+    def executable_statement(self):
+        """
+        The SQL to actually send to the DB for this query: usually just
+        self.statement, but it may read from a summary table (see
+        quest.query.summaries) or materialized queries (see
+        quest.query.materialize) instead.
+        """
+        if self.parsed is not None:
+            routed = summaries.route(self.parsed)
+            if routed is not None:
+                return routed
+        routed = materialize.route(self.statement)
+        if routed is not None:
+            return routed
+        return self.statement
+
     def store(self, table_name):
         """
         Store result of running this query in a table with name
         table_name. Returns True if successfully stored. If it wasn't
         successfully stored, raises the error it encountered with some
         extra Quest-specific info prepended to the error message.
+
+        If materialization is on and this query's result is already
+        materialized (see quest.query.materialize), the table is copied
+        from that, and if it's already in table_name nothing is run.
         """
         match = self.rBeginsWithSelect.match(self.statement)
         if match:
             # This is a SELECT statement, proceed
-            # CREATE TABLE new_table_name SELECT ...
-            query = "CREATE TABLE %s %s" % (table_name, self.statement)
+            source = self.statement
+            materialization = materialize.find(self.statement)
+            if materialization is not None:
+                if materialization.name.lower() == table_name.lower():
+                    return "Nothing to run: %s already holds this query's result" % table_name
+                source = "SELECT * FROM %s" % materialization.name
+            # CREATE TABLE new_table_name AS SELECT ...
+            # (MySQL doesn't need the AS, but SQLite does)
+            query = "CREATE TABLE %s AS %s" % (table_name, source)
             try:
                 quest.engine.run_sql(query)
+                # Cached results that read from table_name are stale now
+                quest.engine.invalidate_statement(query)
+                materialize.register(self, table_name)
                 # Don't set child, because this is just saving to a
                 # variable
                 return query
@@ -104,33 +293,115 @@ class Query:
     def relate(self, other_query):
         """
         Return a string representation of a natural inner join query
-        between this query and other_query.
+        between this query and other_query (a table name or a SELECT).
+
+        If materialization is on, this query's result is stored in a
+        table first, indexed on the join columns, and the join reads from
+        that (see quest.query.materialize).
         """
         statement_without_semicolon = self.statement
         if self.statement.endswith(";"):
             statement_without_semicolon = self.statement[:-1].strip()
-        return self.set_child_and_return("SELECT * FROM %s NATURAL INNER JOIN %s" % (statement_without_semicolon, other_query))
+        other_query = other_query.strip()
+        if self.rBeginsWithSelect.match(other_query):
+            # Derived tables need parentheses and a name
+            other_query = "(%s) AS quest_right" % other_query.rstrip(';').strip()
+        if config.MATERIALIZE_ENABLED and materialize.worth_materializing(self):
+            materialize.materialize(self, materialize.common_columns(statement_without_semicolon, other_query))
+        return self.set_child_and_return("SELECT * FROM (%s) AS quest_left NATURAL INNER JOIN %s" % (statement_without_semicolon, other_query), 'relate')
 
-    def lshift(self, attr):
-        """LSHIFT an attribute of this query."""
-        return self.set_child_and_return(shifter.lshift(self.statement, attr))
+    def lshift(self, attr, steps = 1):
+        """LSHIFT an attribute of this query, steps times."""
+        return self.shift_all([(attr, shifter.LSHIFT, self.parse_steps(steps))], 'lshift')
 
-    def rshift(self, attr):
-        """RSHIFT an attribute of this query."""
-        return self.set_child_and_return(shifter.rshift(self.statement, attr))
+    def rshift(self, attr, steps = 1):
+        """RSHIFT an attribute of this query, steps times."""
+        return self.shift_all([(attr, shifter.RSHIFT, self.parse_steps(steps))], 'rshift')
+
+    def shift(self, *shifts):
+        """
+        Shift several attributes of this query at once. Each shift is a
+        string like "year+5" (RSHIFT year 5 times) or "name-1" (LSHIFT name
+        once); the number defaults to 1, so "year+" works too.
+        """
+        if len(shifts) == 0:
+            raise ValueError("shift needs at least one attribute to shift")
+        parsed_shifts = []
+        for spec in shifts:
+            match = self.rShiftSpec.match(spec)
+            if not match:
+                raise ValueError("Can't shift %s, please use e.g. year+5 or name-1" % spec)
+            attr, direction, steps = match.groups()
+            if direction == '+':
+                shift_type = shifter.RSHIFT
+            else:
+                shift_type = shifter.LSHIFT
+            parsed_shifts.append((attr, shift_type, self.parse_steps(steps or 1)))
+        return self.shift_all(parsed_shifts)
+
+    def shift_all(self, shifts, operator = 'shift'):
+        """
+        Does the work for lshift, rshift and shift. shifts is a list of
+        (attribute, shift_type, steps) tuples.
+        """
+        if self.parsed is not None:
+            child = self.set_child_and_return(shifter.shift_statement(self.parsed, shifts), operator)
+        else:
+            child = self.set_child_and_return(shifter.shift_many(self.statement, shifts), operator)
+        child.derivation = ('shift', tuple(shifts))
+        advisor.note(child, operator, [attribute for attribute, shift_type, steps in shifts])
+        return child
+
+    def parse_steps(self, steps):
+        """Turn a step count (possibly a string, from the prompt) into an int."""
+        if not util.is_integer(steps):
+            raise ValueError("Number of steps to shift (%s) must be a whole number" % steps)
+        return int(steps)
 
     def rollup(self, attr):
-        return self.set_child_and_return(rollup_drilldown.rollup(self.statement, attr))
+        child = self.set_child_and_return(rollup_drilldown.rollup(self.rewritable(), attr), 'rollup')
+        if child.parsed is not None:
+            child.derivation = ('rollup', attr, rollup_drilldown.parent_of(attr))
+            advisor.note(child, 'rollup', child.parsed.group_by)
+        return child
 
     def drilldown(self, attr):
-        return self.set_child_and_return(rollup_drilldown.drilldown(self.statement, attr))
+        return self.set_child_and_return(rollup_drilldown.drilldown(self.rewritable(), attr), 'drilldown')
 
-    def set_child_and_return(self, new_statement):
-        """Set new_query as self.child and return new_query."""
+    def rewritable(self):
+        """
+        What rollup_drilldown should rewrite: the parsed statement, or the
+        SQL text if we couldn't parse it.
+        """
+        if self.parsed is not None:
+            return self.parsed
+        return self.statement
+
+    def set_child_and_return(self, new_statement, operator = None):
+        """
+        Set new_query as self.child and return new_query. new_statement is
+        either SQL text or a parsed statement.Statement, and operator is
+        the name of the operator that made it.
+        """
         # Pass in self as new_query's parent
         new_query = Query(new_statement, self)
-        self.child = new_query
-        return self.child
+        new_query.operator = operator
+        self._child = weakref.ref(new_query)
+        if self._parent is not None:
+            # new_query keeps us alive, but only we needed our parent
+            self._weak_parent = weakref.ref(self._parent)
+            self._parent = None
+        return new_query
+
+    def lineage(self):
+        """
+        The operators that made this query, oldest first, e.g. ('narrow',
+        'rollup') for Q.narrow(...).rollup(...). Empty for a query the
+        user typed in.
+        """
+        if self.operator is None:
+            return ()
+        return self.parent_lineage + (self.operator,)
 
     def __str__(self):
         return str(self.statement)
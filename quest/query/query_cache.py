@@ -1,93 +1,138 @@
 # Stores all queries using simple key-value system, where the value is a Query
 # instance. Each key is either user-specified name (e.g. "my_awesome_query")
 # or if user doesn't specify a name, then an autogenerated name (e.g. "Q20").
-# This is a singleton class implemented using a module (rather than a class).
+#
+# Each quest.session.Session has its own QueryCache, so web users don't see
+# (or overwrite) each other's query variables. The module-level functions
+# (put, get, ...) work on default_cache, which the REPL uses.
+#
+# Queries the user named (with INITIALIZE) stay in the cache forever.
+# Autogenerated ones are evicted, least recently used first, once there are
+# more than config.QUERY_CACHE_SIZE of them.
 
+import itertools
+import threading
 from string import uppercase
+from collections import OrderedDict
+
 from quest.query.query import Query
+import quest.config as config
 
-class TooManyQueryVariables(Exception):
-    def __init__(self, value):
-        self.value = value
+def variable_names():
+    """
+    Generates every possible variable name in order: "A"-"Z", then
+    "AA", "AB", ..., "ZZ", then "AAA", and so on forever.
+    """
+    for length in itertools.count(1):
+        for letters in itertools.product(uppercase, repeat = length):
+            yield ''.join(letters)
 
-# The actual cache dict. query_cache is just a wrapper around this.
-cache = {}
-# counter_dict tracks the current "generation" of a query variable, e.g.
-# if we're in the 3rd generation of Q, then counter_dict["Q"] == 3. Each
-# time an operation is applied to a query, that creates a new
-# generation, so e.g. Q4 == Q3.rollup(<predicate>)
-# Each time INITIALIZE is called, adds a new key with the counter set to
-# 0.
-counter_dict = {}
-uppercase_list = list(uppercase)
-# most_recent_key_query is set whenever put() is called. It is a tuple
-# of (key, query) like ("A", <query object>)
-most_recent_key_and_query = (None, None)
+class QueryCache:
+    def __init__(self):
+        # The actual cache dict. QueryCache is just a wrapper around this.
+        self.cache = {}
+        # The autogenerated keys, least recently used first. These are the
+        # only ones we ever evict.
+        self.unpinned_keys = OrderedDict()
+        # counter_dict tracks the current "generation" of a query variable, e.g.
+        # if we're in the 3rd generation of Q, then counter_dict["Q"] == 3. Each
+        # time an operation is applied to a query, that creates a new
+        # generation, so e.g. Q4 == Q3.rollup(<predicate>)
+        # Each time INITIALIZE is called, adds a new key with the counter set to
+        # 0.
+        self.counter_dict = {}
+        # most_recent_key_query is set whenever put() is called. It is a tuple
+        # of (key, query) like ("A", <query object>)
+        self.most_recent_key_and_query = (None, None)
+        # Hands out the names for next_variable_name. Since it never goes
+        # backwards, finding the next name doesn't mean searching the cache.
+        self.variable_name_generator = variable_names()
+        self.lock = threading.RLock()
 
-def increment_counter_for(variable):
-    """Increment the counter for a given variable name. Should be called each
-    time a new generation of a query is created (Q1.rollup(pred) -> Q2).
-    """
-    global counter_dict
-    counter_dict[variable] += 1
+    def increment_counter_for(self, variable):
+        """Increment the counter for a given variable name. Should be called each
+        time a new generation of a query is created (Q1.rollup(pred) -> Q2).
+        """
+        with self.lock:
+            self.counter_dict[variable] += 1
 
-def next_variable_name(letters = uppercase_list):
-    """Searches _cache_ to get the next unused variable name. Checks
-    "A"-"Z", then "AA"-"ZZ", etc., up to "ZZZ" inclusive, and uses first letter that hasn't
-    been used yet. The `letters` argument allows for recursive calling with
-    different sets of letters.
-    """
-    global counter_dict
-    if len(letters[0]) == 4:
-        # We've reached "AAAA", stop.
-        raise TooManyQueryVariables("Too many query variables!")
+    def next_variable_name(self):
+        """Returns the next variable name that isn't already in the cache."""
+        with self.lock:
+            for next_variable_name in self.variable_name_generator:
+                # Skip names the user has already taken with INITIALIZE
+                if next_variable_name not in self.cache:
+                    # Initialize counter for new variable name to 0
+                    self.counter_dict[next_variable_name] = 0
+                    return next_variable_name
 
-    next_variable_name = ""
-    cache_keys = cache.keys()
-    unused_letters = [letter for letter in letters if letter not in cache_keys]
-    if len(unused_letters) == 0:
-        # All letters are used, recurse.
-        # Each letter in letters grows by one, so "A" -> "AA", "B" -> "BB", etc.
-        new_letters = [letter + letter[0] for letter in letters]
-        next_variable_name = next_variable_name(new_letters)
-    else:
-        # There are unused letters, take the first one
-        next_variable_name = unused_letters[0]
-        # Initialize counter for new variable name to 0
-        counter_dict[next_variable_name] = 0
-    return next_variable_name
+    def put(self, key, query):
+        """Put a (key, query) pair in the cache. If key is None, autogenerates a
+        variable name using next_variable_name. Returns a (key, query) tuple.
 
-def put(key, query):
-    """Put a (key, query) pair in the cache. If key is None, autogenerates a
-    variable name using next_variable_name. Returns a (key, query) tuple.
+        Autoconverts query to a Query instance, if it isn't already.
+        """
+        if not isinstance(query, Query):
+            # Set the query variable (which is a string) to an instance of
+            # the Query class initialized with the value of the query
+            # variable.
+            query = Query(query)
+        with self.lock:
+            if key is None:
+                key = self.next_variable_name()
+                self.unpinned_keys[key] = True
+            else:
+                # User picked this name, so it's pinned
+                self.unpinned_keys.pop(key, None)
+            self.cache[key] = query
+            self.most_recent_key_and_query = (key, query)
+            self.evict()
+            return self.most_recent_key_and_query
 
-    Autoconverts query to a Query instance, if it isn't already.
-    """
-    global most_recent_key_and_query
-    global cache
-    if key is None:
-        key = next_variable_name()
-    if not isinstance(query, Query):
-        # Set the query variable (which is a string) to an instance of
-        # the Query class initialized with the value of the query
-        # variable.
-        query = Query(query)
-    cache[key] = query
-    most_recent_key_and_query = (key, query)
-    return most_recent_key_and_query
+    def get(self, key):
+        """Returns the query associated with the given key. Behaves exactly like a
+        dict (since that's what it uses) if the key is not in the cache. That is, it
+        raises a KeyError.
+        """
+        with self.lock:
+            query = self.cache[key]
+            if key in self.unpinned_keys:
+                # Mark it as recently used
+                del self.unpinned_keys[key]
+                self.unpinned_keys[key] = True
+            return query
 
-def get(key):
-    """Returns the query associated with the given key. Behaves exactly like a
-    dict (since that's what it uses) if the key is not in the cache. That is, it
-    raises a KeyError.
-    """
-    return cache[key]
+    def delete(self, key):
+        """Delete the key from the cache. Raises a KeyError (exactly like a dict)
+        if the key is not in the cache. Returns the query associated with the key.
+        """
+        with self.lock:
+            query = self.get(key)
+            del self.cache[key]
+            self.unpinned_keys.pop(key, None)
+            self.counter_dict.pop(key, None)
+            return query
 
-def delete(key):
-    """Delete the key from the cache. Raises a KeyError (exactly like a dict)
-    if the key is not in the cache. Returns the query associated with the key.
-    """
-    global cache
-    query = get(key)
-    del cache[key]
-    return query
+    def evict(self):
+        """
+        Deletes the least recently used autogenerated queries until there
+        are at most config.QUERY_CACHE_SIZE of them. The most recent query is
+        never evicted.
+        """
+        if config.QUERY_CACHE_SIZE is None:
+            return
+        with self.lock:
+            while len(self.unpinned_keys) > max(config.QUERY_CACHE_SIZE, 1):
+                key, ignored = self.unpinned_keys.popitem(last = False)
+                del self.cache[key]
+                self.counter_dict.pop(key, None)
+
+# The cache the module-level functions below work on.
+default_cache = QueryCache()
+
+# Module-level shortcuts for the REPL, e.g. query_cache.put(key, query)
+increment_counter_for = default_cache.increment_counter_for
+next_variable_name = default_cache.next_variable_name
+put = default_cache.put
+get = default_cache.get
+delete = default_cache.delete
@@ -1,43 +1,77 @@
+import re
+
 import sqlparse
 from quest.exception import QuestOperationNotAllowedException
+from quest.query import statement
+from quest.util import LRUCache
+import quest.config as config
 
 # User-provided hierarchies.
 from quest.config import drilldown_parent2child, rollup_child2parent
 
-def drilldown(query, parent_attribute):
+# sqlparse is slow, so remember what it made of each statement we've
+# rewritten (only statements quest.query.statement can't parse get that
+# far). Maps statement text to sqlparse.parse's result. Check
+# parse_cache.hits and parse_cache.misses to see how well it's doing.
+parse_cache = LRUCache(config.SQLPARSE_CACHE_SIZE)
+
+def child_of(parent_attribute):
     """
-    Takes a query and parent attribute to drilldown on -- i.e. return
-    a query with the parent attribute's child instead of the parent attribute.
+    Returns the attribute one level below parent_attribute in the
+    hierarchy, or raises QuestOperationNotAllowedException if there
+    isn't one.
     """
     if parent_attribute not in drilldown_parent2child:
         error_message = "Cannot DRILLDOWN on %s. Can DRILLDOWN on any of these: %s" % (parent_attribute, ", ".join(drilldown_parent2child.keys()))
         raise QuestOperationNotAllowedException(error_message)
+    return drilldown_parent2child[parent_attribute]
+
+def parent_of(child_attribute):
+    """
+    Returns the attribute one level above child_attribute in the
+    hierarchy, or raises QuestOperationNotAllowedException if there
+    isn't one.
+    """
+    if child_attribute not in rollup_child2parent:
+        error_message = "Cannot ROLLUP on %s. Can ROLLUP on any of these: %s" % (child_attribute, ", ".join(rollup_child2parent.keys()))
+        raise QuestOperationNotAllowedException(error_message)
+    return rollup_child2parent[child_attribute]
 
-    child_attribute = drilldown_parent2child[parent_attribute]
+def drilldown(query, parent_attribute):
+    """
+    Takes a query and parent attribute to drilldown on -- i.e. return
+    a query with the parent attribute's child instead of the parent attribute.
+    query is either SQL text or a parsed quest.query.statement.Statement,
+    and what's returned is the same kind.
+    """
+    child_attribute = child_of(parent_attribute)
     return replace_and_create_new_query(query, parent_attribute, child_attribute)
 
 def rollup(query, child_attribute):
     """
     Takes a query and child attribute to rollup on -- i.e. return a
     a query with the child attribute's parent instead of the child attribute.
+    query is either SQL text or a parsed quest.query.statement.Statement,
+    and what's returned is the same kind.
     """
-    if child_attribute not in rollup_child2parent:
-        error_message = "Cannot ROLLUP on %s. Can ROLLUP on any of these: %s" % (child_attribute, ", ".join(rollup_child2parent.keys()))
-        raise QuestOperationNotAllowedException(error_message)
-
-    parent_attribute = rollup_child2parent[child_attribute]
+    parent_attribute = parent_of(child_attribute)
     return replace_and_create_new_query(query, child_attribute, parent_attribute)
 
 def replace_and_create_new_query(query, target_attribute, new_attribute):
     """
-    Replace target_attribute with new_attribute in query and return new
-    query string.
+    Replace target_attribute with new_attribute in query and return the
+    new query. A parsed Statement (which is what Query has for anything
+    quest.query.statement understands) is rewritten without any parsing;
+    SQL text goes through sqlparse, via parse_cache.
     """
-    parsed = sqlparse.parse(query)
+    if isinstance(query, statement.Statement):
+        return query.replace_attribute(target_attribute, new_attribute)
+
+    parsed = cached_parse(query)
     new_query = []
-    for statement in parsed:
+    for sql_statement in parsed:
         replace_text = False
-        for token in statement.tokens:
+        for token in sql_statement.tokens:
 
             if replace_text and not token.is_whitespace():
                 # Replace the first non-whitespace token after "SELECT"
@@ -66,3 +100,11 @@ def replace_attribute(attributes, target_attribute, new_attribute):
     # Strip everything.
     replaced_attributes = [att.strip() for att in replaced_attributes]
     return ", ".join(replaced_attributes)
+
+def cached_parse(query):
+    """sqlparse.parse(query), remembered in parse_cache."""
+    parsed = parse_cache.get(query)
+    if parsed is None:
+        parsed = sqlparse.parse(query)
+        parse_cache.put(query, parsed)
+    return parsed
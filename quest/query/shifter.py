@@ -1,14 +1,8 @@
 import re
 import datetime
-from operator import itemgetter
 
 import quest.engine
-
-try:
-    import MySQLdb
-except ImportError as ie:
-    import sys
-    sys.exit("!!! Could not import MySQLdb. Install mysql-python.")
+import neighbors
 
 # Raised when we couldn't shift on the supplied attribute
 class DidNotShiftException(Exception):
@@ -17,6 +11,13 @@ class DidNotShiftException(Exception):
     def __str__(self):
         return repr(self.parameter)
 
+# Raised when a string attribute can't be shifted because there's no
+# value before (LSHIFT) or after (RSHIFT) it. It's up to the caller to tell
+# the user, if there is one.
+class EndOfDataException(DidNotShiftException):
+    def __str__(self):
+        return str(self.parameter)
+
 # Magic constants.
 RSHIFT = 0
 LSHIFT = 1
@@ -43,16 +44,10 @@ rWhitespace = re.compile(r"\s+")
 # match.groups(1) would be "att" (no quotes)
 rBareAttribute = re.compile(r"(?:\w+\.)?[\"']?(\w+)[\"']?")
 
-# Maps a column name to its type, e.g. movie_id => int
-meta_dict = {}
-
-# DB cursor
-cursor = None
-# A list of all of the column names
-column_names = None
-
-# Result from executing query in connect(query)
-result_rows = None
+# Column types we've already looked up, so we only have to ask the DB
+# once. Maps (from_clause, column_name) to the column's Python type,
+# e.g. ("playerstats", "year") => int
+column_type_cache = {}
 
 def findOperator(string):
     """
@@ -84,79 +79,120 @@ def combineTimestampTokens(array):
         i += 1
     return array
 
-def execute_query(query):
+def from_clause_key(query):
     """
-    Tries to run the given query using the given database connection.
-
-    db is a DB connection (of any type), and the query is the (string)
-    representation of the query to execute. Returns None if no rows are
-    in the result set, True otherwise.
-    If an Exception is raised when running cursor.execute, this function
-    will explicitly not catch it.
+    Returns a normalized version of the FROM clause of query, used as the
+    table half of column_type_cache keys. Returns the whole normalized
+    query if there's no FROM clause we can find.
     """
-    global result_rows
-    global cursor
-    global meta_dict
-    global column_names
-
-    # Re-initialize since this is called every time we do Query#lshift
-    # or Query#rshift
-    result_rows = None
-    cursor = None
-    meta_dict = {}
-    column_names = None
-
-    cursor = quest.engine.run_sql(query)
-    result_rows = cursor.fetchall()
-
-    if len(result_rows) == 0:
-        # No results
-        return None
-    else:
-        first_row = result_rows[0]
-        # cursor.description[i] is like
-        # ('playerID', None, None, None, None, None, None)
-        column_names = [d[0] for d in cursor.description]
-
-        for index, value in enumerate(first_row):
-            # Map a column name to its type (e.g. int)
-            # meta_dict["movie_id"] = int
-            column_name = column_names[index]
-            column_type = type(value)
-            meta_dict[column_name] = column_type
-        return True
-
-def column_index(column_name):
+    tables = neighbors.from_clause(query)
+    if tables is None:
+        tables = query
+    return rWhitespace.sub(' ', tables).strip().lower()
+
+def clear_column_type_cache():
+    """Forget every cached column type, e.g. after a table is altered."""
+    global column_type_cache
+    column_type_cache = {}
+
+class ShiftState:
     """
-    Returns index of column with given name in result_rows, or None
-    if no column in result_rows has the given name.
+    What execute_query found out about the query being shifted. Each
+    shift gets its own, so shifts running at the same time (e.g. for
+    different web users) can't trample each other's column types.
     """
-    try:
-        return column_names.index(column_name)
-    except ValueError as ve:
-        # No column with this name exists
-        return None
 
-def shift(attr_name, attr_value, shift_type):
+    def __init__(self, query):
+        # The query being shifted. Shifting a string attribute looks up
+        # its neighbors in the table(s) this reads from.
+        self.query = query
+        # Maps a column name to its type, e.g. movie_id => int
+        self.meta_dict = {}
+        # A list of all of the column names, if we know them
+        self.column_names = None
+
+    def column_index(self, column_name):
+        """
+        Returns index of column with given name in column_names, or None
+        if no column in column_names has the given name.
+        """
+        try:
+            return self.column_names.index(column_name)
+        except (ValueError, AttributeError) as e:
+            # No column with this name exists
+            return None
+
+def execute_query(query, attributes = None):
+    """
+    Discovers the types of the given query's columns, without fetching
+    any rows, and returns them in a ShiftState.
+
+    If attributes (a list of column names) is given and we've already
+    seen all of their types for this table (see column_type_cache),
+    that's all we look up and the DB isn't touched at all. Otherwise the
+    types of every column come from the column type codes of a single
+    LIMIT 0 version of the query (see quest.engine.describe), and
+    column_names is filled in too.
+
+    If an Exception is raised when talking to the DB, this function will
+    explicitly not catch it.
+    """
+    state = ShiftState(query)
+
+    table_key = from_clause_key(query)
+    if attributes and all([column_type_cache.get((table_key, a)) is not None for a in attributes]):
+        for attribute in attributes:
+            state.meta_dict[attribute] = column_type_cache[(table_key, attribute)]
+        return state
+
+    description = quest.engine.describe(query)
+    tables = neighbors.from_clause(query)
+    if tables is not None and None in [column_type for column_name, column_type in description]:
+        # SQLite can only tell a column's type from a row, and query may
+        # have none; the whole table is more likely to
+        table_types = dict(quest.engine.describe("SELECT * FROM %s" % tables))
+        description = [(column_name, column_type or table_types.get(column_name))
+                for column_name, column_type in description]
+    state.column_names = [column_name for column_name, column_type in description]
+    for column_name, column_type in description:
+        # Map a column name to its type (e.g. int)
+        # meta_dict["movie_id"] = int
+        state.meta_dict[column_name] = column_type
+        # None means we couldn't tell (e.g. SQLite with no rows to look
+        # at), which may not be true of the next query on this table
+        if column_type is not None:
+            column_type_cache[(table_key, column_name)] = column_type
+    return state
+
+def strip_quotes(value):
+    """Turns "'David'" (a SQL string literal) into "David"."""
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+        return value[1:-1]
+    return value
+
+def shift(state, attr_name, attr_value, shift_type, steps = 1):
     """
     Shift attribute with given name and value according to
-    shift_type.
+    shift_type, steps times over. state is the ShiftState that
+    execute_query returned for the query being shifted.
 
     Raises a TypeError if shift_type does not equal either of the magic
-    constants LSHIFT or RSHIFT.
+    constants LSHIFT or RSHIFT, and EndOfDataException if a string
+    attribute has no value to shift to.
     """
     if shift_type not in [LSHIFT, RSHIFT]:
         raise TypeError("Incorrect shift_type (%s), must provide LSHIFT or RSHIFT." % shift_type)
 
     numeric_types = (int, float, long)
-    attr_type = meta_dict[attr_name]
+    attr_type = state.meta_dict[attr_name]
 
     if attr_type in numeric_types:
         # A number of some sort.
         if shift_type == RSHIFT:
-            return str(attr_type(attr_value)+1)
+            return str(attr_type(attr_value)+steps)
         else:
-            return str(attr_type(attr_value)-1)
+            return str(attr_type(attr_value)-steps)
 
     elif attr_type == datetime.timedelta:
         attr_value = attr_value.split("'")[1]
@@ -164,7 +200,7 @@ def shift(attr_name, attr_value, shift_type):
         hours, minutes, seconds = [int(t) for t in time_segment]
 
         base_time = datetime.timedelta(seconds = seconds, minutes = minutes, hours = hours)
-        time_shift_amount = datetime.timedelta(seconds = 1)
+        time_shift_amount = datetime.timedelta(seconds = steps)
 
         if shift_type == RSHIFT:
             final_time = str(base_time + time_shift_amount).split()
@@ -184,7 +220,7 @@ def shift(attr_name, attr_value, shift_type):
 
             if time_regexp.match(attr_value):
                 # This is a date and time, so shift by 1 second forward or back
-                time_shift_amount = datetime.timedelta(seconds = 1)
+                time_shift_amount = datetime.timedelta(seconds = steps)
 
                 date_segment = attr_value.split()[0].split("-")
                 time_segment = attr_value.split()[1].split(":")
@@ -195,7 +231,7 @@ def shift(attr_name, attr_value, shift_type):
                 base_date = datetime.datetime(year, month, day, hour, minute, second)
             else:
                 # This is a date (without a time), so shift by 1 day forward or back
-                time_shift_amount = datetime.timedelta(days = 1)
+                time_shift_amount = datetime.timedelta(days = steps)
                 date = attr_value.split('-')
                 year, month, day = [int(t) for t in date]
                 base_date = datetime.date(year, month, day)
@@ -210,70 +246,65 @@ def shift(attr_name, attr_value, shift_type):
                     return "'%s'"% (base_date - time_shift_amount)
 
     elif attr_type in (str, unicode):
-        # attr is a string of some sort.
-        match = rBareAttribute.match(attr_value)
-        # Set outside the if so it has wider scope
-        # bare_attr_value is the attr without enclosing quotes or table
-        # references
-        bare_attr_value = None
-        if match:
-            bare_attr_value = match.groups(1)
-        else:
-            # FIXME: no attribute found, error
-            pass
-
-        # attr is the attr_index'th column
-        attr_index = column_index(bare_attr_value)
-        if attr_index is None:
-            # Not a valid column name, don't shift.
-            return attr_value
+        # attr is a string of some sort. Shift to the next (or previous)
+        # distinct value that's actually in the DB (e.g. "David" is in
+        # the DB, and so is "Eric", and "Eric" is the next-highest value
+        # after "David", so RSHIFT returns "Eric")
+        bare_attr_value = strip_quotes(attr_value)
+        if shift_type == RSHIFT:
+            new_value = neighbors.next_value(state.query, attr_name, bare_attr_value, steps)
         else:
-            # rows_sorted_by_attr_value is a copy of result_rows, with each row sorted by
-            # the value of its attr_index'th column, which is the column
-            # corresponding to the attr we're shifting.
-            rows_sorted_by_attr_value = sorted(result_rows, key = itemgetter(attr_index))
-            # data_index is the index in rows_sorted_by_attr_value of
-            # the row containing attr_value for the given column
-            data_index = 0
-            for index, row in enumerate(rows_sorted_by_attr_value):
-                if bare_attr_value == row[attr_index]:
-                    data_index = index
-                    break
+            new_value = neighbors.previous_value(state.query, attr_name, bare_attr_value, steps)
 
+        if new_value is None:
+            # We can't shift
             if shift_type == RSHIFT:
-                if data_index < len(result_rows)-1:
-                    # We can RSHIFT, do so.
-                    # data_index is where we found the attribute, so return
-                    # the next item that's actually in the sorted rows
-                    # (e.g. "David" is in the DB, and so is "Eric", and
-                    # "Eric" is the next-highest value after "David", so
-                    # we return "Eric")
-                    return "'%s'" % rows_sorted_by_attr_value[data_index+1][attr_index]
-                else:
-                    # We can't RSHIFT, return the unshifted value.
-                    print "End of data set! RSHIFT not performed."
-                    return attr_value
-
+                raise EndOfDataException("End of data set! RSHIFT not performed.")
             else:
-                if data_index > 0:
-                    # We can LSHIFT, do so.
-                    return "'%s'" % rows_sorted_by_attr_value[data_index-1][attr_index]
-                else:
-                    # We can't LSHIFT, return the unshifted value.
-                    print "End of data set! LSHIFT not performed."
-                    return attr_value
+                raise EndOfDataException("End of data set! LSHIFT not performed.")
+        else:
+            return quest.engine.quote(new_value)
 
     # Something happened, we couldn't shift at all. Return unshifted
     # value.
     return attr_value
 
-def parseStringAndShift(query, att, shift_type):
+def parseStringAndShift(query, att, shift_type, steps = 1, state = None):
     """
     Parses the given query and shifts its <att> attribute according
-    to shift_type. shift_type is either LSHIFT or RSHIFT.
+    to shift_type, steps times. shift_type is either LSHIFT or RSHIFT.
+    """
+    return parseStringAndShiftMany(query, {att.strip(): (shift_type, steps)}, state)
+
+def parseStringAndShiftMany(query, shifts, state = None):
     """
+    Parses the given query once and shifts several attributes in it.
+    shifts maps each attribute name to a (shift_type, steps) tuple, where
+    shift_type is either LSHIFT or RSHIFT. state is the ShiftState from
+    execute_query; if it's None, we call execute_query ourselves.
 
-    att = att.strip()
+    Raises DidNotShiftException if any of the attributes isn't in the
+    query.
+    """
+    if state is None:
+        state = execute_query(query, shifts.keys())
+    final_query, shifted_attributes = shiftTokens(query, shifts, state)
+    raise_unless_all_shifted(shifts, shifted_attributes)
+    return final_query
+
+def raise_unless_all_shifted(shifts, shifted_attributes):
+    """Raises DidNotShiftException if we missed any attribute in shifts."""
+    missing_attributes = [a for a in shifts if a not in shifted_attributes]
+    if missing_attributes:
+        err_msg = "Didn't shift: attribute %s not found in supplied query." % ", ".join(missing_attributes)
+        raise DidNotShiftException(err_msg)
+
+def shiftTokens(query, shifts, state):
+    """
+    Does the work for parseStringAndShiftMany. Returns a tuple of (the
+    shifted query, a set of the attributes that were actually shifted),
+    rather than raising if some weren't.
+    """
 
     # Remove repeated whitespace
     sanitized_query = rWhitespace.sub(' ', query)
@@ -288,8 +319,8 @@ def parseStringAndShift(query, att, shift_type):
     # Keep track of our index in the query string as we parse through it.
     i = 0
 
-    # Did we shift at all?
-    did_shift = False
+    # The attributes we've shifted so far
+    shifted_attributes = set()
 
     while i < len(split_query):
         token = split_query[i].strip()
@@ -300,6 +331,20 @@ def parseStringAndShift(query, att, shift_type):
             # Haven't found WHERE or HAVING yet, keep going.
             next
 
+        # Which of the attributes we're shifting (if any) is this token?
+        att = None
+        if token in shifts:
+            att = token
+        elif findOperator(token):
+            for candidate in shifts:
+                if candidate in token:
+                    att = candidate
+                    break
+        if att is None:
+            i += 1
+            continue
+        shift_type, steps = shifts[att]
+
         if att in token and findOperator(token):
             # "att< 3" (i.e. no space between attribute and operator)
             # or
@@ -321,14 +366,14 @@ def parseStringAndShift(query, att, shift_type):
             # or
             # "att > 'string'"
 
-            did_shift = True
+            shifted_attributes.add(att)
             operator = findOperator(split_query[i+1])
             tokens = rOperator.split(split_query[i+1])
 
             if tokens[-1] == '':
                 # FIXME: why check for an empty string here?
                 value = split_query[i+2]
-                new_value = shift(att, value, shift_type)
+                new_value = shift(state, att, value, shift_type, steps)
                 # end up with "att > 4", using the example above
                 split_query[i] = att
                 split_query[i+1] = operator
@@ -337,20 +382,20 @@ def parseStringAndShift(query, att, shift_type):
 
             else:
                 value = tokens[-1]
-                new_value = shift(att, value, shift_type)
+                new_value = shift(state, att, value, shift_type, steps)
                 split_query[i] = att
                 split_query[i+1] = operator + new_value
                 i += 1
 
         elif token == att and [s.lower() for s in split_query[i:i+2]] == ['not', 'between']:
             # "x NOT BETWEEN l_value AND r_value"
-            did_shift = True
+            shifted_attributes.add(att)
 
             l_value = split_query[i+3]
             r_value = split_query[i+5]
 
-            new_l_value = shift(att, l_value, shift_type)
-            new_r_value = shift(att, r_value, shift_type)
+            new_l_value = shift(state, att, l_value, shift_type, steps)
+            new_r_value = shift(state, att, r_value, shift_type, steps)
             # change l_value and r_value to new_l_value and
             # new_r_value, respectively
             split_query[i+3] = new_l_value
@@ -359,12 +404,12 @@ def parseStringAndShift(query, att, shift_type):
 
         elif token == att and split_query[i+1].lower() == 'between':
             # "x BETWEEN l_value AND r_value"
-            did_shift = True
+            shifted_attributes.add(att)
 
             l_value = split_query[i+2]
             r_value = split_query[i+4]
-            new_l_value = shift(att, l_value, shift_type)
-            new_r_value = shift(att, r_value, shift_type)
+            new_l_value = shift(state, att, l_value, shift_type, steps)
+            new_r_value = shift(state, att, r_value, shift_type, steps)
 
             # change l_value and r_value to new_l_value and
             # new_r_value, respectively
@@ -376,85 +421,130 @@ def parseStringAndShift(query, att, shift_type):
             # "att IN 'string'
             # or
             # "att IN (3,4,5)"
-            did_shift = True
+            shifted_attributes.add(att)
 
             # For "(3,4,5)", set i to the first index after the "(" and
             # iterate until we hit the ending ")"
             i += 3
             while split_query[i] != ')':
-                split_query[i] = shift(att, split_query[i], shift_type)
+                split_query[i] = shift(state, att, split_query[i], shift_type, steps)
                 i += 2
 
         elif token == att and [s.lower() for s in split_query[i:i+2]] == ['not', 'in'] and ("'" in split_query[i+4] or split_query[i+4].isdigit()):
             # "att NOT IN 'string'
             # or
             # "att NOT IN (3,4,5)"
-            did_shift = True
+            shifted_attributes.add(att)
 
             i += 4
             while split_query[i] != ')':
-                split_query[i] = shift(att, split_query[j], shift_type)
+                split_query[i] = shift(state, att, split_query[i], shift_type, steps)
                 i += 2
 
         elif token == att and split_query[i+1].lower() == 'like':
             # "att LIKE comparison"
-            did_shift = True
+            shifted_attributes.add(att)
 
             comparison = split_query[i+2]
-            split_query[i+2] = shift(att, comparison, shift_type)
+            split_query[i+2] = shift(state, att, comparison, shift_type, steps)
             i += 2
 
         elif token == att and [s.lower() for s in split_query[i:i+2]] == ['not', 'like']:
             # "att NOT LIKE comparison"
-            did_shift = True
+            shifted_attributes.add(att)
 
             comparison = split_query[i+3]
-            split_query[i+3] = shift(att, comparison, shift_type)
+            split_query[i+3] = shift(state, att, comparison, shift_type, steps)
             i += 3
 
         elif token == att and split_query[i+1] == ')' and findOperator(split_query[i+2]):
             # "att ) <operator> operand"
-            did_shift = True
+            shifted_attributes.add(att)
 
             operand = split_query[i+3]
-            split_query[i+3] = shift(att, operand, shift_type)
+            split_query[i+3] = shift(state, att, operand, shift_type, steps)
             i += 3
         i += 1
 
-    if not did_shift:
-        err_msg = "Didn't shift: attribute %s not found in supplied query." % att
-        raise DidNotShiftException(err_msg)
-    else:
-        final_query = ' '.join(split_query)
-        return final_query
+    final_query = ' '.join(split_query)
+    return (final_query, shifted_attributes)
 
-def rshift(query, attribute):
+def rshift(query, attribute, steps = 1):
     """Convenience method."""
-    # Need to run execute_query first
-    execute_query(query)
-    return parseStringAndShift(str(query), attribute, RSHIFT)
+    return shift_many(query, [(attribute, RSHIFT, steps)])
 
-def lshift(query, attribute):
+def lshift(query, attribute, steps = 1):
     """Convenience method."""
+    return shift_many(query, [(attribute, LSHIFT, steps)])
+
+def shift_many(query, shifts):
+    """
+    Shifts several attributes of query in one go. shifts is a list of
+    (attribute, shift_type, steps) tuples. The column types for all of
+    them are looked up at once, and the query is only parsed once.
+    """
+    shifts_by_attribute = normalize_shifts(shifts)
     # Need to run execute_query first
-    execute_query(query)
-    return parseStringAndShift(str(query), attribute, LSHIFT)
+    state = execute_query(query, shifts_by_attribute.keys())
+    return parseStringAndShiftMany(str(query), shifts_by_attribute, state)
+
+def shift_statement(parsed, shifts):
+    """
+    Like shift_many, but takes and returns a parsed Statement (see
+    quest.query.statement). Only the WHERE/HAVING predicates that mention
+    a shifted attribute are re-tokenized; the rest of the statement is
+    shared with the original.
+    """
+    shifts_by_attribute = normalize_shifts(shifts)
+    state = execute_query(parsed.sql(), shifts_by_attribute.keys())
+
+    shifted_attributes = set()
+    def shift_predicate(text):
+        # Only bother with predicates that mention an attribute
+        relevant_shifts = dict([(a, s) for a, s in shifts_by_attribute.items() if a in text])
+        if not relevant_shifts:
+            return text
+        new_text, shifted = shiftTokens(text, relevant_shifts, state)
+        if not shifted:
+            return text
+        shifted_attributes.update(shifted)
+        return new_text
+
+    new_parsed = parsed.map_predicates(shift_predicate)
+    raise_unless_all_shifted(shifts_by_attribute, shifted_attributes)
+    return new_parsed
+
+def normalize_shifts(shifts):
+    """
+    Turns a list of (attribute, shift_type, steps) tuples into a dict
+    mapping each attribute to (shift_type, steps), with steps a
+    non-negative int.
+    """
+    shifts_by_attribute = {}
+    for attribute, shift_type, steps in shifts:
+        steps = int(steps)
+        if steps < 0:
+            # Shifting right -3 times is shifting left 3 times
+            steps = -steps
+            if shift_type == RSHIFT:
+                shift_type = LSHIFT
+            else:
+                shift_type = RSHIFT
+        shifts_by_attribute[attribute.strip()] = (shift_type, steps)
+    return shifts_by_attribute
 
 def test_mysql(attribute = 'throws', shift_type = LSHIFT):
     """Test on MySQL database."""
 
-    mysql_db = MySQLdb.connect(host = "localhost", user = "root", passwd = "bergstrom", db = "baseball")
+    import quest.config
+    quest.config.db_password = "bergstrom"
+    quest.config.db_name = "baseball"
     mysql_query = 'select throws from playerStats'
     mysql_query = 'select * from playerStats where %s between 0 and 8000' % attribute
     print mysql_query
-    result = execute_query(mysql_db, mysql_query)
-    #print result_rows
-    if result is None:
-        print "No results returned, not shifting."
-        return None
-    else:
-        print meta_dict
-        print parseStringAndShift(mysql_query, attribute, shift_type)
+    state = execute_query(mysql_query)
+    print state.meta_dict
+    print parseStringAndShift(mysql_query, attribute, shift_type, state = state)
 
 if __name__ == "__main__":
     test_mysql()
@@ -0,0 +1,331 @@
+# A parsed, structured SELECT statement.
+#
+# A Query parses its SQL once into a Statement, and every operator
+# (narrow, relax, rollup, drilldown, rshift, lshift) builds its child's
+# Statement out of the parent's instead of re-tokenizing the SQL string.
+# Statements are never modified after they're built, so a child shares
+# every clause the operator didn't touch with its parent, and the SQL
+# text is only rendered (once) when someone asks for it.
+
+import re
+
+# The top-level clauses of a SELECT, in the order they have to appear.
+CLAUSES = ('select', 'from', 'where', 'group by', 'having', 'order by', 'limit')
+
+rClauseKeyword = re.compile(r"\b(select|from|where|group\s+by|having|order\s+by|limit)\b", re.I)
+rSelectModifier = re.compile(r"^(distinct|all|distinctrow)\s+", re.I)
+rOr = re.compile(r"\bor\b", re.I)
+rWhitespace = re.compile(r"\s+")
+# A quoted string or identifier, which parse leaves exactly as it is
+rQuoted = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)""")
+# A plain column name
+rColumn = re.compile(r"^\w+$")
+# A simple aggregate, e.g. "SUM( salary )" or "COUNT(*)"
+rAggregate = re.compile(r"^(count|sum|min|max|avg)\s*\(\s*(\*|\w+)\s*\)$", re.I)
+# A plain ORDER BY item, e.g. "year DESC"
+rOrderItem = re.compile(r"^(\w+)(?:\s+(asc|desc))?$", re.I)
+# "expression AS alias" (or with a quoted alias)
+rAlias = re.compile(r"^(.*?)\s+as\s+[`\"]?(\w+)[`\"]?$", re.I | re.S)
+
+class UnparseableStatement(Exception):
+    """Raised by parse() when a statement isn't a SELECT we understand."""
+    def __init__(self, value):
+        self.parameter = value
+    def __str__(self):
+        return repr(self.parameter)
+
+def collapse_whitespace(sql):
+    """sql with every run of whitespace outside of quotes made one space."""
+    pieces = rQuoted.split(sql)
+    # split() puts the quoted pieces at the odd indexes
+    for index in range(0, len(pieces), 2):
+        pieces[index] = rWhitespace.sub(' ', pieces[index])
+    return ''.join(pieces)
+
+def top_level_positions(text):
+    """
+    Returns a list of booleans, one per character of text, that's True
+    where the character is outside of any quotes or parentheses.
+    """
+    positions = []
+    depth = 0
+    quote = None
+    for char in text:
+        if quote is not None:
+            positions.append(False)
+            if char == quote:
+                quote = None
+        elif char in "'\"`":
+            positions.append(False)
+            quote = char
+        elif char == '(':
+            positions.append(False)
+            depth += 1
+        elif char == ')':
+            positions.append(False)
+            depth -= 1
+        else:
+            positions.append(depth == 0)
+    return positions
+
+def split_top_level(text, separator = ','):
+    """
+    Splits text on separator, ignoring separators inside quotes or
+    parentheses. Returns a tuple of stripped pieces.
+    """
+    top_level = top_level_positions(text)
+    pieces = []
+    start = 0
+    for index, char in enumerate(text):
+        if char == separator and top_level[index]:
+            pieces.append(text[start:index].strip())
+            start = index + 1
+    pieces.append(text[start:].strip())
+    return tuple(pieces)
+
+def has_top_level(regexp, text):
+    """Returns True if regexp matches somewhere outside quotes/parentheses."""
+    top_level = top_level_positions(text)
+    for match in regexp.finditer(text):
+        if top_level[match.start()]:
+            return True
+    return False
+
+def split_alias(item):
+    """
+    Splits a SELECT list item into (expression, alias). alias is None if
+    there isn't one.
+    """
+    match = rAlias.match(item)
+    if match:
+        return (match.group(1).strip(), match.group(2))
+    return (item, None)
+
+def aggregate(expression):
+    """
+    If expression is a simple aggregate like SUM(salary), returns
+    (function, argument), e.g. ("sum", "salary"); otherwise None.
+    """
+    match = rAggregate.match(expression)
+    if match:
+        return (match.group(1).lower(), match.group(2))
+    return None
+
+class Predicate:
+    """A leaf of a WHERE/HAVING predicate tree: a bit of raw SQL."""
+
+    def __init__(self, text):
+        self.text = text.strip()
+
+    def leaves(self):
+        return [self]
+
+    def map(self, function):
+        """
+        Returns a tree with function applied to the text of every leaf.
+        If function returns the text unchanged, so is the leaf.
+        """
+        new_text = function(self.text)
+        if new_text is self.text:
+            return self
+        return Predicate(new_text)
+
+    def render(self, parent_operator = None):
+        # AND binds tighter than OR, so "a = 1 OR b = 2" needs
+        # parentheses when it's ANDed with something else.
+        if parent_operator == 'AND' and has_top_level(rOr, self.text):
+            return "(%s)" % self.text
+        return self.text
+
+class Conjunction:
+    """Two predicates joined by AND or OR."""
+
+    def __init__(self, operator, left, right):
+        self.operator = operator
+        self.left = left
+        self.right = right
+
+    def leaves(self):
+        return self.left.leaves() + self.right.leaves()
+
+    def map(self, function):
+        new_left = self.left.map(function)
+        new_right = self.right.map(function)
+        if new_left is self.left and new_right is self.right:
+            return self
+        return Conjunction(self.operator, new_left, new_right)
+
+    def render(self, parent_operator = None):
+        text = "%s %s %s" % (self.left.render(self.operator), self.operator, self.right.render(self.operator))
+        if parent_operator == 'AND' and self.operator == 'OR':
+            return "(%s)" % text
+        return text
+
+class Statement:
+    """
+    An immutable, parsed SELECT statement. select, group_by and order_by
+    are tuples of expressions; where and having are predicate trees (or
+    None); everything else is kept as raw SQL text.
+    """
+
+    def __init__(self, select, from_clause, where = None, group_by = (),
+            having = None, order_by = (), limit = None, select_modifier = None):
+        self.select = select
+        self.from_clause = from_clause
+        self.where = where
+        self.group_by = group_by
+        self.having = having
+        self.order_by = order_by
+        self.limit = limit
+        self.select_modifier = select_modifier
+        # Rendered lazily by sql()
+        self._sql = None
+
+    def replace(self, **changes):
+        """
+        Returns a copy of this statement with the given clauses changed.
+        Every other clause is shared, not copied.
+        """
+        clauses = {
+                'select': self.select,
+                'from_clause': self.from_clause,
+                'where': self.where,
+                'group_by': self.group_by,
+                'having': self.having,
+                'order_by': self.order_by,
+                'limit': self.limit,
+                'select_modifier': self.select_modifier,
+                }
+        clauses.update(changes)
+        return Statement(**clauses)
+
+    def combine(self, clause, operator):
+        """
+        Returns a statement with clause joined (by operator, AND or OR) onto
+        the front of the WHERE and HAVING predicates. If there are neither,
+        clause becomes the WHERE.
+        """
+        new_predicate = Predicate(clause)
+        if self.where is None and self.having is None:
+            return self.replace(where = new_predicate)
+        changes = {}
+        if self.where is not None:
+            changes['where'] = Conjunction(operator, new_predicate, self.where)
+        if self.having is not None:
+            changes['having'] = Conjunction(operator, new_predicate, self.having)
+        return self.replace(**changes)
+
+    def narrow(self, clause):
+        """AND's this statement with the given predicate."""
+        return self.combine(clause, 'AND')
+
+    def relax(self, clause):
+        """OR's this statement with the given predicate."""
+        return self.combine(clause, 'OR')
+
+    def replace_attribute(self, target_attribute, new_attribute):
+        """
+        Returns a statement with target_attribute replaced by new_attribute
+        in the SELECT, GROUP BY and ORDER BY lists.
+        """
+        def replaced(attributes):
+            return tuple([new_attribute if attr == target_attribute else attr for attr in attributes])
+        return self.replace(select = replaced(self.select),
+                group_by = replaced(self.group_by),
+                order_by = replaced(self.order_by))
+
+    def map_predicates(self, function):
+        """
+        Returns a statement with function applied to the text of every
+        WHERE and HAVING leaf predicate.
+        """
+        changes = {}
+        if self.where is not None:
+            changes['where'] = self.where.map(function)
+        if self.having is not None:
+            changes['having'] = self.having.map(function)
+        return self.replace(**changes)
+
+    def sql(self):
+        """Renders (once) and returns the SQL text of this statement."""
+        if self._sql is None:
+            parts = ["SELECT"]
+            if self.select_modifier:
+                parts.append(self.select_modifier)
+            parts.append(", ".join(self.select))
+            parts.append("FROM %s" % self.from_clause)
+            if self.where is not None:
+                parts.append("WHERE %s" % self.where.render())
+            if self.group_by:
+                parts.append("GROUP BY %s" % ", ".join(self.group_by))
+            if self.having is not None:
+                parts.append("HAVING %s" % self.having.render())
+            if self.order_by:
+                parts.append("ORDER BY %s" % ", ".join(self.order_by))
+            if self.limit is not None:
+                parts.append("LIMIT %s" % self.limit)
+            self._sql = " ".join(parts)
+        return self._sql
+
+    def __str__(self):
+        return self.sql()
+
+def parse(sql):
+    """
+    Parses a SELECT statement into a Statement. Raises
+    UnparseableStatement if sql isn't a single SELECT whose top-level
+    clauses we recognize (e.g. a UNION, or no FROM clause).
+    """
+    sql = collapse_whitespace(sql).strip()
+    if sql.endswith(';'):
+        sql = sql[:-1].strip()
+
+    top_level = top_level_positions(sql)
+    # (clause name, start of keyword, end of keyword)
+    keywords = []
+    for match in rClauseKeyword.finditer(sql):
+        if top_level[match.start()]:
+            name = rWhitespace.sub(' ', match.group(1).lower())
+            keywords.append((name, match.start(), match.end()))
+
+    names = [name for name, start, end in keywords]
+    if len(keywords) == 0 or keywords[0][1] != 0 or names[0] != 'select':
+        raise UnparseableStatement("Not a SELECT: %s" % sql)
+    if 'from' not in names:
+        raise UnparseableStatement("No FROM clause: %s" % sql)
+    # Each clause can only appear once, and in the right order
+    if names != sorted(set(names), key = CLAUSES.index):
+        raise UnparseableStatement("Don't understand the clauses of: %s" % sql)
+
+    clauses = {}
+    for index, (name, start, end) in enumerate(keywords):
+        if index+1 < len(keywords):
+            clause_end = keywords[index+1][1]
+        else:
+            clause_end = len(sql)
+        clauses[name] = sql[end:clause_end].strip()
+        if clauses[name] == '':
+            raise UnparseableStatement("Empty %s clause: %s" % (name.upper(), sql))
+
+    select = clauses['select']
+    select_modifier = None
+    match = rSelectModifier.match(select)
+    if match:
+        select_modifier = match.group(1).upper()
+        select = select[match.end():]
+
+    where = None
+    if 'where' in clauses:
+        where = Predicate(clauses['where'])
+    having = None
+    if 'having' in clauses:
+        having = Predicate(clauses['having'])
+
+    return Statement(split_top_level(select),
+            clauses['from'],
+            where = where,
+            group_by = split_top_level(clauses['group by']) if 'group by' in clauses else (),
+            having = having,
+            order_by = split_top_level(clauses['order by']) if 'order by' in clauses else (),
+            limit = clauses.get('limit'),
+            select_modifier = select_modifier)
@@ -0,0 +1,266 @@
+# Precomputed summary tables for ROLLUP/DRILLDOWN.
+#
+# For a fact table and the measure columns users aggregate (e.g. salary),
+# build() makes one summary table per level of each hierarchy declared
+# with config.create_hierarchy. With lg > teamid > playerid, that's
+#   quest_summary_<table>_playerid: grouped by lg, teamid, playerid
+#   quest_summary_<table>_teamid: grouped by lg, teamid
+#   quest_summary_<table>_lg: grouped by lg
+# each holding the row count and the SUM, COUNT, MIN and MAX of every
+# measure. Only the finest level is built from the fact table; each level
+# above is rolled up from the one below it.
+#
+# When config.SUMMARY_TABLES_ENABLED is True, Query.show/stream ask route()
+# whether the smallest summary can answer their statement, e.g.
+#   SELECT teamid, SUM(salary) FROM players GROUP BY teamid
+# runs as
+#   SELECT teamid, SUM(sum_salary) AS `SUM(salary)` FROM quest_summary_players_teamid GROUP BY teamid
+# The query itself (and so what the user sees, and what later operators
+# work on) is unchanged.
+#
+# Summaries of a table are marked stale whenever Quest changes that table
+# (see quest.engine.invalidate_statement), and aren't used again until
+# refresh() rebuilds them.
+
+import re
+import threading
+
+import quest.engine
+import quest.config as config
+import statement
+
+# Anything that looks like a column name, and string literals, which don't
+rWord = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|[A-Za-z_][\w.]*")
+# Words in a WHERE clause that aren't column names
+SQL_WORDS = set(['and', 'or', 'not', 'in', 'between', 'like', 'is', 'null',
+    'true', 'false', 'escape'])
+
+# Maps a lowercased fact table name to its FactTable
+fact_tables = {}
+lock = threading.RLock()
+
+class Summary:
+    """One summary table: the fact table grouped by levels."""
+
+    def __init__(self, name, levels):
+        self.name = name
+        # The hierarchy's attributes from the top down to this level,
+        # e.g. ("lg", "teamid")
+        self.levels = tuple(levels)
+        # How many rows it has, set by build()
+        self.rows = None
+        self.stale = True
+
+class FactTable:
+    """A table with summaries, and the measures they aggregate."""
+
+    def __init__(self, table, measures):
+        self.table = table
+        self.measures = tuple(measures)
+        self.summaries = []
+
+def hierarchies():
+    """
+    Returns each hierarchy declared with config.create_hierarchy as a list
+    of attributes, parents first.
+    """
+    tops = [parent for parent in config.drilldown_parent2child if parent not in config.rollup_child2parent]
+    chains = []
+    for top in sorted(tops):
+        chain = [top]
+        while chain[-1] in config.drilldown_parent2child and len(chain) <= len(config.drilldown_parent2child):
+            chain.append(config.drilldown_parent2child[chain[-1]])
+        chains.append(chain)
+    return chains
+
+def summary_table_name(table, level):
+    return "quest_summary_%s_%s" % (table, level)
+
+def aggregate_columns(measures, finer_summary = False):
+    """
+    The aggregate part of a summary's SELECT list. If finer_summary is
+    True, we're rolling up another summary rather than the fact table.
+    """
+    if finer_summary:
+        columns = ["SUM(quest_rows) AS quest_rows"]
+        for measure in measures:
+            columns.append("SUM(sum_%s) AS sum_%s" % (measure, measure))
+            columns.append("SUM(count_%s) AS count_%s" % (measure, measure))
+            columns.append("MIN(min_%s) AS min_%s" % (measure, measure))
+            columns.append("MAX(max_%s) AS max_%s" % (measure, measure))
+    else:
+        columns = ["COUNT(*) AS quest_rows"]
+        for measure in measures:
+            columns.append("SUM(%s) AS sum_%s" % (measure, measure))
+            columns.append("COUNT(%s) AS count_%s" % (measure, measure))
+            columns.append("MIN(%s) AS min_%s" % (measure, measure))
+            columns.append("MAX(%s) AS max_%s" % (measure, measure))
+    return columns
+
+def build(table, measures):
+    """
+    Builds (or rebuilds) the summary tables of table for every declared
+    hierarchy, aggregating the given measure columns. Returns the list of
+    Summary objects.
+    """
+    with lock:
+        fact = FactTable(table, measures)
+        for chain in hierarchies():
+            source = None
+            # Finest level first, so each coarser one can use the last
+            for depth in range(len(chain), 0, -1):
+                summary = Summary(summary_table_name(table, chain[depth-1]), chain[:depth])
+                build_summary(fact, summary, source)
+                fact.summaries.append(summary)
+                source = summary
+        fact_tables[table.lower()] = fact
+        return fact.summaries
+
+def build_summary(fact, summary, source = None):
+    """Creates summary's table, from source (a finer Summary) if given."""
+    group_by = ", ".join(summary.levels)
+    if source is None:
+        from_table = fact.table
+        columns = aggregate_columns(fact.measures)
+    else:
+        from_table = source.name
+        columns = aggregate_columns(fact.measures, finer_summary = True)
+    quest.engine.run_sql("DROP TABLE IF EXISTS %s" % summary.name)
+    quest.engine.run_sql("CREATE TABLE %s AS SELECT %s, %s FROM %s GROUP BY %s" % (summary.name, group_by, ", ".join(columns), from_table, group_by))
+    summary.rows = quest.engine.run_sql("SELECT COUNT(*) FROM %s" % summary.name).fetchone()[0]
+    summary.stale = False
+
+def refresh(table = None):
+    """
+    Rebuilds the stale summaries of table (or of every table, if table is
+    None).
+    """
+    with lock:
+        if table is None:
+            facts = fact_tables.values()
+        else:
+            facts = [fact_tables[table.lower()]]
+        for fact in facts:
+            if any([summary.stale for summary in fact.summaries]):
+                build(fact.table, fact.measures)
+
+def drop(table):
+    """Drops the summary tables of table and stops routing to them."""
+    with lock:
+        fact = fact_tables.pop(table.lower(), None)
+        if fact is not None:
+            for summary in fact.summaries:
+                quest.engine.run_sql("DROP TABLE IF EXISTS %s" % summary.name)
+
+def mark_stale(tables):
+    """
+    quest.engine calls this when tables changed. If tables is empty, any
+    table could have changed.
+    """
+    with lock:
+        for name, fact in fact_tables.items():
+            if not tables or name in tables:
+                for summary in fact.summaries:
+                    summary.stale = True
+
+quest.engine.add_invalidation_listener(mark_stale)
+
+def route(parsed):
+    """
+    Returns the SQL to run parsed (a statement.Statement) against the
+    smallest summary table that can answer it, or None if it has to run
+    against the fact table (or summaries are turned off).
+    """
+    if not config.SUMMARY_TABLES_ENABLED or not fact_tables:
+        return None
+    with lock:
+        fact = fact_tables.get(parsed.from_clause.strip().lower())
+        if fact is None or parsed.having is not None:
+            return None
+
+        needed_columns = set()
+        select = []
+        has_aggregate = False
+        for item in parsed.select:
+            item, alias = statement.split_alias(item)
+            function_and_argument = statement.aggregate(item)
+            if function_and_argument is not None:
+                rewritten = rewrite_aggregate(function_and_argument[0], function_and_argument[1], fact.measures)
+                if rewritten is None:
+                    return None
+                has_aggregate = True
+                select.append("%s AS `%s`" % (rewritten, alias or item))
+            elif statement.rColumn.match(item):
+                needed_columns.add(item)
+                if alias:
+                    select.append("%s AS %s" % (item, alias))
+                else:
+                    select.append(item)
+            else:
+                # e.g. SELECT *, or an expression
+                return None
+
+        for item in parsed.group_by:
+            if not statement.rColumn.match(item):
+                return None
+            needed_columns.add(item)
+        # Without a GROUP BY, only aggregates are answerable: a summary
+        # has one row per group, not one per fact
+        if not parsed.group_by and not (has_aggregate and not needed_columns):
+            return None
+        # Every plain column has to be grouped on
+        if not needed_columns <= set(parsed.group_by):
+            return None
+
+        for item in parsed.order_by:
+            match = statement.rOrderItem.match(item)
+            if not match:
+                return None
+            needed_columns.add(match.group(1))
+
+        if parsed.where is not None:
+            for leaf in parsed.where.leaves():
+                for word in rWord.findall(leaf.text):
+                    if word[0] in "'\"" or word.lower() in SQL_WORDS:
+                        continue
+                    if '.' in word:
+                        # A qualified name; don't try to be clever
+                        return None
+                    needed_columns.add(word)
+
+        summary = smallest_summary(fact, needed_columns)
+        if summary is None:
+            return None
+        return parsed.replace(select = tuple(select), from_clause = summary.name).sql()
+
+def rewrite_aggregate(function, argument, measures):
+    """
+    Returns the summary-table version of function(argument), e.g.
+    ("sum", "salary") => "SUM(sum_salary)", or None if we can't.
+    """
+    if argument == '*':
+        if function == 'count':
+            return "SUM(quest_rows)"
+        return None
+    if argument not in measures:
+        return None
+    if function == 'sum':
+        return "SUM(sum_%s)" % argument
+    elif function == 'count':
+        return "SUM(count_%s)" % argument
+    elif function == 'min':
+        return "MIN(min_%s)" % argument
+    elif function == 'max':
+        return "MAX(max_%s)" % argument
+    elif function == 'avg':
+        # * 1.0 so SQLite doesn't do integer division
+        return "SUM(sum_%s) * 1.0 / SUM(count_%s)" % (argument, argument)
+    return None
+
+def smallest_summary(fact, needed_columns):
+    """The fresh summary of fact with the fewest rows that has every needed column."""
+    candidates = [summary for summary in fact.summaries
+            if not summary.stale and needed_columns <= set(summary.levels)]
+    if not candidates:
+        return None
+    return min(candidates, key = lambda summary: summary.rows)
@@ -0,0 +1,32 @@
+# A Session is everything one user's Quest session remembers from one
+# command to the next: their query variables and which query is the most
+# recent one. The REPL has exactly one user, so it always uses
+# default_session. The web app keeps one Session per browser (see
+# quest.web.quest_app), so analysts using it at the same time can't
+# trample each other's queries.
+
+import uuid
+
+from quest.query import query_cache
+
+class Session:
+    def __init__(self, cache = None):
+        """
+        cache is the QueryCache to keep query variables in. If it's None,
+        the session gets a brand new, empty one.
+        """
+        self.id = uuid.uuid4().hex
+        if cache is None:
+            cache = query_cache.QueryCache()
+        self.query_cache = cache
+        # The quest.query.prefetch.Plan prefetching around the last
+        # shifted query this session showed, or None
+        self.prefetch_plan = None
+
+    def most_recent_key_and_query(self):
+        """Returns the (key, query) tuple that was most recently stored."""
+        return self.query_cache.most_recent_key_and_query
+
+# Used whenever input_handler.handle isn't given a session. It shares
+# query_cache.default_cache with the module-level query_cache functions.
+default_session = Session(query_cache.default_cache)
@@ -0,0 +1,106 @@
+# Statement statistics, so we can see where a Quest session spends its
+# time.
+#
+# quest.engine reports every statement it runs (and every SHOW it answers
+# without the DB) as a StatementEvent. We keep the last
+# config.STATS_HISTORY_SIZE of them in memory, and append the slow ones
+# to config.SLOW_QUERY_LOG. The "stats" command prints summary().
+
+import collections
+import sys
+import threading
+import time
+
+import quest.engine
+import quest.config as config
+
+lock = threading.Lock()
+# The most recent StatementEvents, oldest first
+history = collections.deque(maxlen = config.STATS_HISTORY_SIZE)
+
+def record(event):
+    """quest.engine calls this after every statement."""
+    global history
+    if not config.STATS_ENABLED:
+        return
+    with lock:
+        if history.maxlen != config.STATS_HISTORY_SIZE:
+            history = collections.deque(history, maxlen = config.STATS_HISTORY_SIZE)
+        history.append(event)
+    if config.SLOW_QUERY_LOG is not None and event.total_seconds() >= config.SLOW_QUERY_SECONDS:
+        log_slow_statement(event)
+
+quest.engine.add_statement_listener(record)
+
+def events():
+    """A list of the remembered StatementEvents, oldest first."""
+    with lock:
+        return list(history)
+
+def clear():
+    with lock:
+        history.clear()
+
+def describe_lineage(lineage):
+    """e.g. "narrow > rollup", or "query" for a query the user typed in."""
+    if not lineage:
+        return "query"
+    return " > ".join(lineage)
+
+def log_slow_statement(event):
+    entry = "# %s total: %.3fs execute: %.3fs fetch: %.3fs rows: %d bytes: %d source: %s lineage: %s%s\n%s\n" % (
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(event.started_at)),
+            event.total_seconds(), event.execute_seconds, event.fetch_seconds,
+            event.rows, event.bytes, event.source, describe_lineage(event.lineage),
+            event.error and " error: %s" % event.error or "",
+            quest.engine.with_semicolon(event.sql.strip()))
+    try:
+        with lock:
+            log_file = open(config.SLOW_QUERY_LOG, 'a')
+            try:
+                log_file.write(entry)
+            finally:
+                log_file.close()
+    except IOError as e:
+        # Losing a log entry shouldn't lose the user their query
+        sys.stderr.write("Couldn't write to the slow query log %s: %s\n" % (config.SLOW_QUERY_LOG, e))
+
+def summary(slowest = 5):
+    """
+    Returns a report of the remembered statements: totals, a breakdown by
+    the operator that made each query and where its rows came from, and
+    the slowest few statements.
+    """
+    remembered = events()
+    if not remembered:
+        return "No statements yet."
+
+    lines = []
+    total_seconds = sum([event.total_seconds() for event in remembered])
+    lines.append("%d statements in %.3fs (execute %.3fs, fetch %.3fs), %d rows, %d bytes" % (
+            len(remembered), total_seconds,
+            sum([event.execute_seconds for event in remembered]),
+            sum([event.fetch_seconds for event in remembered]),
+            sum([event.rows for event in remembered]),
+            sum([event.bytes for event in remembered])))
+    errors = len([event for event in remembered if event.error is not None])
+    if errors:
+        lines.append("%d of them failed" % errors)
+
+    for title, key in (("By operator:", lambda event: event.lineage and event.lineage[-1] or "query"),
+            ("By source:", lambda event: event.source)):
+        lines.append(title)
+        # Maps key to [statements, seconds, rows]
+        totals = collections.defaultdict(lambda: [0, 0.0, 0])
+        for event in remembered:
+            entry = totals[key(event)]
+            entry[0] += 1
+            entry[1] += event.total_seconds()
+            entry[2] += event.rows
+        for name, (count, seconds, rows) in sorted(totals.items(), key = lambda item: -item[1][1]):
+            lines.append("  %-10s %6d statements %10.3fs %10d rows" % (name, count, seconds, rows))
+
+    lines.append("Slowest:")
+    for event in sorted(remembered, key = lambda event: -event.total_seconds())[:slowest]:
+        lines.append("  %.3fs %s (%s): %s" % (event.total_seconds(), describe_lineage(event.lineage), event.source, event.sql.strip()))
+    return "\n".join(lines)
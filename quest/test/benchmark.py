@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+"""
+Times Quest's operators end to end over synthetic tables, and reports the
+results as JSON so they can be compared from run to run.
+
+For each table size, this creates a table (bench_<rows>) of random rows
+with numeric (year, salary), date (day) and string columns, where the
+string columns make up a hierarchy (by default league > team > player)
+that is registered with config.create_hierarchy. Then it times narrow,
+relax, rshift, lshift, rollup, drilldown, relate, store and show, each
+including the time taken to fetch every row of the result.
+
+The command-line usage is like:
+    $ benchmark.py --rows 10000,100000 --repeat 20 --output today.json
+    $ benchmark.py --rows 10000,100000 --compare yesterday.json
+By default it runs against an in-memory SQLite DB, so it needs no DB
+server. Use --backend mysql (and the --db-* options) to run against
+MySQL instead; the bench_* tables are dropped and recreated there.
+
+For each operator, the report has:
+    p50_ms, p95_ms: median and 95th percentile time per run
+    rows: rows the operator's query returned
+    rows_per_sec: rows / median time
+    peak_rss_kb: the process's peak resident memory so far (this only
+                 ever goes up, so look at where it jumps)
+"""
+
+import sys
+import time
+import json
+import random
+import datetime
+import platform
+from optparse import OptionParser
+
+try:
+    import resource
+except ImportError:
+    # Not on Unix, so we can't report memory use
+    resource = None
+
+import quest.config as config
+import quest.engine
+from quest.query.query import Query
+
+# Every operator we time, in the order they run
+OPERATORS = ('show', 'narrow', 'relax', 'rshift', 'lshift', 'rshift_string',
+        'rollup', 'drilldown', 'relate', 'store')
+
+# Rows go to the DB this many at a time
+INSERT_BATCH_SIZE = 10000
+
+# year is between FIRST_YEAR and FIRST_YEAR+YEARS-1
+FIRST_YEAR = 2000
+YEARS = 20
+
+def peak_rss_kb():
+    """Returns the peak resident memory of this process in KB, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # OS X reports bytes, Linux reports KB
+        peak = peak / 1024
+    return peak
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+def hierarchy_value(level_name, index):
+    """e.g. ("team", 42) => "team00042" """
+    return "%s%05d" % (level_name, index)
+
+def generate_rows(number_of_rows, hierarchy, fanout, seed):
+    """
+    Generates (id, year, day, salary, <one value per hierarchy level>)
+    tuples. The top level of hierarchy has fanout distinct values, and
+    every value has fanout children at the level below.
+    """
+    rng = random.Random(seed)
+    leaves = fanout ** len(hierarchy)
+    first_day = datetime.date(FIRST_YEAR, 1, 1)
+    for row_id in xrange(number_of_rows):
+        leaf = rng.randrange(leaves)
+        levels = []
+        for depth, level_name in enumerate(hierarchy):
+            # Each level up divides by another factor of fanout
+            levels.append(hierarchy_value(level_name, leaf // fanout ** (len(hierarchy) - depth - 1)))
+        year = FIRST_YEAR + rng.randrange(YEARS)
+        day = first_day + datetime.timedelta(days = rng.randrange(YEARS * 365))
+        salary = round(rng.uniform(10000, 1000000), 2)
+        yield tuple([row_id, year, day, salary] + levels)
+
+def batches(rows, batch_size):
+    """Splits an iterable of rows into lists of at most batch_size rows."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def drop_table(table_name):
+    quest.engine.run_sql("DROP TABLE IF EXISTS %s" % table_name)
+
+def insert_rows(table_name, column_names, rows):
+    """Inserts rows into table_name, INSERT_BATCH_SIZE at a time."""
+    placeholders = ", ".join(["%s"] * len(column_names))
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (table_name, ", ".join(column_names), placeholders)
+    sql, ignored = quest.engine.get_backend().prepare(sql, ())
+    with quest.engine.checkout_connection() as connection:
+        cursor = connection.cursor()
+        try:
+            for batch in batches(rows, INSERT_BATCH_SIZE):
+                cursor.executemany(sql, batch)
+            connection.commit()
+        finally:
+            cursor.close()
+
+def create_tables(table_name, number_of_rows, hierarchy, fanout, seed):
+    """
+    Creates and fills table_name, plus a small table_name_<top level>
+    table for relate to join it with. Returns how long it took, in seconds.
+    """
+    start = time.time()
+    top_level = hierarchy[0]
+    dimension_table = "%s_%s" % (table_name, top_level)
+    drop_table(table_name)
+    drop_table(dimension_table)
+
+    columns = ["id INTEGER PRIMARY KEY", "year INTEGER", "day DATE", "salary DOUBLE"]
+    columns += ["%s VARCHAR(20)" % level_name for level_name in hierarchy]
+    quest.engine.run_sql("CREATE TABLE %s (%s)" % (table_name, ", ".join(columns)))
+    column_names = ["id", "year", "day", "salary"] + list(hierarchy)
+    insert_rows(table_name, column_names, generate_rows(number_of_rows, hierarchy, fanout, seed))
+    # The columns the operators filter and group on
+    for column_name in ["year"] + list(hierarchy):
+        quest.engine.run_sql("CREATE INDEX %s_by_%s ON %s (%s)" % (table_name, column_name, table_name, column_name))
+
+    quest.engine.run_sql("CREATE TABLE %s (%s VARCHAR(20) PRIMARY KEY, label VARCHAR(40))" % (dimension_table, top_level))
+    insert_rows(dimension_table, [top_level, "label"],
+            [(hierarchy_value(top_level, i), "Label %d" % i) for i in xrange(fanout)])
+    return time.time() - start
+
+def operators(table_name, hierarchy):
+    """
+    Returns a dict mapping each name in OPERATORS to a function that
+    applies that operator and returns the resulting Query (or, for store,
+    the name of the table it made).
+    """
+    base = Query("SELECT * FROM %s WHERE year = %d" % (table_name, FIRST_YEAR + YEARS // 2))
+    top_level = hierarchy[0]
+    bottom_level = hierarchy[-1]
+    by_string = Query("SELECT * FROM %s WHERE %s = '%s'" % (table_name, top_level, hierarchy_value(top_level, 0)))
+    by_bottom = Query("SELECT %s, COUNT(*), SUM(salary) FROM %s GROUP BY %s" % (bottom_level, table_name, bottom_level))
+    by_top = Query("SELECT %s, COUNT(*), SUM(salary) FROM %s GROUP BY %s" % (top_level, table_name, top_level))
+    # A table name on its own would make "(bench_N) AS quest_left",
+    # which MySQL won't take as a derived table
+    whole_table = Query("SELECT * FROM %s" % table_name)
+    stored_tables = []
+
+    def store():
+        stored_table = "%s_stored_%d" % (table_name, len(stored_tables))
+        stored_tables.append(stored_table)
+        drop_table(stored_table)
+        base.store(stored_table)
+        return stored_table
+
+    return {
+            'show': lambda: base,
+            'narrow': lambda: base.narrow("salary > 500000"),
+            'relax': lambda: base.relax("year = %d" % FIRST_YEAR),
+            'rshift': lambda: base.rshift('year'),
+            'lshift': lambda: base.lshift('year'),
+            'rshift_string': lambda: by_string.rshift(top_level),
+            'rollup': lambda: by_bottom.rollup(bottom_level),
+            'drilldown': lambda: by_top.drilldown(top_level),
+            'relate': lambda: whole_table.relate("%s_%s" % (table_name, top_level)),
+            'store': store,
+            }
+
+def time_operator(operator, repeat):
+    """
+    Runs operator (and fetches every row of its result) repeat times, and
+    returns the report for it.
+    """
+    times = []
+    number_of_rows = 0
+    for run in xrange(repeat):
+        start = time.time()
+        result = operator()
+        if isinstance(result, Query):
+            rows = result.show(config.ALL_ROWS)
+        else:
+            # store returned a table name
+            rows = quest.engine.run_sql("SELECT COUNT(*) FROM %s" % result).fetchall()
+            rows = range(rows[0][0])
+            drop_table(result)
+        times.append(time.time() - start)
+        number_of_rows = len(rows)
+        # Don't let one run's rows inflate the next run's memory
+        del rows
+    times.sort()
+    p50 = percentile(times, 0.5)
+    return {
+            'p50_ms': round(p50 * 1000, 3),
+            'p95_ms': round(percentile(times, 0.95) * 1000, 3),
+            'rows': number_of_rows,
+            'rows_per_sec': round(number_of_rows / p50, 1) if p50 > 0 else None,
+            'peak_rss_kb': peak_rss_kb(),
+            }
+
+def run(row_counts, repeat, hierarchy, fanout, seed, only = None):
+    """Runs the whole benchmark and returns the report as a dict."""
+    config.create_hierarchy(hierarchy)
+    report = {
+            'started': datetime.datetime.now().isoformat(),
+            'backend': config.db_backend,
+            'python': platform.python_version(),
+            'repeat': repeat,
+            'hierarchy': list(hierarchy),
+            'fanout': fanout,
+            'seed': seed,
+            'sizes': [],
+            }
+    for number_of_rows in row_counts:
+        table_name = "bench_%d" % number_of_rows
+        load_seconds = create_tables(table_name, number_of_rows, hierarchy, fanout, seed)
+        print >> sys.stderr, "%s: loaded %d rows in %.1fs" % (table_name, number_of_rows, load_seconds)
+        results = {}
+        table_operators = operators(table_name, hierarchy)
+        for name in OPERATORS:
+            if only and name not in only:
+                continue
+            results[name] = time_operator(table_operators[name], repeat)
+            print >> sys.stderr, "  %-14s p50 %10.3fms  p95 %10.3fms" % (name, results[name]['p50_ms'], results[name]['p95_ms'])
+        report['sizes'].append({
+            'rows': number_of_rows,
+            'load_seconds': round(load_seconds, 3),
+            'operators': results,
+            })
+    return report
+
+def compare(old_report, new_report):
+    """Prints (to stderr) how each operator's p50 changed between two reports."""
+    old_sizes = dict([(size['rows'], size['operators']) for size in old_report['sizes']])
+    for size in new_report['sizes']:
+        if size['rows'] not in old_sizes:
+            continue
+        print >> sys.stderr, "%d rows:" % size['rows']
+        for name in OPERATORS:
+            old = old_sizes[size['rows']].get(name)
+            new = size['operators'].get(name)
+            if old is None or new is None or not old['p50_ms']:
+                continue
+            change = (new['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100
+            print >> sys.stderr, "  %-14s %10.3fms -> %10.3fms (%+.1f%%)" % (name, old['p50_ms'], new['p50_ms'], change)
+
+def parse_row_count(text):
+    """Turns "10000", "100K" or "10M" into an int."""
+    text = text.strip().upper()
+    multiplier = 1
+    if text.endswith('K'):
+        multiplier = 1000
+        text = text[:-1]
+    elif text.endswith('M'):
+        multiplier = 1000000
+        text = text[:-1]
+    return int(text) * multiplier
+
+if __name__ == "__main__":
+    parser = OptionParser(usage = "%prog [options]")
+    parser.add_option("--rows", default = "10K,100K",
+            help = "comma-separated table sizes, e.g. 10K,1M,10M [default: %default]")
+    parser.add_option("--repeat", type = "int", default = 10,
+            help = "runs per operator [default: %default]")
+    parser.add_option("--hierarchy", default = "league,team,player",
+            help = "comma-separated string columns, parents first [default: %default]")
+    parser.add_option("--fanout", type = "int", default = 10,
+            help = "children per hierarchy value [default: %default]")
+    parser.add_option("--seed", type = "int", default = 0)
+    parser.add_option("--only", help = "comma-separated operators to run (default: all)")
+    parser.add_option("--output", help = "write the JSON report here instead of stdout")
+    parser.add_option("--compare", help = "a previous JSON report to compare against")
+    parser.add_option("--backend", default = "sqlite", help = "mysql or sqlite [default: %default]")
+    parser.add_option("--db-name", default = ":memory:", help = "[default: %default]")
+    parser.add_option("--db-host", default = config.db_host)
+    parser.add_option("--db-user", default = config.db_user)
+    parser.add_option("--db-password", default = config.db_password)
+    options, args = parser.parse_args()
+
+    config.db_backend = options.backend
+    config.db_name = options.db_name
+    config.db_host = options.db_host
+    config.db_user = options.db_user
+    config.db_password = options.db_password
+    # Every run should hit the DB
+    config.RESULT_CACHE_ENABLED = False
+    config.SUMMARY_TABLES_ENABLED = False
+    config.KEEP_RESULT_ROWS = 0
+    config.LOCAL_ROLLUP = False
+    config.LOCAL_NARROW = False
+    config.PREFETCH_SHIFTS = False
+    config.MATERIALIZE_ENABLED = False
+    # ...and the indexes shouldn't change under it
+    config.INDEX_ADVISOR_ENABLED = False
+
+    hierarchy = [level.strip() for level in options.hierarchy.split(',')]
+    if len(hierarchy) < 2:
+        parser.error("--hierarchy needs at least 2 columns")
+    only = None
+    if options.only:
+        only = [name.strip() for name in options.only.split(',')]
+        unknown = [name for name in only if name not in OPERATORS]
+        if unknown:
+            parser.error("unknown operators: %s" % ", ".join(unknown))
+
+    row_counts = [parse_row_count(text) for text in options.rows.split(',')]
+    report = run(row_counts, options.repeat, hierarchy, options.fanout, options.seed, only)
+
+    output = json.dumps(report, indent = 2, sort_keys = True)
+    if options.output:
+        open(options.output, 'w').write(output + "\n")
+    else:
+        print output
+
+    if options.compare:
+        compare(json.load(open(options.compare)), report)
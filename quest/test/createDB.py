@@ -3,23 +3,67 @@
 This can be run from the command line, to set up a test MySQL database.
 The command-line usage is like:
     $ createDB.py csv_file_name db_name, table_name db_user db_password
+    $ createDB.py --batch-size 50000 --load-data csv_file_name db_name table_name db_user db_password
 Or, you can create a file containing the following:
     from quest.test import createDB
     createDB.create_db_from_csv_file(csv_file, db_name, table_name, db_username, db_password)
+
+To load many CSV files into many tables at once, write a manifest (a JSON
+file) like this:
+    {
+        "db_name": "baseball",
+        "tables": [
+            {"csv": "players.csv", "table": "players", "primary_key": ["playerid", "year"],
+             "indexes": [["teamid"], ["lg", "year"]]},
+            {"csv": "teams.csv", "table": "teams"}
+        ]
+    }
+and run:
+    $ createDB.py --manifest manifest.json [--workers 8] db_user db_password
+CSV paths are relative to the manifest. The tables are loaded in parallel
+by a pool of worker processes (one per CPU by default). Each table is
+dropped and recreated, but the DB itself and any other tables in it are
+left alone. Indexes (each a list of columns) are created after the table
+is loaded, which is much faster than updating them row by row.
+
+The CSV file is streamed, batch_size rows at a time, so files much bigger
+than memory load fine. Each batch goes to the DB as a single multi-row
+INSERT, or with use_load_data (--load-data), as a LOAD DATA LOCAL INFILE
+(faster still, but the MySQL server needs local_infile turned on).
+Progress and throughput are printed as we go.
 create_db_from_csv_file only allows one table to be created from the
 given csv_file.  It assumes that the csv file is formatted like so:
     col_name1,col_name2,...,last_col_name
-    type_of_col1,type_of_col2,...,type_of_last_column
-    primary_key_boolean1,primary_key_boolean2,...,primary_key_boolean_for_last_column
     # Every line after this is a row where the i'th item is the row's
     # value for the i'th column
 
+The column types are worked out from the data, in one pass over the file
+before it's loaded (see infer_column_types): integers get the smallest of
+SMALLINT, INTEGER or BIGINT that fits, reals a NUMERIC with just enough
+digits, YYYY-MM-DD values a DATE, YYYY-MM-DD HH:MM:SS values a DATETIME,
+and everything else a VARCHAR as long as the longest value. Pass
+primary_key (a list of column names), or "primary_key" in a manifest, to
+give the table a primary key. --sample-rows only looks at the first rows
+of the file, which is quicker but risks a column too narrow for the rest.
+
+Files can instead spell out the types and primary key in the two rows
+after the column names:
+    col_name1,col_name2,...,last_col_name
+    type_of_col1,type_of_col2,...,type_of_last_column
+    primary_key_boolean1,primary_key_boolean2,...,primary_key_boolean_for_last_column
+
 The second row, with the type_of_col1, allows for 3 types: STRING, INTEGER, or REAL (a non-integer).
 The third row, with primary_key_boolean's, should have the string "TRUE" if this column is part of the primary key, and "FALSE" if it is not.
 """
 
 import sys
 import csv
+import time
+import decimal
+import datetime
+import tempfile
+import multiprocessing
+from optparse import OptionParser
 
 # When we hit a warning, turn it into an error so we crash and get a
 # stack trace.
@@ -33,35 +77,80 @@ except ImportError:
 
 try:
     import sqlalchemy
-    from sqlalchemy import create_engine, MetaData, Table, Column
+    from sqlalchemy import create_engine, MetaData, Table, Column, Index
     from sqlalchemy import Integer, Numeric, Unicode
 except ImportError:
     sys.exit("ERROR: install sqlalchemy.")
 
+# Reading CSV files and inferring their types doesn't need the DB, so it
+# lives in ingest
+from ingest import NULL_VALUES, rDate, read_chunks, is_type_row, \
+        infer_column_specs, read_manifest
+
 # global vars (initialized in initialize_db)
 engine = None
 metadata = None
 connection = None
 
-def create_db_from_csv_file(file_name, db_name, table_name, user, password):
+# How many CSV rows are read, cleaned up and sent to the DB at a time
+DEFAULT_BATCH_SIZE = 10000
+
+def create_db_from_csv_file(file_name, db_name, table_name, user, password,
+        batch_size = DEFAULT_BATCH_SIZE, use_load_data = False, progress = None,
+        primary_key = None, sample_rows = None):
     """
     Takes a filename to parse, db_name to write, and table_name to
     create and populate.
+
+    The rows are read and loaded batch_size at a time. If use_load_data is
+    True, each batch is loaded with LOAD DATA LOCAL INFILE instead of an
+    INSERT. progress is called after each batch with (rows loaded so far,
+    seconds since we started); it defaults to print_progress.
+    primary_key and sample_rows are as for load_csv_file.
     """
 
+    initialize_db(db_name, user, password)
+    return load_csv_file(file_name, table_name, batch_size, use_load_data, progress,
+            primary_key = primary_key, sample_rows = sample_rows)
+
+def load_csv_file(file_name, table_name, batch_size = DEFAULT_BATCH_SIZE,
+        use_load_data = False, progress = None, indexes = (), replace = False,
+        primary_key = None, sample_rows = None):
+    """
+    Creates table_name in the DB initialize_db connected to, and loads
+    file_name into it. indexes is a list of lists of column names to
+    index once the rows are in. If replace is True, an existing table
+    called table_name is dropped first. Returns the number of rows loaded.
+
+    Unless the file has rows of types and primary keys after its column
+    names, the types are inferred (from the first sample_rows rows, or the
+    whole file if that's None) and primary_key is a list of the columns
+    that make up the primary key, if any.
+    """
     csv_file = csv.reader(open(file_name))
     column_names = [elem.strip() for elem in csv_file.next()]
-    column_types = derive_column_types(csv_file.next())
-    primary_keys = derive_keys(csv_file.next())
+    first_row = next(csv_file, None)
+    if first_row is not None and is_type_row(first_row):
+        column_types = derive_column_types(first_row)
+        primary_keys = derive_keys(csv_file.next())
+    else:
+        column_types = infer_column_types(file_name, batch_size, sample_rows)
+        primary_key = primary_key or []
+        unknown_columns = [name for name in primary_key if name not in column_names]
+        if unknown_columns:
+            raise ValueError("Primary key columns not in %s: %s" % (file_name, ", ".join(unknown_columns)))
+        primary_keys = [column_name in primary_key for column_name in column_names]
+        # Start over, just after the column names
+        csv_file = csv.reader(open(file_name))
+        csv_file.next()
 
-    # the rest of the CSV file
-    data = list(csv_file)
-
-    # initialize db, create table with metadata, populate table with data
-    initialize_db(db_name, user, password)
-    data = cleanup_data(data, column_types)
-    table = create_table(table_name, column_names, column_types, primary_keys)
-    populate_table(table, column_names, data)
+    # create table with metadata, populate table with the rest of the CSV
+    # file
+    table = create_table(table_name, column_names, column_types, primary_keys, replace)
+    chunks = (cleanup_data(chunk, column_types) for chunk in read_chunks(csv_file, batch_size))
+    rows_loaded = populate_table(table, column_names, chunks, use_load_data, progress)
+    create_indexes(table, indexes)
+    return rows_loaded
 
 def cleanup_data(rows, column_types):
     """
@@ -74,48 +163,76 @@ def cleanup_data(rows, column_types):
     # Perform matrix transposition so that each item in rows becomes a
     # column
     columns = zip(*rows)
+    def cleanup_date(elem, date_format):
+        # Change '-' and '' to NULL
+        elem = elem.strip()
+        if elem in NULL_VALUES:
+            return None
+        if date_format is None:
+            # A datetime, although some values may be just dates
+            elem = elem.replace('T', ' ')
+            if rDate.match(elem):
+                date_format = '%Y-%m-%d'
+            elif '.' in elem:
+                date_format = '%Y-%m-%d %H:%M:%S.%f'
+            else:
+                date_format = '%Y-%m-%d %H:%M:%S'
+            return datetime.datetime.strptime(elem, date_format)
+        return datetime.datetime.strptime(elem, date_format).date()
+
     def cleanup_numeric(elem, numeric_type):
-        # Change '-' and '' to 0
-        if str(elem).strip() in ['-', '']:
-            return 0
+        # Change '-' and '' to NULL, like cleanup_date
+        if str(elem).strip() in NULL_VALUES:
+            return None
         else:
             try:
                 return numeric_type(elem.strip())
-            except ValueError as ve:
+            except (ValueError, decimal.InvalidOperation) as ve:
                 print "|%s|" % elem.strip()
                 print ve
-                raise TypeError("%s is of wrong type (expected %s, got %s)" % (element, numeric_type, type(element)))
+                raise TypeError("%s is of wrong type (expected %s, got %s)" % (elem, numeric_type, type(elem)))
 
     for index, column_type in enumerate(column_types):
         if isinstance(column_type, sqlalchemy.types.Integer):
             columns[index] = [cleanup_numeric(elem, int) for elem in columns[index]]
-        elif isinstance(column_type, sqlalchemy.types.Numeric):
+        elif isinstance(column_type, sqlalchemy.types.Float):
             columns[index] = [cleanup_numeric(elem, float) for elem in columns[index]]
+        elif isinstance(column_type, sqlalchemy.types.Numeric):
+            # Not float, which would lose digits a NUMERIC keeps
+            columns[index] = [cleanup_numeric(elem, decimal.Decimal) for elem in columns[index]]
+        elif isinstance(column_type, sqlalchemy.types.DateTime):
+            columns[index] = [cleanup_date(elem, None) for elem in columns[index]]
+        elif isinstance(column_type, sqlalchemy.types.Date):
+            columns[index] = [cleanup_date(elem, '%Y-%m-%d') for elem in columns[index]]
         elif isinstance(column_type, sqlalchemy.types.Unicode):
-            # Convert to unicode
-            columns[index] = [unicode(elem) for elem in columns[index]]
+            # Convert to unicode (the widths infer_column_types picks
+            # are in UTF-8 characters, not bytes)
+            columns[index] = [elem.decode('utf-8') for elem in columns[index]]
 
     # Transpose again to get the rows back out
     rows = zip(*columns)
     return rows
 
-def initialize_db(db_name, user, password):
+def initialize_db(db_name, user, password, recreate = True):
     """
     Sets global connection, metadata, and engine variables. Also
-    DROPs and then CREATEs the database.
+    DROPs and then CREATEs the database, unless recreate is False.
 
     Multiple DBs can be created, so long as they have unique varNames.
     This will be useful when needing to read from one db and write to
     another(e.g. temp db in mem).
     """
     global engine, metadata, connection
-    engine = create_engine('mysql://' + user + ':' + password + '@localhost:3306/' + db_name)
+    # local_infile lets populate_table use LOAD DATA LOCAL INFILE
+    engine = create_engine('mysql://' + user + ':' + password + '@localhost:3306/' + db_name,
+            connect_args = {'local_infile': 1})
     engine.echo = False
     metadata = MetaData(engine)
     connection = engine.connect()
-    # Create DB
-    connection.execute("DROP DATABASE IF EXISTS baseball")
-    connection.execute("CREATE DATABASE baseball")
+    if recreate:
+        # Create DB
+        connection.execute("DROP DATABASE IF EXISTS baseball")
+        connection.execute("CREATE DATABASE baseball")
 
 def derive_keys(lst):
     # CSV file has "TRUE" in i'th column if i'th column should be a
@@ -151,20 +268,44 @@ def derive_column_types(lst):
             raise TypeError("Invalid type: %s" % element)
     return column_types
 
-def create_table(table_name, column_names, column_types, keyValues):
+def column_type(spec):
+    """
+    The sqlalchemy type for spec, a (type name, arguments...) tuple like
+    ingest.ColumnStats.column_spec returns.
+    """
+    return getattr(sqlalchemy, spec[0])(*spec[1:])
+
+def infer_column_types(file_name, batch_size = DEFAULT_BATCH_SIZE, sample_rows = None):
+    """
+    Works out a sqlalchemy type for each column of file_name (a CSV file
+    whose first row is column names) by reading it batch_size rows at a
+    time. If sample_rows is given, only that many rows are read.
+    """
+    return [column_type(spec) for spec in infer_column_specs(file_name, batch_size, sample_rows)]
+
+def create_table(table_name, column_names, column_types, keyValues, replace = False):
     """
     Takes the metadata as parameters, using it to create the table.
     keyValues is an array of True/False values that indicate whether a
-    given column is a primary key.
+    given column is a primary key. If replace is True, drops any existing
+    table with the same name first.
     """
     if not valid_list_lengths(column_names, column_types, keyValues):
         raise Exception("Invalid list lengths!")
     zipped = zip(column_names, column_types, keyValues)
     columns = [Column(col_name, col_type, primary_key=is_primary_key) for (col_name, col_type, is_primary_key) in zipped]
     table = Table(table_name, metadata, *columns)#, mysql_charset = 'utf8')
+    if replace:
+        table.drop(checkfirst = True)
     table.create()
     return table
 
+def create_indexes(table, indexes):
+    """Indexes table. indexes is a list of lists of column names."""
+    for index_columns in indexes:
+        index_name = "%s_%s" % (table.name, "_".join(index_columns))
+        Index(index_name, *[table.c[column_name] for column_name in index_columns]).create()
+
 def valid_list_lengths(column_names, column_types, keyValues):
     """
     A helper function for create_table that takes the metadata as a
@@ -179,15 +320,135 @@ def valid_list_lengths(column_names, column_types, keyValues):
         return False
     return True
 
-def populate_table(table, column_names, data):
-    update = table.insert()
-    [update.execute(dict(zip(column_names, element))) for element in data]
+def populate_table(table, column_names, chunks, use_load_data = False, progress = None):
+    """
+    Loads chunks (an iterable of lists of rows) into table, one chunk at a
+    time. Returns the number of rows loaded.
+    """
+    if progress is None:
+        progress = print_progress
+    start = time.time()
+    rows_loaded = 0
+    insert = table.insert()
+    for chunk in chunks:
+        if use_load_data:
+            load_data(table.name, column_names, chunk)
+        else:
+            # A list of parameters makes this an executemany, which
+            # MySQLdb sends as a single multi-row INSERT.
+            connection.execute(insert, [dict(zip(column_names, row)) for row in chunk])
+        rows_loaded += len(chunk)
+        progress(rows_loaded, time.time() - start)
+    return rows_loaded
+
+def load_data(table_name, column_names, rows):
+    """
+    Loads rows into table_name by writing them to a temporary CSV file and
+    having MySQL read it with LOAD DATA LOCAL INFILE.
+    """
+    temp_file = tempfile.NamedTemporaryFile(suffix = '.csv')
+    try:
+        writer = csv.writer(temp_file, lineterminator = '\n')
+        for row in rows:
+            writer.writerow([encode(elem) for elem in row])
+        temp_file.flush()
+        # csv.writer escapes quotes by doubling them, not with backslashes
+        connection.execute("LOAD DATA LOCAL INFILE '%s' INTO TABLE %s "
+                "CHARACTER SET utf8 "
+                "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+                "LINES TERMINATED BY '\\n' (%s)" % (temp_file.name, table_name, ", ".join(column_names)))
+    finally:
+        temp_file.close()
+
+def encode(elem):
+    """csv.writer can't handle unicode, so encode it as UTF-8."""
+    if isinstance(elem, unicode):
+        return elem.encode('utf-8')
+    return elem
+
+def print_progress(rows_loaded, seconds, label = None):
+    """The default progress reporter for populate_table."""
+    if seconds > 0:
+        rate = rows_loaded / seconds
+    else:
+        rate = 0
+    message = "%d rows loaded in %.1fs (%.0f rows/sec)" % (rows_loaded, seconds, rate)
+    if label is not None:
+        message = "%s: %s" % (label, message)
+    print message
+
+def ingest_manifest(manifest_file, user, password, workers = None,
+        batch_size = DEFAULT_BATCH_SIZE, use_load_data = False, sample_rows = None):
+    """
+    Loads every table in manifest_file, workers tables at a time (one per
+    CPU if workers is None), each in its own process. Returns a dict
+    mapping each table name to the number of rows loaded into it.
+    """
+    db_name, tables = read_manifest(manifest_file)
+    jobs = [(table, batch_size, use_load_data, sample_rows) for table in tables]
+    pool = multiprocessing.Pool(workers, initializer = initialize_worker,
+            initargs = (db_name, user, password))
+    start = time.time()
+    rows_by_table = {}
+    try:
+        for table_name, rows_loaded, seconds in pool.imap_unordered(load_manifest_table, jobs):
+            rows_by_table[table_name] = rows_loaded
+            print "Finished %s: %d rows in %.1fs (%d of %d tables done)" % (table_name, rows_loaded, seconds, len(rows_by_table), len(tables))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    print "Loaded %d rows into %d tables in %.1fs" % (sum(rows_by_table.values()), len(tables), time.time() - start)
+    return rows_by_table
+
+def initialize_worker(db_name, user, password):
+    """Gives each ingest_manifest worker process its own DB connection."""
+    initialize_db(db_name, user, password, recreate = False)
+
+def load_manifest_table(job):
+    """
+    Runs in an ingest_manifest worker: loads one table. Returns a tuple of
+    (table name, rows loaded, seconds taken).
+    """
+    table, batch_size, use_load_data, sample_rows = job
+    start = time.time()
+    def progress(rows_loaded, seconds):
+        print_progress(rows_loaded, seconds, table['table'])
+    rows_loaded = load_csv_file(table['csv'], table['table'], batch_size, use_load_data,
+            progress, indexes = table['indexes'], replace = True,
+            primary_key = table['primary_key'], sample_rows = sample_rows)
+    return (table['table'], rows_loaded, time.time() - start)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 6:
-        sys.exit("Usage: %s csv_file_name db_name table_name db_user db_password" % __file__)
+    parser = OptionParser(usage = "%prog [options] csv_file_name db_name table_name db_user db_password\n"
+            "       %prog [options] --manifest manifest_file db_user db_password")
+    parser.add_option("--batch-size", type = "int", default = DEFAULT_BATCH_SIZE,
+            help = "rows to load at a time [default: %default]")
+    parser.add_option("--load-data", action = "store_true", default = False,
+            help = "load with LOAD DATA LOCAL INFILE instead of INSERT")
+    parser.add_option("--sample-rows", type = "int",
+            help = "infer column types from this many rows [default: the whole file]")
+    parser.add_option("--primary-key",
+            help = "comma-separated primary key columns, for files without a types row")
+    parser.add_option("--manifest", help = "load every table in this manifest file")
+    parser.add_option("--workers", type = "int",
+            help = "with --manifest, tables to load at once [default: one per CPU]")
+    options, args = parser.parse_args()
+
+    if options.manifest:
+        if len(args) != 2:
+            parser.error("wrong number of arguments")
+        db_user, db_password = [str(x) for x in args]
+        ingest_manifest(options.manifest, db_user, db_password, options.workers,
+                options.batch_size, options.load_data, options.sample_rows)
+        sys.exit(0)
+
+    if len(args) != 5:
+        parser.error("wrong number of arguments")
 
-    csv_file, db_name, table_name, db_user, db_password = [str(x) for x in sys.argv[1:]]
+    csv_file, db_name, table_name, db_user, db_password = [str(x) for x in args]
     print 'csv_file_name: ' + csv_file
     print 'db_name      : ' + db_name
     print 'table_name   : ' + table_name
@@ -196,5 +457,10 @@ if __name__ == "__main__":
     print
 
     print "Creating database..."
-    create_db_from_csv_file(csv_file, db_name, table_name, db_user, db_password)
+    primary_key = None
+    if options.primary_key:
+        primary_key = [column_name.strip() for column_name in options.primary_key.split(',')]
+    create_db_from_csv_file(csv_file, db_name, table_name, db_user, db_password,
+            batch_size = options.batch_size, use_load_data = options.load_data,
+            primary_key = primary_key, sample_rows = options.sample_rows)
     print "done!"
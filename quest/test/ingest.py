@@ -0,0 +1,227 @@
+# The parts of loading CSV files (see createDB) that don't need the DB:
+# reading a file in chunks, working out each column's type from its
+# values, and reading ingest manifests. createDB needs MySQLdb and
+# sqlalchemy; this only needs the standard library, so it can be used
+# (and tested) without them.
+#
+# Column types are described as (sqlalchemy type name, arguments...)
+# tuples, e.g. ('Numeric', 5, 3), which createDB turns into real
+# sqlalchemy types.
+
+import os
+import re
+import csv
+import json
+import datetime
+
+# The type names allowed in a file's (optional) second row
+TYPE_DESCRIPTIONS = ('String', 'Integer', 'Real')
+
+# What ColumnStats recognizes
+# (no leading zeros, so e.g. zip codes stay strings)
+rInteger = re.compile(r"^[+-]?(0|[1-9]\d*)$")
+rReal = re.compile(r"^[+-]?(\d*)\.(\d+)$|^[+-]?(\d+)\.$")
+rScientific = re.compile(r"^[+-]?(\d+\.?\d*|\.\d+)[eE][+-]?\d+$")
+rDate = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+rDatetime = re.compile(r"^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(\.\d{1,6})?$")
+
+# Values that mean "nothing here", which don't count against a type
+NULL_VALUES = ('', '-')
+
+# The biggest NUMERIC MySQL allows
+MAX_NUMERIC_PRECISION = 65
+
+def read_chunks(csv_file, batch_size):
+    """
+    Yields lists of at most batch_size rows from csv_file (a csv.reader),
+    skipping blank lines.
+    """
+    chunk = []
+    for row in csv_file:
+        if not row:
+            continue
+        chunk.append(row)
+        if len(chunk) == batch_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def is_type_row(lst):
+    """True if lst is a row of type names, like "String,Integer,Real"."""
+    return len(lst) > 0 and all([element.strip() in TYPE_DESCRIPTIONS for element in lst])
+
+class ColumnStats:
+    """
+    What infer_column_specs has seen of one column so far: the most
+    specific kind that fits every value ('integer', 'real', 'date',
+    'datetime' or 'string', or None if every value was empty), plus the
+    sizes needed to pick a tight type for that kind.
+    """
+
+    # When a column has values of two kinds, it becomes this kind
+    widened_kinds = {
+            frozenset(['integer', 'real']): 'real',
+            frozenset(['date', 'datetime']): 'datetime',
+            }
+
+    def __init__(self):
+        self.kind = None
+        self.smallest = None
+        self.largest = None
+        # Most digits seen before and after the decimal point
+        self.integer_digits = 0
+        self.fraction_digits = 0
+        self.scientific = False
+        # Longest value, in characters
+        self.width = 0
+
+    def add_values(self, values):
+        """Takes a column's worth of values from one chunk of the file."""
+        values = [value.strip() for value in values]
+        values = [value for value in values if value not in NULL_VALUES]
+        if not values:
+            return
+        self.width = max(self.width, max([len(value.decode('utf-8', 'replace')) for value in values]))
+        if self.kind == 'string':
+            # Nothing more specific is possible, width is all that matters
+            return
+
+        # Find the kind of the whole chunk in one go where we can, rather
+        # than value by value
+        if all([rInteger.match(value) for value in values]):
+            numbers = [int(value) for value in values]
+            self.widen('integer', min(numbers), max(numbers))
+            self.integer_digits = max(self.integer_digits, max([len(str(abs(n))) for n in numbers]))
+        elif all([rInteger.match(value) or rReal.match(value) for value in values]):
+            self.widen('real')
+            for value in values:
+                integer_part, ignored, fraction_part = value.lstrip('+-').partition('.')
+                self.integer_digits = max(self.integer_digits, len(integer_part.lstrip('0')))
+                self.fraction_digits = max(self.fraction_digits, len(fraction_part))
+        elif all([rInteger.match(value) or rReal.match(value) or rScientific.match(value) for value in values]):
+            self.widen('real')
+            self.scientific = True
+        elif all([is_valid_date(value) for value in values]):
+            self.widen('date')
+        elif all([is_valid_datetime(value) for value in values]):
+            self.widen('datetime')
+        elif all([is_valid_date(value) or is_valid_datetime(value) for value in values]):
+            self.widen('datetime')
+        else:
+            self.kind = 'string'
+
+    def widen(self, kind, smallest = None, largest = None):
+        """Merges kind into self.kind, becoming 'string' if they don't mix."""
+        if smallest is not None:
+            if self.smallest is None:
+                self.smallest, self.largest = smallest, largest
+            else:
+                self.smallest = min(self.smallest, smallest)
+                self.largest = max(self.largest, largest)
+        if self.kind is None or self.kind == kind:
+            self.kind = kind
+        else:
+            self.kind = self.widened_kinds.get(frozenset([self.kind, kind]), 'string')
+
+    def column_spec(self):
+        """
+        The tightest type that holds every value we've seen, as a
+        (sqlalchemy type name, arguments...) tuple.
+        """
+        if self.kind == 'integer':
+            if -2**15 <= self.smallest and self.largest < 2**15:
+                return ('SmallInteger',)
+            elif -2**31 <= self.smallest and self.largest < 2**31:
+                return ('Integer',)
+            elif -2**63 <= self.smallest and self.largest < 2**63:
+                return ('BigInteger',)
+            return ('Numeric', min(self.integer_digits, MAX_NUMERIC_PRECISION), 0)
+        elif self.kind == 'real':
+            precision = max(self.integer_digits + self.fraction_digits, 1)
+            if self.scientific or precision > MAX_NUMERIC_PRECISION:
+                return ('Float',)
+            return ('Numeric', precision, self.fraction_digits)
+        elif self.kind == 'date':
+            return ('Date',)
+        elif self.kind == 'datetime':
+            return ('DateTime',)
+        # A string, or we never saw a value
+        return ('Unicode', max(self.width, 1))
+
+def is_valid_date(value):
+    """True if value is a YYYY-MM-DD date that actually exists."""
+    if not rDate.match(value):
+        return False
+    try:
+        datetime.datetime.strptime(value, '%Y-%m-%d')
+        return True
+    except ValueError:
+        return False
+
+def is_valid_datetime(value):
+    """
+    True if value is a YYYY-MM-DD HH:MM:SS datetime (maybe with a T
+    instead of the space, and fractions of a second) that actually exists.
+    """
+    if not rDatetime.match(value):
+        return False
+    value = value.replace('T', ' ')
+    if '.' in value:
+        datetime_format = '%Y-%m-%d %H:%M:%S.%f'
+    else:
+        datetime_format = '%Y-%m-%d %H:%M:%S'
+    try:
+        datetime.datetime.strptime(value, datetime_format)
+        return True
+    except ValueError:
+        return False
+
+def infer_column_specs(file_name, batch_size, sample_rows = None):
+    """
+    Works out the type of each column of file_name (a CSV file whose first
+    row is column names) by reading it batch_size rows at a time, and
+    returns a list of their specs (see ColumnStats.column_spec). If
+    sample_rows is given, only that many rows are read.
+    """
+    csv_file = csv.reader(open(file_name))
+    column_names = csv_file.next()
+    stats = [ColumnStats() for column_name in column_names]
+    rows_read = 0
+    for chunk in read_chunks(csv_file, batch_size):
+        if sample_rows is not None:
+            chunk = chunk[:sample_rows - rows_read]
+        # One column at a time, like createDB.cleanup_data
+        for column_stats, values in zip(stats, zip(*chunk)):
+            column_stats.add_values(values)
+        rows_read += len(chunk)
+        if sample_rows is not None and rows_read >= sample_rows:
+            break
+    return [column_stats.column_spec() for column_stats in stats]
+
+def read_manifest(manifest_file):
+    """
+    Reads an ingest manifest (see the top of createDB). Returns a tuple of
+    (db_name, list of table dicts), where each table dict has "csv" (an
+    absolute path), "table", "indexes" and "primary_key" keys.
+    """
+    manifest = json.load(open(manifest_file))
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+    if 'db_name' not in manifest or not manifest.get('tables'):
+        raise ValueError("%s needs a db_name and at least one table" % manifest_file)
+
+    tables = []
+    table_names = set()
+    for entry in manifest['tables']:
+        if 'csv' not in entry or 'table' not in entry:
+            raise ValueError("Every table in %s needs a csv and a table: %s" % (manifest_file, entry))
+        if entry['table'] in table_names:
+            raise ValueError("Table %s is in %s twice" % (entry['table'], manifest_file))
+        table_names.add(entry['table'])
+        tables.append({
+            'csv': os.path.join(manifest_dir, entry['csv']),
+            'table': str(entry['table']),
+            'indexes': [[str(column_name) for column_name in index] for index in entry.get('indexes', [])],
+            'primary_key': [str(column_name) for column_name in entry.get('primary_key', [])],
+            })
+    return (str(manifest['db_name']), tables)
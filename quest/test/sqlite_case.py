@@ -0,0 +1,58 @@
+# A base class for tests that need a DB. Every test gets a brand new
+# in-memory SQLite DB (see quest.backends.sqlite), so they don't need a DB
+# server. Run the tests from the top of the tree with:
+#   python -m unittest discover -t . -s quest/test -p "test_*.py"
+
+import unittest
+
+import quest.config as config
+import quest.engine
+
+class SQLiteTestCase(unittest.TestCase):
+    # Maps config setting to the value it has during each test. The old
+    # values are put back afterwards.
+    settings = {}
+
+    def setUp(self):
+        settings = {'db_backend': 'sqlite', 'db_name': ':memory:'}
+        settings.update(self.settings)
+        self.saved_settings = {}
+        for name, value in settings.items():
+            self.saved_settings[name] = getattr(config, name)
+            setattr(config, name, value)
+        # Start from a fresh DB and an empty result cache
+        quest.engine.reset()
+        quest.engine.result_cache = None
+
+    def tearDown(self):
+        quest.engine.reset()
+        quest.engine.result_cache = None
+        for name, value in self.saved_settings.items():
+            setattr(config, name, value)
+
+    def run_sql(self, *statements):
+        for sql in statements:
+            quest.engine.run_sql(sql)
+
+    def create_players(self):
+        """A small players table: 3 teams in 2 leagues over 3 years."""
+        self.run_sql("CREATE TABLE players (playerid TEXT, teamid TEXT, lg TEXT, year INTEGER, hr INTEGER)")
+        rows = []
+        for year in (2000, 2001, 2002):
+            for number, (teamid, lg) in enumerate((('BOS', 'AL'), ('NYA', 'AL'), ('CHN', 'NL'))):
+                for player in range(2):
+                    rows.append("('p%s%d', '%s', '%s', %d, %d)" % (teamid, player, teamid, lg, year, (year - 2000) * 10 + number * 2 + player))
+        self.run_sql("INSERT INTO players VALUES %s" % ", ".join(rows))
+
+def save_hierarchies():
+    """A copy of config's ROLLUP/DRILLDOWN hierarchies, for restore_hierarchies."""
+    return (dict(config.rollup_child2parent), dict(config.drilldown_parent2child))
+
+def restore_hierarchies(saved):
+    """
+    Puts back the hierarchies save_hierarchies copied. They're restored in
+    place, since rollup_drilldown imported config's dicts themselves.
+    """
+    for hierarchy, saved_hierarchy in zip((config.rollup_child2parent, config.drilldown_parent2child), saved):
+        hierarchy.clear()
+        hierarchy.update(saved_hierarchy)
@@ -0,0 +1,76 @@
+# Tests for the index advisor (quest.query.advisor), which EXPLAINs the
+# statements operators made to find full table scans.
+
+import unittest
+
+import quest.config as config
+import quest.engine
+from quest.query import advisor
+from quest.query import shifter
+from quest.query.query import Query
+from quest.test.sqlite_case import SQLiteTestCase
+
+class AdvisorTest(SQLiteTestCase):
+    settings = {'INDEX_ADVISOR_ENABLED': True, 'INDEX_ADVISOR_CREATE': False,
+            'INDEX_ADVISOR_THRESHOLD': 3, 'PREFETCH_SHIFTS': False}
+
+    def setUp(self):
+        SQLiteTestCase.setUp(self)
+        advisor.clear()
+        advisor.created.clear()
+        shifter.clear_column_type_cache()
+        self.create_players()
+
+    def tearDown(self):
+        advisor.clear()
+        advisor.created.clear()
+        shifter.clear_column_type_cache()
+        SQLiteTestCase.tearDown(self)
+
+    def indexes(self):
+        return [row[0] for row in quest.engine.run_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'players'").fetchall()]
+
+    def test_full_scans(self):
+        self.assertEqual(quest.engine.full_scans("SELECT * FROM players WHERE hr > 3"), set(['players']))
+        self.run_sql("CREATE INDEX players_hr ON players (hr)")
+        self.assertEqual(quest.engine.full_scans("SELECT * FROM players WHERE hr > 3"), set())
+
+    def test_predicate_columns(self):
+        self.assertEqual(advisor.predicate_columns("hr > 3 AND teamid IN ('BOS', 'NYA') OR p.year IS NULL"),
+                ['hr', 'teamid'])
+
+    def test_recommends_and_creates(self):
+        query = Query("SELECT * FROM players WHERE year = 2000")
+        query.narrow("hr > 3").narrow("hr > 5")
+        query.rshift('year')
+        lines = advisor.advise().split("\n")
+        self.assertEqual(lines[1:], [
+            "  CREATE INDEX quest_idx_players_hr ON players (hr);  -- narrow x2; full scan of players",
+            "  CREATE INDEX quest_idx_players_year ON players (year);  -- rshift x1; full scan of players"])
+        advisor.advise(True)
+        self.assertEqual(sorted(self.indexes()), ['quest_idx_players_hr', 'quest_idx_players_year'])
+        self.assertEqual(advisor.advise(), "No indexes to recommend.")
+
+    def test_joins_and_unknown_columns_are_ignored(self):
+        Query("SELECT * FROM players NATURAL JOIN players AS p").narrow("hr > 3")
+        Query("SELECT * FROM players").narrow("LOWER(teamid) = 'bos'")
+        self.assertEqual(advisor.usages.keys(), [('players', ('lower', 'teamid'))])
+        self.assertEqual([recommendation.columns for recommendation in advisor.recommendations()], [('teamid',)])
+
+    def test_creates_at_threshold(self):
+        config.INDEX_ADVISOR_CREATE = True
+        query = Query("SELECT * FROM players")
+        query.narrow("hr > 1")
+        query.narrow("hr > 2")
+        self.assertEqual(self.indexes(), [])
+        query.narrow("hr > 3")
+        self.assertEqual(self.indexes(), ['quest_idx_players_hr'])
+
+    def test_off(self):
+        config.INDEX_ADVISOR_ENABLED = False
+        Query("SELECT * FROM players").narrow("hr > 1")
+        self.assertEqual(advisor.usages, {})
+
+if __name__ == '__main__':
+    unittest.main()
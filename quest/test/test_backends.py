@@ -0,0 +1,46 @@
+# Tests for quest.backends and how quest.engine picks one.
+
+import threading
+import unittest
+
+import quest.config as config
+import quest.engine
+import quest.backends
+from quest.test.sqlite_case import SQLiteTestCase
+
+class BackendTest(SQLiteTestCase):
+    def test_unknown_backend(self):
+        self.assertRaises(quest.backends.UnknownBackendError, quest.backends.get_backend, 'oracle')
+
+    def test_pool_before_backend(self):
+        # get_pool creates the backend itself; it used to deadlock
+        finished = []
+        worker = threading.Thread(target = lambda: finished.append(quest.engine.get_pool()))
+        worker.daemon = True
+        worker.start()
+        worker.join(5)
+        self.assertEqual(len(finished), 1)
+        self.assertEqual(finished[0].max_size, 1)
+
+    def test_quote(self):
+        self.assertEqual(quest.engine.quote(None), "NULL")
+        self.assertEqual(quest.engine.quote(3), "3")
+        self.assertEqual(quest.engine.quote("O'Neil"), "'O''Neil'")
+        self.assertEqual(quest.engine.quote(u'Jos\xe9'), u"'Jos\xe9'")
+
+    def test_run_sql_placeholders(self):
+        self.run_sql("CREATE TABLE t (a INTEGER, b TEXT)")
+        quest.engine.run_sql("INSERT INTO t VALUES (%s, %s)", (1, "x"))
+        self.assertEqual(quest.engine.run_sql("SELECT a, b FROM t").fetchall(), [(1, u"x")])
+
+    def test_placeholders_in_strings_are_text(self):
+        self.run_sql("CREATE TABLE t (a INTEGER, b TEXT)")
+        quest.engine.run_sql("INSERT INTO t VALUES (%s, '%s''s %s')", (1,))
+        self.assertEqual(quest.engine.run_sql("SELECT a, b FROM t WHERE b LIKE %s", ("%s%",)).fetchall(), [(1, u"%s's %s")])
+
+    def test_describe(self):
+        self.run_sql("CREATE TABLE t (a INTEGER, b TEXT)", "INSERT INTO t VALUES (1, 'x')")
+        self.assertEqual(quest.engine.describe("SELECT a, b FROM t LIMIT 5"), [('a', int), ('b', unicode)])
+
+if __name__ == '__main__':
+    unittest.main()
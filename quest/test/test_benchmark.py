@@ -0,0 +1,59 @@
+# A quick run of the benchmark (quest.test.benchmark) on a tiny table, so
+# it doesn't rot between the times someone needs it.
+
+import StringIO
+import sys
+import unittest
+
+import quest.config as config
+from quest.test import benchmark
+from quest.test.sqlite_case import SQLiteTestCase, save_hierarchies, restore_hierarchies
+
+class BenchmarkTest(SQLiteTestCase):
+    # What the benchmark's own command line turns off
+    settings = {'RESULT_CACHE_ENABLED': False, 'SUMMARY_TABLES_ENABLED': False,
+            'KEEP_RESULT_ROWS': 0, 'LOCAL_ROLLUP': False, 'LOCAL_NARROW': False,
+            'PREFETCH_SHIFTS': False, 'MATERIALIZE_ENABLED': False,
+            'INDEX_ADVISOR_ENABLED': False}
+
+    def setUp(self):
+        SQLiteTestCase.setUp(self)
+        self.saved_hierarchies = save_hierarchies()
+
+    def tearDown(self):
+        restore_hierarchies(self.saved_hierarchies)
+        SQLiteTestCase.tearDown(self)
+
+    def test_run(self):
+        # run() reports progress on stderr
+        saved_stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            report = benchmark.run([50], 1, ['league', 'team', 'player'], 2, 0)
+        finally:
+            sys.stderr = saved_stderr
+        self.assertEqual(report['backend'], 'sqlite')
+        self.assertEqual(len(report['sizes']), 1)
+        size = report['sizes'][0]
+        self.assertEqual(size['rows'], 50)
+        self.assertEqual(sorted(size['operators'].keys()), sorted(benchmark.OPERATORS))
+        for timings in size['operators'].values():
+            self.assertTrue(timings['p50_ms'] <= timings['p95_ms'])
+        # Every row has its top level in the dimension table
+        self.assertEqual(size['operators']['relate']['rows'], 50)
+
+    def test_relate_joins_a_derived_table(self):
+        config.create_hierarchy(['league', 'team', 'player'])
+        benchmark.create_tables("bench_10", 10, ['league', 'team', 'player'], 2, 0)
+        related = benchmark.operators("bench_10", ['league', 'team', 'player'])['relate']()
+        self.assertEqual(related.statement,
+                "SELECT * FROM (SELECT * FROM bench_10) AS quest_left NATURAL INNER JOIN bench_10_league")
+        self.assertEqual(len(related.show(config.ALL_ROWS)), 10)
+
+    def test_parse_row_count(self):
+        self.assertEqual(benchmark.parse_row_count("10000"), 10000)
+        self.assertEqual(benchmark.parse_row_count("100k"), 100000)
+        self.assertEqual(benchmark.parse_row_count(" 10M"), 10000000)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# Tests for quest.engine.CancelToken, which lets one thread stop another's
+# statements.
+
+import threading
+import time
+import unittest
+
+import quest.engine
+from quest.test.sqlite_case import SQLiteTestCase
+
+# Counts for far longer than any test should take, unless interrupted
+SLOW_SQL = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 1000000000) SELECT count(*) FROM c"
+
+class CancelTokenTest(SQLiteTestCase):
+    def run_in_thread(self, token, sql):
+        """Runs sql inside cancellable(token) on a new thread; returns (thread, outcome)."""
+        outcome = {}
+        def run():
+            try:
+                with quest.engine.cancellable(token):
+                    outcome['rows'] = quest.engine.run_sql(sql).fetchall()
+            except Exception as e:
+                outcome['error'] = e
+        thread = threading.Thread(target = run)
+        thread.daemon = True
+        thread.start()
+        return thread, outcome
+
+    def test_cancel_interrupts_running_statement(self):
+        token = quest.engine.CancelToken()
+        thread, outcome = self.run_in_thread(token, SLOW_SQL)
+        deadline = time.time() + 5
+        while not token.handles and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(token.handles)
+        token.cancel()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(isinstance(outcome.get('error'), quest.engine.get_backend().Error))
+        # The connection went back to the pool, and works
+        self.assertEqual(quest.engine.run_sql("SELECT 1").fetchall(), [(1,)])
+
+    def test_cancelled_token_stops_later_statements(self):
+        token = quest.engine.CancelToken()
+        token.cancel()
+        with quest.engine.cancellable(token):
+            self.assertRaises(quest.engine.QueryCancelled, quest.engine.run_sql, "SELECT 1")
+
+    def test_cancelled_stream_keeps_connection(self):
+        token = quest.engine.CancelToken()
+        token.cancel()
+        pool = quest.engine.get_pool()
+        with quest.engine.cancellable(token):
+            self.assertRaises(quest.engine.QueryCancelled, list, quest.engine.stream("SELECT 1"))
+        # Back in the pool, rather than thrown away
+        self.assertEqual((pool.size, pool.idle.qsize()), (1, 1))
+
+    def test_cancel_after_block_leaves_connection_alone(self):
+        token = quest.engine.CancelToken()
+        with quest.engine.cancellable(token):
+            quest.engine.run_sql("SELECT 1")
+        self.assertEqual(token.handles, {})
+        token.cancel()
+        # The same (only) connection, now running someone else's statement
+        self.assertEqual(quest.engine.run_sql("SELECT count(*) FROM (SELECT 1 UNION SELECT 2)").fetchall(), [(2,)])
+
+    def test_detach_waits_for_cancel(self):
+        backend = quest.engine.get_backend()
+        events = []
+        def slow_cancel(handle):
+            events.append('cancel started')
+            time.sleep(0.2)
+            events.append('cancel finished')
+        backend.cancel = slow_cancel
+        token = quest.engine.CancelToken()
+        connection = object()
+        token.attach(connection)
+        canceller = threading.Thread(target = token.cancel)
+        canceller.start()
+        while not events:
+            time.sleep(0.01)
+        token.detach(connection)
+        events.append('detached')
+        canceller.join()
+        self.assertEqual(events, ['cancel started', 'cancel finished', 'detached'])
+
+if __name__ == '__main__':
+    unittest.main()
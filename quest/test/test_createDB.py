@@ -0,0 +1,67 @@
+# Tests for createDB's CSV handling that needs sqlalchemy: cleaning up
+# batches of rows for the DB, and turning inferred column types into
+# sqlalchemy ones. (Reading files and inferring their types is tested in
+# test_ingest, which needs neither.) createDB itself needs MySQLdb and
+# sqlalchemy, so these are skipped without them.
+
+import datetime
+import decimal
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from quest.test import createDB
+except SystemExit:
+    # createDB exits when it can't import MySQLdb or sqlalchemy
+    createDB = None
+
+@unittest.skipIf(createDB is None, "createDB needs MySQLdb and sqlalchemy")
+class ChunkTest(unittest.TestCase):
+    def test_cleanup_data(self):
+        column_types = [createDB.Integer(), createDB.Numeric(precision = 3, scale = 1),
+                createDB.sqlalchemy.Date(), createDB.sqlalchemy.DateTime(), createDB.Unicode(5)]
+        rows = createDB.cleanup_data([
+            ['1', '2.5', '2001-02-03', '2001-02-03T04:05:06', 'Zo\xc3\xab'],
+            ['-', '', '', '2001-02-03', 'BOS'],
+            ], column_types)
+        self.assertEqual(rows, [
+            (1, decimal.Decimal('2.5'), datetime.date(2001, 2, 3), datetime.datetime(2001, 2, 3, 4, 5, 6), u'Zo\xeb'),
+            (None, None, None, datetime.datetime(2001, 2, 3), u'BOS'),
+            ])
+
+    def test_cleanup_data_rejects_bad_numbers(self):
+        self.assertRaises(TypeError, createDB.cleanup_data, [['x1']], [createDB.Integer()])
+        self.assertRaises(TypeError, createDB.cleanup_data, [['x1']], [createDB.Numeric(precision = 3, scale = 1)])
+
+    def test_numerics_keep_every_digit(self):
+        huge = str(2 ** 70)
+        column_types = [createDB.Numeric(precision = len(huge), scale = 0),
+                createDB.Numeric(precision = 20, scale = 18), createDB.sqlalchemy.Float()]
+        rows = createDB.cleanup_data([[huge, '0.123456789012345678', '1.5e10']], column_types)
+        self.assertEqual(rows, [(decimal.Decimal(huge), decimal.Decimal('0.123456789012345678'), 1.5e10)])
+
+@unittest.skipIf(createDB is None, "createDB needs MySQLdb and sqlalchemy")
+class InferColumnTypesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'players.csv')
+        with open(self.file_name, 'w') as csv_file:
+            csv_file.write("playerid,year,avg\n")
+            for number in range(10):
+                csv_file.write("p%d,%d,0.%d\n" % (number, 2000 + number, number))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_sqlalchemy_types(self):
+        playerid, year, avg = createDB.infer_column_types(self.file_name, batch_size = 3)
+        self.assertTrue(isinstance(playerid, createDB.Unicode))
+        self.assertEqual(playerid.length, 2)
+        self.assertTrue(isinstance(year, createDB.sqlalchemy.SmallInteger))
+        self.assertTrue(isinstance(avg, createDB.Numeric))
+        self.assertEqual((avg.precision, avg.scale), (1, 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# Tests for quest.test.ingest, the parts of createDB's CSV loading that
+# don't need the DB: reading batches of rows, column type inference
+# (ColumnStats and infer_column_specs), and reading the manifests that load
+# many tables at once.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from quest.test import ingest
+
+def column_spec(*values):
+    stats = ingest.ColumnStats()
+    stats.add_values(values)
+    return stats.column_spec()
+
+class ColumnStatsTest(unittest.TestCase):
+    def test_integers_get_the_smallest_type(self):
+        self.assertEqual(column_spec('1', '-32768', '32767'), ('SmallInteger',))
+        self.assertEqual(column_spec('1', '40000'), ('Integer',))
+        self.assertEqual(column_spec('1', str(2 ** 40)), ('BigInteger',))
+        self.assertEqual(column_spec(str(2 ** 70)), ('Numeric', len(str(2 ** 70)), 0))
+
+    def test_reals_get_just_enough_digits(self):
+        self.assertEqual(column_spec('12.5', '3', '-0.125'), ('Numeric', 5, 3))
+        self.assertEqual(column_spec('1.5e10', '2'), ('Float',))
+
+    def test_dates(self):
+        self.assertEqual(column_spec('2001-02-03', '1999-12-31'), ('Date',))
+        self.assertEqual(column_spec('2001-02-03', '2001-02-03 04:05:06'), ('DateTime',))
+        # Not real dates
+        self.assertEqual(column_spec('2001-02-30'), ('Unicode', 10))
+        self.assertEqual(column_spec('2001-02-30 10:00:00'), ('Unicode', 19))
+        self.assertEqual(column_spec('2001-02-03', '2001-02-03 25:00:00'), ('Unicode', 19))
+        self.assertEqual(column_spec('2001-02-03T04:05:06.5'), ('DateTime',))
+
+    def test_strings_are_as_wide_as_the_longest_value(self):
+        self.assertEqual(column_spec('BOS', '007', 'Zo\xc3\xabe'), ('Unicode', 4))
+
+    def test_empty_values_dont_count(self):
+        self.assertEqual(column_spec('', '-', '5'), ('SmallInteger',))
+        self.assertEqual(column_spec('', '-'), ('Unicode', 1))
+
+    def test_kinds_widen_across_chunks(self):
+        stats = ingest.ColumnStats()
+        stats.add_values(['1', '2'])
+        stats.add_values(['2.25'])
+        self.assertEqual(stats.kind, 'real')
+        stats.add_values(['n/a'])
+        self.assertEqual(stats.kind, 'string')
+
+class ChunkTest(unittest.TestCase):
+    def test_read_chunks(self):
+        rows = [['1'], [], ['2'], ['3'], ['4'], ['5']]
+        self.assertEqual(list(ingest.read_chunks(iter(rows), 2)), [[['1'], ['2']], [['3'], ['4']], [['5']]])
+
+    def test_type_rows(self):
+        self.assertTrue(ingest.is_type_row(['String', ' Integer', 'Real']))
+        self.assertFalse(ingest.is_type_row(['p1', '2000', '0.1']))
+
+class InferColumnSpecsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'players.csv')
+        with open(self.file_name, 'w') as csv_file:
+            csv_file.write("playerid,year,avg\n")
+            for number in range(10):
+                csv_file.write("p%d,%d,0.%d\n" % (number, 2000 + number, number))
+            csv_file.write("longer_player_id,later,\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_whole_file_in_batches(self):
+        self.assertEqual(ingest.infer_column_specs(self.file_name, batch_size = 3),
+                [('Unicode', len("longer_player_id")), ('Unicode', 5), ('Numeric', 1, 1)])
+
+    def test_sample_rows(self):
+        self.assertEqual(ingest.infer_column_specs(self.file_name, batch_size = 3, sample_rows = 10),
+                [('Unicode', 2), ('SmallInteger',), ('Numeric', 1, 1)])
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manifest_file = os.path.join(self.directory, 'manifest.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_manifest(self, manifest):
+        with open(self.manifest_file, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+
+    def test_read_manifest(self):
+        self.write_manifest({"db_name": "baseball", "tables": [
+            {"csv": "players.csv", "table": "players", "primary_key": ["playerid", "year"],
+                "indexes": [["teamid"], ["lg", "year"]]},
+            {"csv": "data/teams.csv", "table": "teams"}]})
+        db_name, tables = ingest.read_manifest(self.manifest_file)
+        self.assertEqual(db_name, 'baseball')
+        self.assertEqual(tables, [
+            {'csv': os.path.join(self.directory, 'players.csv'), 'table': 'players',
+                'indexes': [['teamid'], ['lg', 'year']], 'primary_key': ['playerid', 'year']},
+            {'csv': os.path.join(self.directory, 'data', 'teams.csv'), 'table': 'teams',
+                'indexes': [], 'primary_key': []}])
+
+    def test_bad_manifests(self):
+        for manifest in [{"tables": [{"csv": "a.csv", "table": "a"}]},
+                {"db_name": "baseball", "tables": []},
+                {"db_name": "baseball", "tables": [{"csv": "a.csv"}]},
+                {"db_name": "baseball", "tables": [{"csv": "a.csv", "table": "a"}, {"csv": "b.csv", "table": "a"}]}]:
+            self.write_manifest(manifest)
+            self.assertRaises(ValueError, ingest.read_manifest, self.manifest_file)
+
+if __name__ == '__main__':
+    unittest.main()
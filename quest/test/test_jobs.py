@@ -0,0 +1,112 @@
+# Tests for quest.web.jobs: background jobs for the web app.
+
+import threading
+import time
+import unittest
+
+import quest.config as config
+from quest.session import Session
+from quest.web import jobs
+from quest.test.sqlite_case import SQLiteTestCase
+
+class JobTest(SQLiteTestCase):
+    settings = {'WEB_PAGE_SIZE': 10, 'WEB_JOB_BUFFER_PAGES': 2, 'STREAM_BATCH_SIZE': 5}
+
+    def setUp(self):
+        SQLiteTestCase.setUp(self)
+        self.run_sql("CREATE TABLE t (a INTEGER)")
+        self.run_sql("INSERT INTO t VALUES %s" % ", ".join(["(%d)" % number for number in range(100)]))
+
+    def start(self, job):
+        worker = threading.Thread(target = job.run)
+        worker.daemon = True
+        worker.start()
+        return worker
+
+    def test_reads_only_a_few_pages_ahead(self):
+        job = jobs.Job("SELECT a FROM t", Session())
+        worker = self.start(job)
+        time.sleep(0.2)
+        self.assertEqual(job.state, jobs.RUNNING)
+        self.assertTrue(len(job.rows) <= 20 + 5, len(job.rows))
+        taken = []
+        while True:
+            rows = job.take_rows(len(taken), 10)
+            taken.extend(rows)
+            if job.finished() and len(taken) == job.rows_read():
+                break
+            if not rows:
+                time.sleep(0.01)
+            self.assertTrue(len(job.rows) <= 20 + 5 + 10)
+        worker.join(5)
+        self.assertEqual(job.state, jobs.DONE)
+        self.assertEqual([row[0] for row in taken], range(100))
+
+    def test_forgotten_rows(self):
+        job = jobs.Job("SELECT a FROM t", Session())
+        job.add_rows([(number,) for number in range(10)])
+        self.assertEqual(job.take_rows(5, 2), [(5,), (6,)])
+        # Rows 0-4 are gone, so they can't come back as the wrong rows
+        self.assertRaises(jobs.RowsForgottenError, job.take_rows, 3, 2)
+        self.assertEqual(job.take_rows(5, 2), [(5,), (6,)])
+        self.assertEqual(job.take_rows(8), [(8,), (9,)])
+
+    def test_cancel_wakes_waiting_job(self):
+        job = jobs.Job("SELECT a FROM t", Session())
+        worker = self.start(job)
+        time.sleep(0.2)
+        job.cancel()
+        worker.join(5)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(job.state, jobs.CANCELLED)
+
+class CachedJobTest(SQLiteTestCase):
+    settings = {'RESULT_CACHE_ENABLED': True, 'ALWAYS_SHOW': False,
+            'ROWS_TO_SHOW': config.ALL_ROWS, 'KEEP_RESULT_ROWS': 100,
+            'PREFETCH_SHIFTS': False, 'INDEX_ADVISOR_ENABLED': False}
+
+    def run_job(self, user_input, session):
+        job = jobs.Job(user_input, session)
+        job.run()
+        self.assertEqual(job.state, jobs.DONE)
+        return job
+
+    def test_repeated_show_hits_the_cache(self):
+        self.run_sql("CREATE TABLE t (a INTEGER)", "INSERT INTO t VALUES (1), (2), (3)")
+        session = Session()
+        self.run_job("initialize(Q, SELECT a FROM t)", session)
+        first = self.run_job("Q.show()", session)
+        self.assertEqual(first.take_rows(0), [(1,), (2,), (3,)])
+        # Behind Quest's back, so only a cached result still has the rows
+        self.run_sql("DELETE FROM t")
+        second = self.run_job("Q.show()", session)
+        self.assertEqual(second.take_rows(0), [(1,), (2,), (3,)])
+        self.assertEqual(second.columns, ['a'])
+
+    def test_shown_rows_are_kept_for_children(self):
+        self.run_sql("CREATE TABLE t (a INTEGER)", "INSERT INTO t VALUES (1), (2), (3)")
+        session = Session()
+        self.run_job("initialize(Q, SELECT a FROM t)", session)
+        self.run_job("Q.show()", session)
+        self.assertEqual(list(session.query_cache.get('Q').complete_result()), [(1,), (2,), (3,)])
+
+class JobManagerTest(SQLiteTestCase):
+    def test_forgets_and_cancels_old_jobs(self):
+        manager = jobs.JobManager(0)
+        session = Session()
+        finished = manager.submit("SELECT 1", session)
+        finished.finish(jobs.DONE)
+        abandoned = manager.submit("SELECT 1", session)
+        finished.finished_at = abandoned.last_polled = time.time() - config.WEB_JOB_RETENTION - 1
+        with manager.lock:
+            manager.forget_old_jobs()
+        self.assertTrue(manager.get(finished.id, session) is None)
+        self.assertEqual(abandoned.state, jobs.CANCELLED)
+
+    def test_other_sessions_cant_see_jobs(self):
+        manager = jobs.JobManager(0)
+        job = manager.submit("SELECT 1", Session())
+        self.assertTrue(manager.get(job.id, Session()) is None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+# Tests for quest.query.local: answering ROLLUP and NARROW from the
+# parent's kept rows.
+
+import unittest
+
+import quest.config as config
+import quest.engine
+import quest.stats
+from quest.query import local
+from quest.query.query import Query
+from quest.test.sqlite_case import SQLiteTestCase, save_hierarchies, restore_hierarchies
+
+class LocalTestCase(SQLiteTestCase):
+    settings = {'ROWS_TO_SHOW': config.ALL_ROWS, 'KEEP_RESULT_ROWS': 1000,
+            'LOCAL_ROLLUP': True, 'LOCAL_NARROW': True, 'STATS_ENABLED': True,
+            'PREFETCH_SHIFTS': False, 'INDEX_ADVISOR_ENABLED': False}
+
+    def setUp(self):
+        SQLiteTestCase.setUp(self)
+        local.hierarchy_mappings.clear()
+        self.saved_hierarchies = save_hierarchies()
+        config.create_hierarchy(['lg', 'teamid', 'playerid'])
+        self.create_players()
+
+    def tearDown(self):
+        restore_hierarchies(self.saved_hierarchies)
+        SQLiteTestCase.tearDown(self)
+
+    def sources(self, function):
+        """Calls function, and returns it result and the sources of its statements."""
+        quest.stats.clear()
+        result = function()
+        return result, [event.source for event in quest.stats.events()]
+
+    def assertSameRows(self, query):
+        """query's rows match what the DB says, ignoring order."""
+        expected = quest.engine.run_sql(query.statement).fetchall()
+        self.assertEqual(sorted(query.show()), sorted(expected))
+
+class LocalRollupTest(LocalTestCase):
+    def test_rollup_in_memory(self):
+        parent = Query("SELECT lg, teamid, SUM(hr), COUNT(hr), MIN(hr), MAX(hr), AVG(hr) FROM players GROUP BY lg, teamid")
+        parent.show()
+        child = parent.rollup('teamid')
+        rows, sources = self.sources(child.show)
+        self.assertEqual(sources, ['local'])
+        expected = quest.engine.run_sql(child.statement).fetchall()
+        self.assertEqual(sorted(rows), sorted(expected))
+
+    def test_rollup_of_rollup(self):
+        parent = Query("SELECT lg, teamid, playerid, SUM(hr) FROM players GROUP BY lg, teamid, playerid")
+        parent.show()
+        teams = parent.rollup('playerid')
+        teams.show()
+        leagues = teams.rollup('teamid')
+        rows, sources = self.sources(leagues.show)
+        self.assertEqual(sources, ['local'])
+        self.assertSameRows(leagues)
+
+    def test_having_goes_to_db(self):
+        parent = Query("SELECT lg, teamid, SUM(hr) FROM players GROUP BY lg, teamid HAVING SUM(hr) > 5")
+        parent.show()
+        rows, sources = self.sources(parent.rollup('teamid').show)
+        self.assertEqual(sources, ['db'])
+
+    def test_parent_not_shown_goes_to_db(self):
+        parent = Query("SELECT lg, teamid, SUM(hr) FROM players GROUP BY lg, teamid")
+        rows, sources = self.sources(parent.rollup('teamid').show)
+        self.assertEqual(sources, ['db'])
+
+    def test_groups_come_out_in_key_order(self):
+        parent = Query("SELECT lg, teamid, year, SUM(hr), MIN(hr) FROM players GROUP BY lg, teamid, year")
+        parent.show()
+        child = parent.rollup('teamid')
+        rows, sources = self.sources(child.show)
+        self.assertEqual(sources, ['local'])
+        self.assertEqual(list(rows), quest.engine.run_sql(child.statement).fetchall())
+
+    def test_without_numpy(self):
+        saved_numpy = local.numpy
+        local.numpy = None
+        try:
+            self.test_groups_come_out_in_key_order()
+        finally:
+            local.numpy = saved_numpy
+
+    def test_hierarchy_mapping_is_cached(self):
+        parent = Query("SELECT teamid, SUM(hr) FROM players GROUP BY teamid")
+        parent.show()
+        rows, sources = self.sources(parent.rollup('teamid').show)
+        self.assertEqual(sources, ['db', 'local'])
+        self.assertEqual(list(rows), [(u'AL', 138), (u'NL', 87)])
+        rows, sources = self.sources(parent.rollup('teamid').show)
+        self.assertEqual(sources, ['local'])
+        # Only writes to players make it stale
+        quest.engine.invalidate_statement("INSERT INTO teams VALUES ('BOS')")
+        self.assertEqual(len(local.hierarchy_mappings), 1)
+        quest.engine.invalidate_statement("INSERT INTO players VALUES ('p', 'BOS', 'AL', 2003, 1)")
+        self.assertEqual(len(local.hierarchy_mappings), 0)
+
+    def test_case_insensitive_strings_go_to_db(self):
+        backend = quest.engine.get_backend()
+        backend.case_insensitive_strings = True
+        try:
+            parent = Query("SELECT lg, teamid, SUM(hr) FROM players GROUP BY lg, teamid")
+            parent.show()
+            rows, sources = self.sources(parent.rollup('teamid').show)
+            self.assertEqual(sources, ['db'])
+        finally:
+            del backend.case_insensitive_strings
+
+class LocalNarrowTest(LocalTestCase):
+    def test_narrow_in_memory(self):
+        parent = Query("SELECT * FROM players WHERE year >= 2001")
+        parent.show()
+        child = parent.narrow("teamid IN ('BOS', 'CHN') AND hr > 12")
+        rows, sources = self.sources(child.show)
+        self.assertEqual(sources, ['local'])
+        self.assertSameRows(child)
+
+    def test_narrow_of_narrow(self):
+        parent = Query("SELECT playerid, teamid, hr FROM players")
+        parent.show()
+        teams = parent.narrow("teamid <> 'NYA'")
+        teams.show()
+        rows, sources = self.sources(teams.narrow("hr BETWEEN 3 AND 20").show)
+        self.assertEqual(sources, ['local'])
+        self.assertEqual(sorted(rows), sorted(quest.engine.run_sql(
+                "SELECT playerid, teamid, hr FROM players WHERE teamid <> 'NYA' AND hr BETWEEN 3 AND 20").fetchall()))
+
+    def test_narrow_on_group_by_column(self):
+        parent = Query("SELECT teamid, SUM(hr) FROM players GROUP BY teamid")
+        parent.show()
+        child = parent.narrow("teamid = 'BOS'")
+        rows, sources = self.sources(child.show)
+        self.assertEqual(sources, ['local'])
+        self.assertSameRows(child)
+
+    def test_narrow_on_aggregated_column_goes_to_db(self):
+        # hr is summed away, so the DB has to filter the rows first
+        parent = Query("SELECT teamid, SUM(hr) FROM players GROUP BY teamid")
+        parent.show()
+        child = parent.narrow("hr > 10")
+        rows, sources = self.sources(child.show)
+        self.assertEqual(sources, ['db'])
+        self.assertSameRows(child)
+
+    def test_unknown_predicate_goes_to_db(self):
+        parent = Query("SELECT * FROM players")
+        parent.show()
+        child = parent.narrow("hr % 2 = 0")
+        rows, sources = self.sources(child.show)
+        self.assertEqual(sources, ['db'])
+        self.assertSameRows(child)
+
+class KeptResultTest(LocalTestCase):
+    def test_show_again_sees_outside_changes(self):
+        query = Query("SELECT playerid, hr FROM players WHERE playerid = 'pBOS0' AND year = 2000")
+        self.assertEqual(list(query.show()), [(u'pBOS0', 0)])
+        # Behind Quest's back, so nothing is invalidated
+        pool = quest.engine.get_pool()
+        connection = pool.checkout()
+        connection.execute("UPDATE players SET hr = 99")
+        pool.checkin(connection)
+        self.assertEqual(list(query.show()), [(u'pBOS0', 99)])
+
+    def test_quest_write_invalidates_kept_rows(self):
+        parent = Query("SELECT lg, teamid, SUM(hr) FROM players GROUP BY lg, teamid")
+        parent.show()
+        update = "UPDATE players SET hr = hr + 1"
+        quest.engine.run_sql(update)
+        quest.engine.invalidate_statement(update)
+        child = parent.rollup('teamid')
+        rows, sources = self.sources(child.show)
+        self.assertEqual(sources, ['db'])
+        self.assertSameRows(child)
+
+    def test_keep_nothing(self):
+        config.KEEP_RESULT_ROWS = 0
+        parent = Query("SELECT lg, teamid, SUM(hr) FROM players GROUP BY lg, teamid")
+        parent.show()
+        self.assertTrue(parent.result is None)
+
+if __name__ == '__main__':
+    unittest.main()
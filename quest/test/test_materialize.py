@@ -0,0 +1,91 @@
+# Tests for quest.query.materialize: storing RELATE's left side in a
+# table, and routing statements to it.
+
+import unittest
+
+import quest.config as config
+import quest.engine
+from quest.query import materialize
+from quest.query.query import Query
+from quest.test.sqlite_case import SQLiteTestCase
+
+TEAMS = "SELECT teamid, SUM(hr) AS hr FROM players GROUP BY teamid"
+
+class MaterializeTest(SQLiteTestCase):
+    settings = {'MATERIALIZE_ENABLED': True, 'MATERIALIZE_MAX_TABLES': 20,
+            'ROWS_TO_SHOW': config.ALL_ROWS, 'KEEP_RESULT_ROWS': 0,
+            'SUMMARY_TABLES_ENABLED': False, 'PREFETCH_SHIFTS': False,
+            'INDEX_ADVISOR_ENABLED': False}
+
+    def setUp(self):
+        SQLiteTestCase.setUp(self)
+        materialize.materializations.clear()
+        self.create_players()
+        self.run_sql("CREATE TABLE teams (teamid TEXT, name TEXT)",
+                "INSERT INTO teams VALUES ('BOS', 'Red Sox'), ('NYA', 'Yankees'), ('CHN', 'Cubs')")
+
+    def tearDown(self):
+        materialize.drop_all()
+        SQLiteTestCase.tearDown(self)
+
+    def tables(self):
+        return set([row[0] for row in quest.engine.run_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'quest_mat_%'").fetchall()])
+
+    def test_relate_reads_from_materialized_table(self):
+        joined = Query(TEAMS).relate('teams')
+        name = materialize.table_name(TEAMS)
+        self.assertEqual(self.tables(), set([name]))
+        self.assertEqual(materialize.materializations.values()[0].indexes, [('teamid',)])
+        executable = joined.executable_statement()
+        self.assertTrue(name in executable)
+        self.assertFalse('GROUP BY' in executable)
+        self.assertEqual(sorted(joined.show()), sorted(quest.engine.run_sql(joined.statement).fetchall()))
+
+    def test_plain_table_read_isnt_materialized(self):
+        Query("SELECT * FROM players").relate('teams')
+        self.assertEqual(self.tables(), set())
+
+    def test_route(self):
+        Query(TEAMS).relate('teams')
+        name = materialize.table_name(TEAMS)
+        self.assertEqual(materialize.route("select  teamid, sum(hr) as hr from players group by teamid"),
+                "SELECT * FROM %s" % name)
+        self.assertEqual(materialize.route("SELECT * FROM (%s) AS t WHERE hr > 1" % TEAMS),
+                "SELECT * FROM %s AS t WHERE hr > 1" % name)
+        self.assertEqual(materialize.route("SELECT * FROM players"), None)
+        # A table doesn't keep the rows in order
+        self.assertEqual(materialize.route(TEAMS + " ORDER BY hr"), None)
+
+    def test_writes_make_it_stale(self):
+        joined = Query(TEAMS).relate('teams')
+        update = "UPDATE players SET hr = hr + 1"
+        quest.engine.run_sql(update)
+        quest.engine.invalidate_statement(update)
+        self.assertEqual(materialize.find(TEAMS), None)
+        self.assertEqual(joined.executable_statement(), joined.statement)
+        self.assertEqual(sorted(joined.show()), sorted(quest.engine.run_sql(joined.statement).fetchall()))
+        # Dropped the next time anything is materialized
+        Query("SELECT teamid, MAX(hr) AS hr FROM players GROUP BY teamid").relate('teams')
+        self.assertFalse(materialize.table_name(TEAMS) in self.tables())
+
+    def test_least_recently_used_are_dropped(self):
+        config.MATERIALIZE_MAX_TABLES = 2
+        statements = ["SELECT teamid, %s(hr) AS hr FROM players GROUP BY teamid" % function
+                for function in ('SUM', 'MIN', 'MAX')]
+        for sql in statements:
+            Query(sql).relate('teams')
+        self.assertEqual(self.tables(), set([materialize.table_name(sql) for sql in statements[1:]]))
+
+    def test_store_is_registered(self):
+        query = Query(TEAMS)
+        query.store('team_hr')
+        self.assertEqual(materialize.find(TEAMS).name, 'team_hr')
+        self.assertEqual(query.executable_statement(), "SELECT * FROM team_hr")
+        self.assertTrue(query.store('team_hr').startswith("Nothing to run"))
+        materialize.drop_all()
+        # STORE's tables belong to the user
+        self.assertEqual(quest.engine.run_sql("SELECT COUNT(*) FROM team_hr").fetchall(), [(3,)])
+
+if __name__ == '__main__':
+    unittest.main()
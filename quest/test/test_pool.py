@@ -0,0 +1,131 @@
+# Tests for quest.engine's connection pool.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import quest.config as config
+import quest.engine
+from quest.test.sqlite_case import SQLiteTestCase
+
+class ConnectionPoolTest(SQLiteTestCase):
+    def test_checkin_reuses_connection(self):
+        pool = quest.engine.ConnectionPool(2)
+        connection = pool.checkout()
+        pool.checkin(connection)
+        self.assertTrue(pool.checkout() is connection)
+        self.assertEqual(pool.size, 1)
+
+    def test_full_pool_times_out(self):
+        pool = quest.engine.ConnectionPool(2, timeout = 0.05)
+        pool.checkout()
+        pool.checkout()
+        self.assertRaises(quest.engine.QuestPoolTimeoutError, pool.checkout)
+
+    def test_discard_frees_slot(self):
+        pool = quest.engine.ConnectionPool(1, timeout = 0.05)
+        pool.discard(pool.checkout())
+        self.assertEqual(pool.size, 0)
+        pool.checkout()
+
+    def test_checkout_connection_returns_connection_after_error(self):
+        pool = quest.engine.get_pool()
+        try:
+            with quest.engine.checkout_connection() as connection:
+                raise ValueError("oops")
+        except ValueError:
+            pass
+        self.assertEqual(pool.idle.qsize(), 1)
+
+class StaleConnection(Exception):
+    pass
+
+class RetryTest(SQLiteTestCase):
+    """run_sql runs a statement again after a stale connection error only if that's safe."""
+
+    def setUp(self):
+        # A stale connection is thrown away, which would take ":memory:"
+        # with it
+        self.directory = tempfile.mkdtemp()
+        self.settings = {'db_name': os.path.join(self.directory, 'quest.db')}
+        SQLiteTestCase.setUp(self)
+        self.run_sql("CREATE TABLE t (a INTEGER)")
+        backend = quest.engine.get_backend()
+        backend.is_stale_connection_error = lambda error: isinstance(error, StaleConnection)
+        self.real_execute = quest.engine.execute
+        self.executed = []
+
+    def tearDown(self):
+        quest.engine.execute = self.real_execute
+        SQLiteTestCase.tearDown(self)
+        shutil.rmtree(self.directory)
+
+    def die_after_executing(self, times = 1):
+        """Makes the next times statements run, then lose their connection."""
+        def execute(cursor, sql, params = None):
+            self.real_execute(cursor, sql, params)
+            self.executed.append(sql)
+            if len(self.executed) <= times:
+                raise StaleConnection()
+        quest.engine.execute = execute
+
+    def test_read_is_retried(self):
+        self.run_sql("INSERT INTO t VALUES (1)")
+        self.die_after_executing()
+        self.assertEqual(quest.engine.run_sql("SELECT COUNT(*) FROM t").fetchall(), [(1,)])
+        self.assertEqual(len(self.executed), 2)
+
+    def test_write_isnt_retried(self):
+        self.die_after_executing()
+        self.assertRaises(StaleConnection, quest.engine.run_sql, "INSERT INTO t VALUES (1)")
+        self.assertEqual(len(self.executed), 1)
+        self.assertEqual(quest.engine.run_sql("SELECT COUNT(*) FROM t").fetchall(), [(1,)])
+
+    def test_write_that_never_ran_is_retried(self):
+        backend = quest.engine.get_backend()
+        real_cursor = backend.cursor
+        failures = []
+        def cursor(connection):
+            if not failures:
+                failures.append(connection)
+                raise StaleConnection()
+            return real_cursor(connection)
+        backend.cursor = cursor
+        quest.engine.run_sql("INSERT INTO t VALUES (1)")
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(quest.engine.run_sql("SELECT COUNT(*) FROM t").fetchall(), [(1,)])
+
+    def test_is_read_statement(self):
+        self.assertTrue(quest.engine.is_read_statement("SELECT * FROM t"))
+        self.assertTrue(quest.engine.is_read_statement(" (select a from t) union (select a from t)"))
+        self.assertFalse(quest.engine.is_read_statement("INSERT INTO t SELECT * FROM t"))
+        self.assertFalse(quest.engine.is_read_statement("WITH x AS (SELECT 1) INSERT INTO t SELECT * FROM x"))
+        self.assertFalse(quest.engine.is_read_statement("CREATE TABLE u AS SELECT * FROM t"))
+
+class SharedFileTest(SQLiteTestCase):
+    """Writes must be visible on every pooled connection."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = {'db_name': os.path.join(self.directory, 'quest.db'), 'db_pool_size': 2}
+        SQLiteTestCase.setUp(self)
+
+    def tearDown(self):
+        SQLiteTestCase.tearDown(self)
+        shutil.rmtree(self.directory)
+
+    def test_write_is_committed(self):
+        self.run_sql("CREATE TABLE t (a INTEGER)")
+        pool = quest.engine.get_pool()
+        writer = pool.checkout()
+        reader = pool.checkout()
+        try:
+            writer.execute("INSERT INTO t VALUES (1)")
+            self.assertEqual(reader.execute("SELECT COUNT(*) FROM t").fetchone()[0], 1)
+        finally:
+            pool.checkin(writer)
+            pool.checkin(reader)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# Tests for quest.query.predicate, which evaluates simple WHERE predicates
+# in Python. Every predicate the compiler accepts has to pick the same
+# rows SQLite does.
+
+import unittest
+
+import quest.engine
+from quest.query import predicate
+from quest.test.sqlite_case import SQLiteTestCase
+
+ROWS = [
+        (2000, 'BOS', 'Anna', 1.5),
+        (2001, 'NYA', 'bob', None),
+        (2002, None, "O'Neil", 3.0),
+        (2003, 'CHN', 'Zed', -2.0),
+        ]
+COLUMNS = {'year': 0, 'teamid': 1, 'name': 2, 'avg': 3}
+
+class PredicateTest(SQLiteTestCase):
+    def setUp(self):
+        SQLiteTestCase.setUp(self)
+        self.run_sql("CREATE TABLE t (year INTEGER, teamid TEXT, name TEXT, avg REAL)")
+        for row in ROWS:
+            quest.engine.run_sql("INSERT INTO t VALUES (%s, %s, %s, %s)", row)
+
+    def matching(self, text):
+        test = predicate.compile_predicate(text, COLUMNS)
+        return [row for row in ROWS if test(row)]
+
+    def assertLikeDB(self, text):
+        expected = quest.engine.run_sql("SELECT * FROM t WHERE %s ORDER BY year" % text).fetchall()
+        self.assertEqual(self.matching(text), expected, text)
+
+    def test_matches_the_db(self):
+        for text in ["year >= 2001", "year <> 2001", "year != 2001", "2001 < year",
+                "teamid = 'BOS' OR teamid = 'CHN'", "year > 2000 AND teamid IS NOT NULL",
+                "teamid IS NULL", "NOT teamid = 'BOS'", "year BETWEEN 2001 AND 2002",
+                "year NOT BETWEEN 2001 AND 2002", "teamid IN ('BOS', 'NYA')",
+                "teamid NOT IN ('BOS', 'NYA')", "name LIKE 'a%'", "name NOT LIKE '_e_'",
+                "name = 'O''Neil'", "avg > -1", "avg < 2.5", "NOT (year = 2000 OR avg IS NULL)",
+                "`year` = 2003"]:
+            self.assertLikeDB(text)
+
+    def test_nulls_are_unknown(self):
+        # Neither avg = 1 nor its opposite holds for a NULL avg
+        self.assertEqual(len(self.matching("avg = 1.5")) + len(self.matching("NOT avg = 1.5")), 3)
+
+    def test_beyond_us(self):
+        for text in ["year + 1 > 2001", "LOWER(name) = 'bob'", "hr > 1",
+                "year IN (SELECT year FROM u)", "name = \"bob\"", "name = 'a\\'b'"]:
+            self.assertRaises(predicate.CannotEvaluate, predicate.compile_predicate, text, COLUMNS)
+
+    def test_mixed_types_are_beyond_us(self):
+        # The DB would convert the string first
+        test = predicate.compile_predicate("year = '2000'", COLUMNS)
+        self.assertRaises(predicate.CannotEvaluate, test, ROWS[0])
+
+if __name__ == '__main__':
+    unittest.main()
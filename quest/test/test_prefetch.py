@@ -0,0 +1,95 @@
+# Tests for shift prefetching (quest.query.prefetch).
+
+import time
+import unittest
+
+import quest.engine
+from quest.query import prefetch
+from quest.query import shifter
+from quest.query.query import Query
+from quest.session import Session
+from quest.test.sqlite_case import SQLiteTestCase
+
+class PrefetchTest(SQLiteTestCase):
+    settings = {'PREFETCH_SHIFTS': True, 'PREFETCH_DEPTH': 1, 'PREFETCH_TTL': 60,
+            'RESULT_CACHE_ENABLED': False, 'INDEX_ADVISOR_ENABLED': False}
+
+    def setUp(self):
+        SQLiteTestCase.setUp(self)
+        shifter.clear_column_type_cache()
+        prefetch.data_changed(set())
+        self.create_players()
+        self.session = Session()
+        self.other_session = Session()
+
+    def tearDown(self):
+        for session in (self.session, self.other_session):
+            prefetch.cancel(session)
+        self.wait_for_plans()
+        prefetch.data_changed(set())
+        shifter.clear_column_type_cache()
+        SQLiteTestCase.tearDown(self)
+
+    def wait_for_plans(self):
+        deadline = time.time() + 10
+        while prefetch.running and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(prefetch.running)
+
+    def show_shifted(self, session):
+        """Shows 2001 shifted from 2000 in session; returns that query."""
+        with prefetch.for_session(session):
+            shifted = Query("SELECT * FROM players WHERE year = 2000").rshift('year')
+            shifted.show()
+        self.wait_for_plans()
+        return shifted
+
+    def key(self, query):
+        return quest.engine.normalize_sql(query.executable_statement())
+
+    def test_next_shift_is_prefetched(self):
+        shifted = self.show_shifted(self.session)
+        following = shifted.rshift('year')
+        self.assertTrue(self.key(following) in prefetch.results)
+        with prefetch.for_session(self.session):
+            rows = following.show()
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(set([row[3] for row in rows]), set([2002]))
+        self.assertFalse(self.key(following) in prefetch.results)
+
+    def test_plans_are_per_session(self):
+        self.show_shifted(self.session)
+        plan = self.session.prefetch_plan
+        self.assertTrue(plan is not None)
+        # Going somewhere unexpected only cancels the other session's plan
+        with prefetch.for_session(self.other_session):
+            Query("SELECT * FROM players WHERE year = 2002").show()
+        self.assertTrue(self.session.prefetch_plan is plan)
+        self.assertFalse(plan.token.cancelled)
+
+    def test_expired_rows_arent_used(self):
+        shifted = self.show_shifted(self.session)
+        following = shifted.rshift('year')
+        prefetch.results[self.key(following)].fetched_at -= 120
+        with prefetch.for_session(self.session):
+            self.assertEqual(prefetch.take(following.executable_statement(), 10), None)
+
+    def test_changing_data_discards_plans_in_flight(self):
+        shifted = self.show_shifted(self.session)
+        plan = self.session.prefetch_plan
+        prefetch.data_changed(set())
+        self.assertTrue(plan.token.cancelled or plan not in prefetch.running)
+        rows = quest.engine.ResultRows([(1,)])
+        self.assertFalse(prefetch.store(plan, 'select 1', prefetch.Prefetched(rows, None)))
+        self.assertEqual(prefetch.results, {})
+
+    def test_end_of_data_isnt_prefetched(self):
+        self.run_sql("CREATE TABLE people (name TEXT)", "INSERT INTO people VALUES ('Anna'), ('Bob'), ('Cy')")
+        with prefetch.for_session(self.session):
+            last = Query("SELECT * FROM people WHERE name = 'Bob'").rshift('name')
+            last.show()
+        self.wait_for_plans()
+        self.assertEqual(prefetch.results.keys(), ["select * from people where name = 'Bob'"])
+
+if __name__ == '__main__':
+    unittest.main()
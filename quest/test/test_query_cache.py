@@ -0,0 +1,70 @@
+# Tests for quest.query.query_cache, and how long queries live.
+
+import gc
+import unittest
+import weakref
+
+import quest.config as config
+from quest.query import query_cache
+from quest.query.query import Query
+
+class QueryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.saved_size = config.QUERY_CACHE_SIZE
+        self.cache = query_cache.QueryCache()
+
+    def tearDown(self):
+        config.QUERY_CACHE_SIZE = self.saved_size
+
+    def test_variable_names(self):
+        names = query_cache.variable_names()
+        first = [names.next() for number in range(28)]
+        self.assertEqual(first[:3], ['A', 'B', 'C'])
+        self.assertEqual(first[25:], ['Z', 'AA', 'AB'])
+
+    def test_skips_names_the_user_took(self):
+        self.cache.put('A', "SELECT * FROM players")
+        key, query = self.cache.put(None, "SELECT * FROM teams")
+        self.assertEqual(key, 'B')
+
+    def test_evicts_least_recently_used(self):
+        config.QUERY_CACHE_SIZE = 2
+        self.cache.put(None, "SELECT 1 FROM t")
+        self.cache.put(None, "SELECT 2 FROM t")
+        # Using A makes B the least recently used
+        self.cache.get('A')
+        self.cache.put(None, "SELECT 3 FROM t")
+        self.assertRaises(KeyError, self.cache.get, 'B')
+        self.assertEqual(str(self.cache.get('A')), "SELECT 1 FROM t")
+
+    def test_named_queries_are_pinned(self):
+        config.QUERY_CACHE_SIZE = 1
+        self.cache.put('Q', "SELECT 1 FROM t")
+        self.cache.put(None, "SELECT 2 FROM t")
+        self.cache.put(None, "SELECT 3 FROM t")
+        self.assertEqual(str(self.cache.get('Q')), "SELECT 1 FROM t")
+        self.assertEqual(len(self.cache.unpinned_keys), 1)
+
+class QueryLifetimeTest(unittest.TestCase):
+    def test_evicted_ancestors_are_freed(self):
+        saved_size, saved_advisor = config.QUERY_CACHE_SIZE, config.INDEX_ADVISOR_ENABLED
+        config.QUERY_CACHE_SIZE = 3
+        config.INDEX_ADVISOR_ENABLED = False
+        try:
+            cache = query_cache.QueryCache()
+            key, query = cache.put(None, "SELECT * FROM players WHERE year > 2000")
+            root = weakref.ref(query)
+            for number in range(10):
+                key, query = cache.put(None, query.narrow("hr > %d" % number))
+            del query
+            gc.collect()
+            self.assertTrue(root() is None)
+            newest = cache.get(key)
+            # The parent stays, for quest.query.local
+            self.assertTrue(newest.parent is not None)
+            self.assertEqual(newest.lineage(), ('narrow',) * 10)
+        finally:
+            config.QUERY_CACHE_SIZE, config.INDEX_ADVISOR_ENABLED = saved_size, saved_advisor
+
+if __name__ == '__main__':
+    unittest.main()
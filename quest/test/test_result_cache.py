@@ -0,0 +1,73 @@
+# Tests for quest.engine's result cache, and how it finds out which
+# tables a statement touches.
+
+import time
+import unittest
+
+import quest.config as config
+import quest.engine
+from quest.test.sqlite_case import SQLiteTestCase
+
+class TableReferenceTest(unittest.TestCase):
+    def test_single_table(self):
+        self.assertEqual(quest.engine.referenced_tables("SELECT * FROM players WHERE year = 2000"), set(['players']))
+
+    def test_comma_join(self):
+        self.assertEqual(quest.engine.referenced_tables("select * from players, teams where players.teamid = teams.teamid"),
+                set(['players', 'teams']))
+
+    def test_joins_and_subqueries(self):
+        sql = "SELECT * FROM (SELECT teamid FROM players) AS p NATURAL JOIN `Teams`, leagues WHERE lg IN (SELECT lg FROM franchises)"
+        self.assertEqual(quest.engine.referenced_tables(sql), set(['players', 'teams', 'leagues', 'franchises']))
+
+    def test_select_list_commas_arent_tables(self):
+        self.assertEqual(quest.engine.referenced_tables("SELECT a, b FROM t"), set(['t']))
+
+    def test_string_literals_are_ignored(self):
+        self.assertEqual(quest.engine.referenced_tables("SELECT * FROM t WHERE name = 'from x, y'"), set(['t']))
+
+    def test_written_tables(self):
+        self.assertEqual(quest.engine.written_tables("INSERT INTO t SELECT * FROM u"), set(['t']))
+        self.assertEqual(quest.engine.written_tables("UPDATE players SET hr = 1"), set(['players']))
+
+    def test_normalize_sql(self):
+        self.assertEqual(quest.engine.normalize_sql("SELECT  *\nFROM t WHERE a = 'X Y';"),
+                quest.engine.normalize_sql("select * from t where a = 'X Y'"))
+        self.assertNotEqual(quest.engine.normalize_sql("select * from t where a = 'x'"),
+                quest.engine.normalize_sql("select * from t where a = 'X'"))
+
+class ResultCacheTest(unittest.TestCase):
+    def test_invalidates_every_table_of_a_join(self):
+        cache = quest.engine.ResultCache(10)
+        cache.store("SELECT * FROM players, teams", None, ['rows'])
+        cache.store("SELECT * FROM leagues", None, ['other rows'])
+        cache.invalidate_statement("UPDATE teams SET name = 'x'")
+        self.assertTrue(cache.lookup("SELECT * FROM players, teams", None) is None)
+        self.assertEqual(cache.lookup("SELECT * FROM leagues", None), ['other rows'])
+
+    def test_limit_is_part_of_key(self):
+        cache = quest.engine.ResultCache(10)
+        cache.store("SELECT * FROM t", 10, ['rows'])
+        self.assertTrue(cache.lookup("SELECT * FROM t", None) is None)
+        self.assertEqual(cache.lookup("select *  from t;", 10), ['rows'])
+
+    def test_ttl(self):
+        cache = quest.engine.ResultCache(10, ttl = 0.01)
+        cache.store("SELECT * FROM t", None, ['rows'])
+        time.sleep(0.02)
+        self.assertTrue(cache.lookup("SELECT * FROM t", None) is None)
+
+class ShowCacheTest(SQLiteTestCase):
+    settings = {'RESULT_CACHE_ENABLED': True}
+
+    def test_show_is_cached_until_a_write(self):
+        self.run_sql("CREATE TABLE t (a INTEGER)", "INSERT INTO t VALUES (1)")
+        self.assertEqual(list(quest.engine.show("SELECT a FROM t", config.ALL_ROWS)), [(1,)])
+        # Behind Quest's back, so the cache doesn't know
+        self.run_sql("INSERT INTO t VALUES (2)")
+        self.assertEqual(list(quest.engine.show("SELECT a FROM t", config.ALL_ROWS)), [(1,)])
+        quest.engine.invalidate_statement("INSERT INTO t VALUES (2)")
+        self.assertEqual(list(quest.engine.show("SELECT a FROM t", config.ALL_ROWS)), [(1,), (2,)])
+
+if __name__ == '__main__':
+    unittest.main()
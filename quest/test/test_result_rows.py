@@ -0,0 +1,85 @@
+# Tests for quest.engine's column-by-column ResultRows, and
+# fetch_result_rows, which builds them from a cursor.
+
+import unittest
+
+import quest.engine
+from quest.engine import Column, ResultRows
+from quest.test.sqlite_case import SQLiteTestCase
+
+ROWS = [(1, 'a', 2.5, None), (3, None, 0.5, 7L), (2, 'c', None, 1L)]
+
+class ResultRowsTest(unittest.TestCase):
+    def test_acts_like_a_list_of_tuples(self):
+        rows = ResultRows(ROWS)
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(list(rows), ROWS)
+        self.assertEqual(rows, ROWS)
+        self.assertEqual(rows[1], ROWS[1])
+        self.assertEqual(rows[-1], ROWS[-1])
+        self.assertEqual(rows[1:], ROWS[1:])
+        self.assertRaises(IndexError, lambda: rows[3])
+
+    def test_numbers_are_kept_in_arrays(self):
+        rows = ResultRows(ROWS)
+        self.assertEqual(rows.columns[0].python_type, int)
+        self.assertEqual(rows.columns[1].python_type, None)
+        # NULLs come back as None, not as the 0 standing in for them
+        self.assertEqual(rows.column(2), [2.5, 0.5, None])
+        self.assertEqual(rows.column(3), [None, 7L, 1L])
+        self.assertEqual(type(rows.column(3)[1]), long)
+
+    def test_empty(self):
+        rows = ResultRows((), quest.engine.describe_columns(['a', 'b']))
+        self.assertEqual(len(rows), 0)
+        self.assertEqual(list(rows), [])
+        self.assertEqual(rows.column_names(), ['a', 'b'])
+        self.assertEqual(rows.columns[0].minimum(), None)
+
+    def test_sorted_by_puts_nulls_first(self):
+        rows = ResultRows(ROWS)
+        self.assertEqual(rows.sorted_by(0), sorted(ROWS))
+        self.assertEqual(rows.sorted_by(2).column(2), [None, 0.5, 2.5])
+        self.assertEqual(rows.sorted_by(2, True).column(2), [2.5, 0.5, None])
+
+    def test_minimum_and_maximum_skip_nulls(self):
+        self.assertEqual(Column([3, None, 1]).minimum(), 1)
+        self.assertEqual(Column([3, None, 1]).maximum(), 3)
+        self.assertEqual(Column(['b', None, 'a']).minimum(), 'a')
+        self.assertEqual(Column([None, None]).maximum(), None)
+
+    def test_huge_longs_stay_python_values(self):
+        column = Column([2 ** 70, 1L])
+        self.assertEqual(column.python_type, None)
+        self.assertEqual(column.to_list(), [2 ** 70, 1L])
+
+class FetchResultRowsTest(SQLiteTestCase):
+    def setUp(self):
+        SQLiteTestCase.setUp(self)
+        self.create_players()
+
+    def fetch(self, limit = None):
+        return quest.engine.fetch_result_rows(
+                quest.engine.run_sql("SELECT playerid, year, hr FROM players ORDER BY playerid, year"), limit)
+
+    def test_matches_fetchall(self):
+        expected = quest.engine.run_sql("SELECT playerid, year, hr FROM players ORDER BY playerid, year").fetchall()
+        rows = self.fetch()
+        self.assertEqual(rows, expected)
+        self.assertEqual(rows.column_names(), ['playerid', 'year', 'hr'])
+
+    def test_limit(self):
+        self.assertEqual(len(self.fetch(4)), 4)
+        self.assertEqual(len(self.fetch(0)), 0)
+
+    def test_batches(self):
+        old_batch_size = quest.engine.FETCH_BATCH_SIZE
+        quest.engine.FETCH_BATCH_SIZE = 5
+        try:
+            self.assertEqual(len(self.fetch()), 18)
+            self.assertEqual(len(self.fetch(7)), 7)
+        finally:
+            quest.engine.FETCH_BATCH_SIZE = old_batch_size
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# Tests for ROLLUP/DRILLDOWN's rewriting (quest.query.rollup_drilldown):
+# parsed statements from quest.query.statement, and the sqlparse fallback
+# with its parse_cache, both directly and through Query.
+
+import unittest
+
+import quest.config as config
+from quest.exception import QuestOperationNotAllowedException
+from quest.query import rollup_drilldown, statement
+from quest.query.query import Query
+from quest.test.sqlite_case import save_hierarchies, restore_hierarchies
+
+class RollupDrilldownTest(unittest.TestCase):
+    def setUp(self):
+        self.saved_hierarchies = save_hierarchies()
+        config.create_hierarchy(['lg', 'teamid', 'playerid'])
+        rollup_drilldown.parse_cache.clear()
+
+    def tearDown(self):
+        rollup_drilldown.parse_cache.clear()
+        restore_hierarchies(self.saved_hierarchies)
+
+    def test_rollup(self):
+        self.assertEqual(rollup_drilldown.rollup("SELECT teamid, SUM(hr) FROM players GROUP BY teamid", 'teamid'),
+                "SELECT lg, SUM(hr) FROM players GROUP BY lg")
+
+    def test_drilldown(self):
+        parsed = statement.parse("select lg, count(*) from players where year = 2000 group by lg;")
+        self.assertEqual(rollup_drilldown.drilldown(parsed, 'lg').sql(),
+                "SELECT teamid, count(*) FROM players WHERE year = 2000 GROUP BY teamid")
+
+    def test_parsed_statements_dont_parse(self):
+        parsed = statement.parse("SELECT playerid, SUM(hr) FROM players GROUP BY playerid")
+        rolled_up = rollup_drilldown.rollup(parsed, 'playerid')
+        self.assertEqual(rolled_up.group_by, ('teamid',))
+        self.assertEqual(len(rollup_drilldown.parse_cache), 0)
+
+    def test_leaves_similar_names_alone(self):
+        self.assertEqual(rollup_drilldown.rollup("SELECT teamid, teamid_old FROM players GROUP BY teamid, teamid_old", 'teamid'),
+                "SELECT lg, teamid_old FROM players GROUP BY lg, teamid_old")
+
+    def test_unknown_attribute(self):
+        self.assertRaises(QuestOperationNotAllowedException, rollup_drilldown.rollup, "SELECT lg FROM players", 'lg')
+        self.assertRaises(QuestOperationNotAllowedException, rollup_drilldown.drilldown, "SELECT year FROM players", 'year')
+
+    def test_sqlparse_results_are_cached(self):
+        sql = "SELECT teamid, SUM(hr) FROM players WHERE teamid <> 'BOS' GROUP BY teamid"
+        first = rollup_drilldown.rollup(sql, 'teamid')
+        self.assertEqual((rollup_drilldown.parse_cache.hits, rollup_drilldown.parse_cache.misses), (0, 1))
+        self.assertEqual(rollup_drilldown.rollup(sql, 'teamid'), first)
+        self.assertEqual((rollup_drilldown.parse_cache.hits, rollup_drilldown.parse_cache.misses), (1, 1))
+        self.assertTrue(first.startswith("SELECT lg, SUM(hr) FROM players WHERE"))
+
+    def test_query_uses_parse_cache(self):
+        # A UNION is more than quest.query.statement understands, so Query
+        # hands rollup_drilldown the SQL text
+        sql = "SELECT teamid, SUM(hr) FROM players GROUP BY teamid UNION SELECT teamid, SUM(hr) FROM batting GROUP BY teamid"
+        self.assertEqual(Query(sql).parsed, None)
+        first = Query(sql).rollup('teamid')
+        second = Query(sql).rollup('teamid')
+        self.assertEqual(second.statement, first.statement)
+        self.assertEqual((rollup_drilldown.parse_cache.hits, rollup_drilldown.parse_cache.misses), (1, 1))
+        self.assertEqual(first.statement.count("lg"), 4)
+
+    def test_query_with_parsed_statement(self):
+        child = Query("SELECT teamid, SUM(hr) FROM players GROUP BY teamid").drilldown('teamid')
+        self.assertEqual(child.parsed.group_by, ('playerid',))
+        self.assertEqual(len(rollup_drilldown.parse_cache), 0)
+
+if __name__ == '__main__':
+    unittest.main()
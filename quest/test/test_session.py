@@ -0,0 +1,40 @@
+# Tests for per-user Sessions (quest.session): each one keeps its own
+# query variables.
+
+import unittest
+
+import quest.config as config
+import quest.input_handler
+from quest.session import Session
+from quest.test.sqlite_case import SQLiteTestCase
+
+class SessionTest(SQLiteTestCase):
+    settings = {'ALWAYS_SHOW': False, 'STREAM_RESULTS': False,
+            'PREFETCH_SHIFTS': False, 'INDEX_ADVISOR_ENABLED': False}
+
+    def setUp(self):
+        SQLiteTestCase.setUp(self)
+        self.create_players()
+
+    def handle(self, session, user_input):
+        return quest.input_handler.handle(user_input, session)
+
+    def test_sessions_dont_share_variables(self):
+        alice = Session()
+        bob = Session()
+        self.handle(alice, "initialize(Q, SELECT * FROM players WHERE year = 2000)")
+        self.handle(bob, "initialize(Q, SELECT * FROM players WHERE year = 2002)")
+        self.assertEqual(self.handle(alice, "Q"), "SELECT * FROM players WHERE year = 2000")
+        self.assertEqual(self.handle(bob, "Q"), "SELECT * FROM players WHERE year = 2002")
+        self.assertEqual(len(self.handle(alice, "Q.show()")), 6)
+
+    def test_most_recent_query_is_per_session(self):
+        alice = Session()
+        bob = Session()
+        self.handle(alice, "initialize(Q, SELECT * FROM players)")
+        self.assertTrue("New query:" in self.handle(alice, "Q.narrow(hr > 10)"))
+        self.assertEqual(alice.most_recent_key_and_query()[1].statement, "SELECT * FROM players WHERE hr > 10")
+        self.assertEqual(self.handle(bob, "Q.narrow(hr > 10)"), "!!! Q is not a valid query variable. Please try again.")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+# Tests for RSHIFT/LSHIFT (quest.query.shifter).
+
+import unittest
+
+import quest.config as config
+import quest.engine
+from quest.query import neighbors, shifter
+from quest.query.query import Query
+from quest.test.sqlite_case import SQLiteTestCase
+
+class ShiftTestCase(SQLiteTestCase):
+    settings = {'INDEX_ADVISOR_ENABLED': False, 'PREFETCH_SHIFTS': False}
+
+    def setUp(self):
+        SQLiteTestCase.setUp(self)
+        shifter.clear_column_type_cache()
+        self.create_players()
+
+    def tearDown(self):
+        shifter.clear_column_type_cache()
+        SQLiteTestCase.tearDown(self)
+
+class NumericShiftTest(ShiftTestCase):
+    def test_rshift(self):
+        query = Query("SELECT * FROM players WHERE year BETWEEN 2000 AND 2001")
+        self.assertEqual(query.rshift('year').statement, "SELECT * FROM players WHERE year BETWEEN 2001 AND 2002")
+
+    def test_lshift_steps(self):
+        query = Query("SELECT * FROM players WHERE year >= 2002")
+        self.assertEqual(query.lshift('year', 2).statement, "SELECT * FROM players WHERE year >= 2000")
+
+    def test_shift_several(self):
+        query = Query("SELECT * FROM players WHERE year = 2001 AND hr < 10")
+        self.assertEqual(query.shift('year+', 'hr-3').statement, "SELECT * FROM players WHERE year = 2002 AND hr < 7")
+
+class MultiShiftTest(ShiftTestCase):
+    def test_steps_from_the_prompt(self):
+        query = Query("SELECT * FROM players WHERE year BETWEEN 2000 AND 2001")
+        self.assertEqual(query.rshift('year', '3').statement, "SELECT * FROM players WHERE year BETWEEN 2003 AND 2004")
+        self.assertRaises(ValueError, query.rshift, 'year', 'two')
+
+    def test_shift_specs(self):
+        query = Query("SELECT * FROM players WHERE year > 2000 AND hr <= 10 AND teamid = 'BOS'")
+        self.assertEqual(query.shift(' year + 2', 'hr-', 'teamid+').statement,
+                "SELECT * FROM players WHERE year > 2002 AND hr <= 9 AND teamid = 'CHN'")
+        self.assertRaises(ValueError, query.shift)
+        self.assertRaises(ValueError, query.shift, 'year*2')
+
+    def test_shift_is_one_child(self):
+        query = Query("SELECT * FROM players WHERE year = 2000 AND hr < 10")
+        shifted = query.shift('year+', 'hr+')
+        self.assertTrue(shifted.parent is query)
+        self.assertEqual(shifted.derivation[0], 'shift')
+        self.assertEqual(len(shifted.derivation[1]), 2)
+
+class ColumnTypeCacheTest(ShiftTestCase):
+    def test_types_are_cached(self):
+        Query("SELECT * FROM players WHERE year = 2001").rshift('year')
+        self.assertEqual(shifter.column_type_cache[('players', 'year')], int)
+
+    def test_empty_result_uses_table_types(self):
+        empty = Query("SELECT * FROM players WHERE year BETWEEN 3000 AND 3001")
+        self.assertEqual(empty.rshift('year').statement, "SELECT * FROM players WHERE year BETWEEN 3001 AND 3002")
+
+    def test_unknown_types_arent_cached(self):
+        # SQLite can't tell the types of an empty table's columns
+        self.run_sql("CREATE TABLE later (year INTEGER)")
+        query = Query("SELECT * FROM later WHERE year BETWEEN 2000 AND 2001")
+        self.assertEqual(query.rshift('year').statement, query.statement)
+        self.assertFalse(('later', 'year') in shifter.column_type_cache)
+        self.run_sql("INSERT INTO later VALUES (2000)")
+        self.assertEqual(query.rshift('year').statement, "SELECT * FROM later WHERE year BETWEEN 2001 AND 2002")
+
+class StringShiftTest(ShiftTestCase):
+    def setUp(self):
+        ShiftTestCase.setUp(self)
+        self.run_sql("CREATE TABLE people (name TEXT)",
+                u"INSERT INTO people VALUES ('Anna'), ('O''Neil'), ('Zo\u00eb')")
+
+    def test_rshift(self):
+        query = Query("SELECT * FROM people WHERE name = 'Anna'")
+        self.assertEqual(query.rshift('name').statement, "SELECT * FROM people WHERE name = 'O''Neil'")
+
+    def test_end_of_data(self):
+        query = Query(u"SELECT * FROM people WHERE name = 'Zo\u00eb'")
+        self.assertRaises(shifter.EndOfDataException, query.rshift, 'name')
+        self.assertEqual(query.child, None)
+        self.assertEqual(query.lshift('name').statement, "SELECT * FROM people WHERE name = 'O''Neil'")
+
+    def test_unicode_neighbor(self):
+        query = Query("SELECT * FROM people WHERE name = 'Anna'")
+        shifted = query.rshift('name', 2)
+        self.assertEqual(shifted.statement, u"SELECT * FROM people WHERE name = 'Zo\u00eb'")
+        self.assertEqual(shifted.show(), [(u'Zo\u00eb',)])
+
+class NeighborMemoryTest(StringShiftTest):
+    settings = dict(ShiftTestCase.settings, SHIFT_NEIGHBOR_LOOKUP = config.NEIGHBOR_MEMORY)
+
+    def setUp(self):
+        StringShiftTest.setUp(self)
+        neighbors.clear_cache()
+
+    def tearDown(self):
+        neighbors.clear_cache()
+        StringShiftTest.tearDown(self)
+
+    def test_writes_drop_cached_values(self):
+        query = Query("SELECT * FROM people WHERE name = 'Anna'")
+        self.assertEqual(query.rshift('name').statement, "SELECT * FROM people WHERE name = 'O''Neil'")
+        sql = "INSERT INTO people VALUES ('Bob')"
+        self.run_sql(sql)
+        quest.engine.invalidate_statement(sql)
+        self.assertEqual(query.rshift('name').statement, "SELECT * FROM people WHERE name = 'Bob'")
+
+    def test_other_tables_writes_keep_cached_values(self):
+        Query("SELECT * FROM people WHERE name = 'Anna'").rshift('name')
+        quest.engine.invalidate_statement("INSERT INTO players VALUES ('p', 'BOS', 'AL', 2003, 1)")
+        self.assertEqual(len(neighbors.distinct_values_cache), 1)
+
+if __name__ == '__main__':
+    unittest.main()
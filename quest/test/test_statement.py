@@ -0,0 +1,96 @@
+# Tests for the parsed SELECT statements operators build on
+# (quest.query.statement).
+
+import unittest
+
+from quest.query import statement
+from quest.query.statement import parse, UnparseableStatement
+
+class ParseTest(unittest.TestCase):
+    def test_clauses(self):
+        parsed = parse("select distinct teamid, SUM(hr) AS total from players\n"
+                "where year >= 2000 group by teamid having SUM(hr) > 5 order by teamid desc limit 10;")
+        self.assertEqual(parsed.select_modifier, 'DISTINCT')
+        self.assertEqual(parsed.select, ('teamid', 'SUM(hr) AS total'))
+        self.assertEqual(parsed.from_clause, 'players')
+        self.assertEqual(parsed.where.text, 'year >= 2000')
+        self.assertEqual(parsed.group_by, ('teamid',))
+        self.assertEqual(parsed.having.text, 'SUM(hr) > 5')
+        self.assertEqual(parsed.order_by, ('teamid desc',))
+        self.assertEqual(parsed.limit, '10')
+
+    def test_round_trip(self):
+        sql = "SELECT teamid, COUNT(*) FROM players WHERE lg = 'AL' GROUP BY teamid ORDER BY teamid LIMIT 5"
+        self.assertEqual(parse(sql).sql(), sql)
+
+    def test_keywords_in_strings_and_subqueries(self):
+        parsed = parse("SELECT * FROM (SELECT * FROM players WHERE year = 2000) AS p WHERE name = 'order by x, y'")
+        self.assertEqual(parsed.from_clause, '(SELECT * FROM players WHERE year = 2000) AS p')
+        self.assertEqual(parsed.where.text, "name = 'order by x, y'")
+        self.assertEqual(parsed.order_by, ())
+
+    def test_whitespace_in_strings_is_kept(self):
+        parsed = parse("SELECT  name\nFROM players   WHERE name = 'Ty  Cobb' OR `nick  name` = \"Georgia\tPeach\"")
+        self.assertEqual(parsed.sql(),
+                "SELECT name FROM players WHERE name = 'Ty  Cobb' OR `nick  name` = \"Georgia\tPeach\"")
+
+    def test_select_commas_inside_functions(self):
+        self.assertEqual(parse("SELECT COALESCE(a, b), c FROM t").select, ('COALESCE(a, b)', 'c'))
+
+    def test_unparseable(self):
+        self.assertRaises(UnparseableStatement, parse, "UPDATE players SET hr = 1")
+        self.assertRaises(UnparseableStatement, parse, "SELECT 1")
+        self.assertRaises(UnparseableStatement, parse, "SELECT * FROM t WHERE a = 1 FROM u")
+        self.assertRaises(UnparseableStatement, parse, "SELECT * FROM t WHERE")
+
+class StatementTest(unittest.TestCase):
+    def test_narrow_parenthesizes_or(self):
+        parsed = parse("SELECT * FROM players WHERE lg = 'AL' OR lg = 'NL'")
+        self.assertEqual(parsed.narrow("year = 2000").sql(),
+                "SELECT * FROM players WHERE year = 2000 AND (lg = 'AL' OR lg = 'NL')")
+
+    def test_relax(self):
+        parsed = parse("SELECT * FROM players WHERE year = 2000")
+        self.assertEqual(parsed.relax("year = 2002").sql(),
+                "SELECT * FROM players WHERE year = 2002 OR year = 2000")
+
+    def test_narrow_without_where(self):
+        self.assertEqual(parse("SELECT * FROM players").narrow("hr > 1").sql(),
+                "SELECT * FROM players WHERE hr > 1")
+
+    def test_narrow_applies_to_having_too(self):
+        parsed = parse("SELECT teamid, SUM(hr) FROM players GROUP BY teamid HAVING SUM(hr) > 5").narrow("teamid <> 'BOS'")
+        self.assertEqual(parsed.where, None)
+        self.assertEqual(parsed.having.render(), "teamid <> 'BOS' AND SUM(hr) > 5")
+
+    def test_children_share_untouched_clauses(self):
+        parsed = parse("SELECT a, b FROM t WHERE a = 1 GROUP BY a, b")
+        narrowed = parsed.narrow("b = 2")
+        self.assertTrue(narrowed.select is parsed.select)
+        self.assertTrue(narrowed.group_by is parsed.group_by)
+        self.assertTrue(narrowed.where.right is parsed.where)
+
+    def test_replace_attribute(self):
+        parsed = parse("SELECT teamid, SUM(hr) FROM players GROUP BY teamid ORDER BY teamid")
+        self.assertEqual(parsed.replace_attribute('teamid', 'lg').sql(),
+                "SELECT lg, SUM(hr) FROM players GROUP BY lg ORDER BY lg")
+
+    def test_map_predicates_keeps_unchanged_leaves(self):
+        parsed = parse("SELECT * FROM t WHERE a = 1").narrow("b = 2")
+        mapped = parsed.map_predicates(lambda text: text.replace('b = 2', 'b = 3'))
+        self.assertEqual(mapped.sql(), "SELECT * FROM t WHERE b = 3 AND a = 1")
+        self.assertTrue(mapped.where.right is parsed.where.right)
+        self.assertTrue(parsed.map_predicates(lambda text: text).where is parsed.where)
+
+class HelperTest(unittest.TestCase):
+    def test_split_alias(self):
+        self.assertEqual(statement.split_alias("SUM(hr) AS total"), ("SUM(hr)", "total"))
+        self.assertEqual(statement.split_alias("teamid"), ("teamid", None))
+
+    def test_aggregate(self):
+        self.assertEqual(statement.aggregate("SUM( hr )"), ("sum", "hr"))
+        self.assertEqual(statement.aggregate("count(*)"), ("count", "*"))
+        self.assertEqual(statement.aggregate("SUM(hr + 1)"), None)
+
+if __name__ == '__main__':
+    unittest.main()
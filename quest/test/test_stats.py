@@ -0,0 +1,80 @@
+# Tests for statement statistics (quest.stats) and the StatementEvents
+# quest.engine reports.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import quest.config as config
+import quest.engine
+import quest.stats
+from quest.query.query import Query
+from quest.test.sqlite_case import SQLiteTestCase
+
+class StatsTest(SQLiteTestCase):
+    settings = {'STATS_ENABLED': True, 'STATS_HISTORY_SIZE': 1000, 'SLOW_QUERY_LOG': None,
+            'SLOW_QUERY_SECONDS': 1.0, 'KEEP_RESULT_ROWS': 0, 'RESULT_CACHE_ENABLED': False,
+            'PREFETCH_SHIFTS': False, 'INDEX_ADVISOR_ENABLED': False}
+
+    def setUp(self):
+        SQLiteTestCase.setUp(self)
+        self.create_players()
+        quest.stats.clear()
+
+    def tearDown(self):
+        quest.stats.clear()
+        SQLiteTestCase.tearDown(self)
+
+    def test_records_rows_and_lineage(self):
+        Query("SELECT * FROM players WHERE year = 2000").narrow("hr > 2").show()
+        events = quest.stats.events()
+        self.assertEqual(len(events), 1)
+        event = events[0]
+        self.assertEqual((event.source, event.lineage, event.rows), ('db', ('narrow',), 3))
+        self.assertTrue(event.bytes > 0)
+        self.assertEqual(event.error, None)
+
+    def test_show_reads_only_the_rows_it_wants(self):
+        quest.engine.show("SELECT * FROM players", 5)
+        self.assertEqual(quest.stats.events()[-1].rows, 5)
+
+    def test_records_errors(self):
+        self.assertRaises(quest.engine.get_backend().Error, quest.engine.run_sql, "SELECT * FROM nowhere")
+        self.assertTrue('nowhere' in quest.stats.events()[-1].error)
+
+    def test_history_is_bounded(self):
+        config.STATS_HISTORY_SIZE = 3
+        for number in range(5):
+            quest.engine.run_sql("SELECT %d" % number)
+        self.assertEqual([event.sql for event in quest.stats.events()], ["SELECT %d;" % number for number in (2, 3, 4)])
+
+    def test_off(self):
+        config.STATS_ENABLED = False
+        quest.engine.run_sql("SELECT 1")
+        self.assertEqual(quest.stats.events(), [])
+
+    def test_summary(self):
+        self.assertEqual(quest.stats.summary(), "No statements yet.")
+        Query("SELECT * FROM players").narrow("hr > 2").show()
+        quest.engine.run_sql("SELECT 1")
+        summary = quest.stats.summary()
+        self.assertTrue(summary.startswith("2 statements in "))
+        self.assertTrue("\n  narrow " in summary)
+        self.assertTrue("\n  query " in summary)
+
+    def test_slow_query_log(self):
+        directory = tempfile.mkdtemp()
+        try:
+            config.SLOW_QUERY_LOG = os.path.join(directory, 'slow.log')
+            config.SLOW_QUERY_SECONDS = 0
+            quest.engine.run_sql("SELECT 1")
+            log = open(config.SLOW_QUERY_LOG).read()
+            self.assertTrue(log.startswith("# "))
+            self.assertTrue(log.endswith("\nSELECT 1;\n"))
+            self.assertTrue("source: db lineage: query" in log)
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
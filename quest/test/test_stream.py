@@ -0,0 +1,54 @@
+# Tests for streaming results a batch at a time (quest.engine.RowStream).
+
+import unittest
+
+import quest.config as config
+import quest.engine
+import quest.input_handler
+from quest.query.query import Query
+from quest.session import Session
+from quest.test.sqlite_case import SQLiteTestCase
+
+ALL_PLAYERS = "SELECT playerid, year FROM players ORDER BY playerid, year"
+
+class StreamTest(SQLiteTestCase):
+    settings = {'db_pool_timeout': 1, 'ROWS_TO_SHOW': config.ALL_ROWS, 'STREAM_BATCH_SIZE': 1000,
+            'PREFETCH_SHIFTS': False, 'INDEX_ADVISOR_ENABLED': False}
+
+    def setUp(self):
+        SQLiteTestCase.setUp(self)
+        self.create_players()
+
+    def test_batches(self):
+        rows = quest.engine.stream(ALL_PLAYERS, batch_size = 5)
+        batches = list(rows.batches())
+        self.assertEqual([len(batch) for batch in batches], [5, 5, 5, 3])
+        self.assertEqual(sum(batches, []), quest.engine.run_sql(ALL_PLAYERS).fetchall())
+        self.assertEqual([d[0] for d in rows.description], ['playerid', 'year'])
+
+    def test_limit(self):
+        self.assertEqual(len(list(quest.engine.stream(ALL_PLAYERS, 7, batch_size = 5))), 7)
+
+    def test_nothing_runs_until_read(self):
+        quest.engine.stream("SELECT * FROM nowhere")
+        rows = quest.engine.stream("SELECT * FROM nowhere")
+        self.assertRaises(quest.engine.get_backend().Error, list, rows)
+
+    def test_stopping_early_frees_the_connection(self):
+        batches = quest.engine.stream(ALL_PLAYERS, batch_size = 5).batches()
+        batches.next()
+        batches.close()
+        # ":memory:" has only the one connection, so this would time out
+        self.assertEqual(quest.engine.run_sql("SELECT COUNT(*) FROM players").fetchall(), [(18,)])
+
+    def test_query_and_input_handler(self):
+        query = Query("SELECT * FROM players WHERE year = 2001")
+        self.assertEqual(list(query.stream()), list(query.show()))
+        session = Session()
+        quest.input_handler.handle("initialize(Q, SELECT * FROM players)", session)
+        rows = quest.input_handler.handle("Q.show()", session, stream = True)
+        self.assertTrue(isinstance(rows, quest.engine.RowStream))
+        self.assertEqual(len(list(rows)), 18)
+
+if __name__ == '__main__':
+    unittest.main()
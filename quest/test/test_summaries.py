@@ -0,0 +1,77 @@
+# Tests for quest.query.summaries: precomputed summary tables for each
+# level of a hierarchy, and routing grouped queries to them.
+
+import unittest
+
+import quest.config as config
+import quest.engine
+from quest.query import statement
+from quest.query import summaries
+from quest.test.sqlite_case import SQLiteTestCase, save_hierarchies, restore_hierarchies
+
+class SummariesTest(SQLiteTestCase):
+    settings = {'SUMMARY_TABLES_ENABLED': True, 'MATERIALIZE_ENABLED': False}
+
+    def setUp(self):
+        SQLiteTestCase.setUp(self)
+        self.saved_hierarchies = save_hierarchies()
+        config.rollup_child2parent.clear()
+        config.drilldown_parent2child.clear()
+        config.create_hierarchy(['lg', 'teamid', 'playerid'])
+        summaries.fact_tables.clear()
+        self.create_players()
+        summaries.build('players', ['hr'])
+
+    def tearDown(self):
+        summaries.fact_tables.clear()
+        restore_hierarchies(self.saved_hierarchies)
+        SQLiteTestCase.tearDown(self)
+
+    def route(self, sql):
+        return summaries.route(statement.parse(sql))
+
+    def assertRoutedTo(self, sql, table):
+        routed = self.route(sql)
+        self.assertTrue(routed is not None, sql)
+        self.assertTrue("FROM %s" % table in routed, routed)
+        # Same rows, whichever table they came from
+        expected = quest.engine.run_sql(sql).fetchall()
+        self.assertEqual(sorted(quest.engine.run_sql(routed).fetchall()), sorted(expected))
+
+    def test_build(self):
+        self.assertEqual(summaries.hierarchies(), [['lg', 'teamid', 'playerid']])
+        self.assertEqual([(summary.name, summary.rows) for summary in summaries.fact_tables['players'].summaries],
+                [('quest_summary_players_playerid', 6), ('quest_summary_players_teamid', 3), ('quest_summary_players_lg', 2)])
+
+    def test_smallest_summary_answers(self):
+        self.assertRoutedTo("SELECT lg, SUM(hr), COUNT(hr), MIN(hr), MAX(hr), AVG(hr), COUNT(*) FROM players GROUP BY lg",
+                'quest_summary_players_lg')
+        self.assertRoutedTo("SELECT teamid, SUM(hr) AS total FROM players WHERE lg = 'AL' GROUP BY teamid ORDER BY teamid",
+                'quest_summary_players_teamid')
+        self.assertRoutedTo("SELECT SUM(hr) FROM players WHERE playerid <> 'pBOS0'",
+                'quest_summary_players_playerid')
+
+    def test_fact_table_only(self):
+        for sql in ["SELECT * FROM players",
+                "SELECT year, SUM(hr) FROM players GROUP BY year",
+                "SELECT lg, SUM(year) FROM players GROUP BY lg",
+                "SELECT lg, SUM(hr) FROM players GROUP BY lg HAVING SUM(hr) > 10",
+                "SELECT lg, SUM(hr) FROM players WHERE year = 2000 GROUP BY lg",
+                "SELECT teamid FROM players"]:
+            self.assertEqual(self.route(sql), None, sql)
+
+    def test_stale_until_refreshed(self):
+        sql = "SELECT lg, SUM(hr) FROM players GROUP BY lg"
+        update = "UPDATE players SET hr = hr + 1"
+        quest.engine.run_sql(update)
+        quest.engine.invalidate_statement(update)
+        self.assertEqual(self.route(sql), None)
+        summaries.refresh('players')
+        self.assertRoutedTo(sql, 'quest_summary_players_lg')
+
+    def test_off(self):
+        config.SUMMARY_TABLES_ENABLED = False
+        self.assertEqual(self.route("SELECT lg, SUM(hr) FROM players GROUP BY lg"), None)
+
+if __name__ == '__main__':
+    unittest.main()
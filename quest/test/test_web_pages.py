@@ -0,0 +1,47 @@
+# Tests for the web app's paginated JSON results (quest.web.quest_app).
+# The app needs CherryPy, so these are skipped without it.
+
+import datetime
+import decimal
+import json
+import unittest
+
+try:
+    import cherrypy
+    from quest.web import quest_app
+except ImportError:
+    quest_app = None
+
+@unittest.skipIf(quest_app is None, "the web app needs CherryPy")
+class JSONPageTest(unittest.TestCase):
+    def setUp(self):
+        self.saved_rows_per_chunk = quest_app.ROWS_PER_CHUNK
+        quest_app.ROWS_PER_CHUNK = 2
+
+    def tearDown(self):
+        quest_app.ROWS_PER_CHUNK = self.saved_rows_per_chunk
+
+    def test_rows_are_sent_a_chunk_at_a_time(self):
+        rows = [(number, 'p%d' % number) for number in range(5)]
+        chunks = list(quest_app.stream_json_page({'id': 'abc', 'next': None}, rows))
+        # The head, 3 chunks of rows, and the closing brackets
+        self.assertEqual(len(chunks), 5)
+        page = json.loads("".join(chunks))
+        self.assertEqual(page['id'], 'abc')
+        self.assertEqual(page['next'], None)
+        self.assertEqual(page['rows'], [[number, 'p%d' % number] for number in range(5)])
+
+    def test_no_rows(self):
+        self.assertEqual(json.loads("".join(quest_app.stream_json_page({'id': 'abc'}, [])))['rows'], [])
+
+    def test_values_json_doesnt_know(self):
+        rows = [(datetime.date(2001, 2, 3), decimal.Decimal('1.50'), None)]
+        page = json.loads("".join(quest_app.stream_json_page({}, rows)))
+        self.assertEqual(page['rows'], [['2001-02-03', '1.50', None]])
+
+    def test_bad_cursors(self):
+        for cursor in (None, '', 'abc-x'):
+            self.assertRaises(cherrypy.HTTPError, quest_app.find_job_and_offset, cursor)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,69 @@
 """Utility functions for Quest."""
 
+import threading
+from collections import OrderedDict
 
 def is_integer(number):
     """Returns True if number is an integer, False otherwise."""
     return str(number).isdigit()
+
+class LRUCache:
+    """
+    A thread-safe dict-like cache that holds at most max_size items,
+    evicting the least recently used one when it's full. Counts hits and
+    misses so we can tell whether it's earning its keep.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default = None):
+        """Returns the value for key (marking it recently used), or default."""
+        with self.lock:
+            try:
+                value = self.items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.items[key] = value
+            self.hits += 1
+            return value
+
+    def peek(self, key, default = None):
+        """Like get, but doesn't count as a use (or a hit/miss)."""
+        with self.lock:
+            return self.items.get(key, default)
+
+    def put(self, key, value):
+        """Stores value under key, evicting the oldest item if need be."""
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.max_size:
+                self.items.popitem(last = False)
+
+    def delete(self, key):
+        """Removes key from the cache, if it's there."""
+        with self.lock:
+            self.items.pop(key, None)
+
+    def keys(self):
+        """Returns a list of the keys, least recently used first."""
+        with self.lock:
+            return list(self.items.keys())
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
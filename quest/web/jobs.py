@@ -0,0 +1,271 @@
+# Running the web app's queries in the background.
+#
+# Instead of handling a query inside the HTTP request (which ties up a
+# CherryPy thread until the DB is done, and can't be stopped), the page
+# submits it as a Job and gets the job's id straight back. One of
+# config.WEB_JOB_WORKERS worker threads runs it, reading the result a
+# batch at a time, and the page polls for the job's state and any new
+# rows. Cancelling a job interrupts its statement in the DB (KILL QUERY
+# on MySQL; see quest.engine.CancelToken), so an abandoned analysis stops
+# using the DB too.
+#
+# A job reads at most config.WEB_JOB_BUFFER_PAGES pages of rows ahead of
+# the page, then waits for the page to take some, so a huge result never
+# piles up in memory. Finished jobs are forgotten config.WEB_JOB_RETENTION
+# seconds after they finish, and unfinished ones the page hasn't asked
+# about for that long are cancelled (the browser has probably gone away).
+
+import threading
+import time
+import uuid
+import Queue
+
+import quest.engine
+import quest.config as config
+from quest import input_handler
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+class RowsForgottenError(Exception):
+    """
+    Raised by Job.take_rows when asked for rows it has already handed out
+    and forgotten.
+    """
+
+    def __init__(self, since, first_row):
+        self.since = since
+        self.first_row = first_row
+
+    def __str__(self):
+        return "Rows before row %d have been forgotten; can't start at row %d" % (self.first_row, self.since)
+
+class Job:
+    """One query submitted by a web session."""
+
+    def __init__(self, user_input, session):
+        self.id = uuid.uuid4().hex
+        self.user_input = user_input
+        # The quest.session.Session it runs in; only that session's
+        # requests can see or cancel it
+        self.session = session
+        self.state = QUEUED
+        self.token = quest.engine.CancelToken()
+        # Text to show above the rows (e.g. "New query: ..."), or the
+        # whole result if it isn't rows
+        self.header = None
+        self.result = None
+        # The rows' column names, once we know them
+        self.columns = None
+        self.error = None
+        # Rows read but not yet handed to the page. first_row is the
+        # number of the first of them: rows before it have been fetched
+        # by take_rows and forgotten.
+        self.rows = []
+        self.first_row = 0
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # When the page last took rows
+        self.last_polled = self.submitted_at
+        self.lock = threading.Lock()
+        # Notified when take_rows makes room for more rows, or the job is
+        # cancelled
+        self.room = threading.Condition(self.lock)
+
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    def rows_read(self):
+        return self.first_row + len(self.rows)
+
+    def buffer_limit(self):
+        return config.WEB_JOB_BUFFER_PAGES * config.WEB_PAGE_SIZE
+
+    def add_rows(self, rows):
+        """
+        Adds rows for the page to take, first waiting until it has taken
+        enough that we're less than buffer_limit() rows ahead of it.
+        """
+        with self.lock:
+            while len(self.rows) >= self.buffer_limit() and not self.token.cancelled:
+                # With a timeout, in case the limit is raised
+                self.room.wait(1.0)
+            self.rows.extend(rows)
+
+    def take_rows(self, since, limit = None):
+        """
+        Returns the rows from row number since on (at most limit of them,
+        if limit isn't None). Rows before since are forgotten, since the
+        page has them already. Raises RowsForgottenError if since is
+        before a row we've already forgotten.
+        """
+        with self.lock:
+            self.last_polled = time.time()
+            if since < self.first_row:
+                raise RowsForgottenError(since, self.first_row)
+            if since > self.first_row:
+                forgotten = min(since - self.first_row, len(self.rows))
+                del self.rows[:forgotten]
+                self.first_row += forgotten
+                self.room.notify_all()
+            start = since - self.first_row
+            if limit is None:
+                return self.rows[start:]
+            return self.rows[start:start + limit]
+
+    def finish(self, state, error = None):
+        with self.lock:
+            if not self.finished():
+                self.state = state
+                self.error = error
+                self.finished_at = time.time()
+
+    def cancel(self):
+        """Stops the job, interrupting its statement if it's running one."""
+        with self.lock:
+            if self.finished():
+                return False
+            if self.state == QUEUED:
+                # The worker will skip it
+                self.state = CANCELLED
+                self.finished_at = time.time()
+                return True
+        self.token.cancel()
+        with self.lock:
+            # Wakes up add_rows, if it's waiting for room
+            self.room.notify_all()
+        return True
+
+    def run(self):
+        with self.lock:
+            if self.state != QUEUED:
+                return
+            self.state = RUNNING
+            self.started_at = time.time()
+        try:
+            with quest.engine.cancellable(self.token):
+                result = input_handler.handle(self.user_input, self.session, stream = True)
+                if isinstance(result, quest.engine.RowStream):
+                    self.header = result.header
+                    batches = result.batches()
+                    try:
+                        for batch in batches:
+                            if self.columns is None and result.description is not None:
+                                self.columns = [column[0] for column in result.description]
+                            self.add_rows(batch)
+                            if self.token.cancelled:
+                                break
+                    finally:
+                        # Lets the stream clean up its connection now,
+                        # even if we stopped early
+                        batches.close()
+                    if self.columns is None and result.description is not None:
+                        # There weren't any rows
+                        self.columns = [column[0] for column in result.description]
+                else:
+                    self.result = result
+        except Exception as e:
+            if self.token.cancelled:
+                self.finish(CANCELLED)
+            else:
+                self.finish(FAILED, str(e))
+            return
+        if self.token.cancelled:
+            self.finish(CANCELLED)
+        else:
+            self.finish(DONE)
+
+    def status(self):
+        return {
+                'id': self.id,
+                'state': self.state,
+                'rows_read': self.rows_read(),
+                'elapsed': (self.finished_at or time.time()) - (self.started_at or self.submitted_at),
+                'error': self.error,
+                }
+
+class JobManager:
+    """
+    Hands Jobs to a pool of worker threads, and finds them again by id. A
+    reaper thread forgets old jobs every so often.
+    """
+
+    def __init__(self, workers):
+        self.queue = Queue.Queue()
+        # Maps job id to Job
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.workers = []
+        for number in range(workers):
+            worker = threading.Thread(target = self.work, name = "quest-job-%d" % number)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        self.reaper = threading.Thread(target = self.reap, name = "quest-job-reaper")
+        self.reaper.daemon = True
+        self.reaper.start()
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            try:
+                job.run()
+            finally:
+                self.queue.task_done()
+
+    def reap(self):
+        while True:
+            time.sleep(max(config.WEB_JOB_RETENTION / 10.0, 1))
+            with self.lock:
+                self.forget_old_jobs()
+
+    def submit(self, user_input, session):
+        """Queues user_input to run in session, and returns its Job."""
+        job = Job(user_input, session)
+        with self.lock:
+            self.forget_old_jobs()
+            self.jobs[job.id] = job
+        self.queue.put(job)
+        return job
+
+    def get(self, job_id, session):
+        """The job with the given id, if it belongs to session, or None."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+        # Compare ids: CherryPy may hand us a copy of the session
+        if job is None or job.session.id != session.id:
+            return None
+        return job
+
+    def forget_old_jobs(self):
+        """
+        Forgets jobs that finished more than config.WEB_JOB_RETENTION
+        seconds ago, and cancels unfinished ones the page hasn't taken rows
+        from for that long. Call with self.lock held.
+        """
+        cutoff = time.time() - config.WEB_JOB_RETENTION
+        for job_id, job in self.jobs.items():
+            if job.finished():
+                if job.finished_at < cutoff:
+                    del self.jobs[job_id]
+            elif job.last_polled < cutoff:
+                job.cancel()
+
+# manager is created (and its threads started) the first time it's needed
+manager = None
+manager_lock = threading.Lock()
+
+def get_manager():
+    """Returns the module-wide JobManager, creating it if need be."""
+    global manager
+    if manager is None:
+        with manager_lock:
+            if manager is None:
+                manager = JobManager(config.WEB_JOB_WORKERS)
+    return manager
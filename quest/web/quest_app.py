@@ -2,6 +2,8 @@
 
 # A simple server to run a local HTML interface to Quest
 
+import cgi
+import json
 import os.path
 from os.path import dirname
 import sys
@@ -11,6 +13,9 @@ import cherrypy
 import quest
 from quest import config
 from quest import input_handler
+from quest.engine import RowStream
+from quest.session import Session
+from quest.web import jobs
 
 # Used in conf file to serve static assets
 current_dir = dirname(os.path.abspath(__file__))
@@ -36,6 +41,15 @@ quest_html = """
     /* The result of processing a user's query */
     .repl-result {
     }
+    /* A result's rows */
+    .repl-rows td, .repl-rows th {
+        padding-right: 1em;
+        text-align: left;
+    }
+    /* How a running query is getting on, and its cancel link */
+    .repl-status {
+        color: gray;
+    }
 </style>
 
 <script type="text/javascript" src="/jquery-1.4.4.min.js"></script>
@@ -44,27 +58,96 @@ quest_html = """
         url: "navigate",
         type: "GET"
     });
+    // How often to ask how a running query is getting on, in ms
+    var POLL_INTERVAL = 500;
+
+    function escapeHtml(value){
+        if(value === null){
+            return "NULL";
+        }
+        return String(value).replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;");
+    }
+
+    // Fetches the page of a job's result at cursor and adds its rows to
+    // result's table, then goes on to the next page (straight away if
+    // this one had rows, after POLL_INTERVAL if it didn't) until there
+    // isn't one. So the first rows show up as soon as they're read, no
+    // matter how many more there are.
+    function fetchPage(cursor, result, status){
+        $.ajax({
+            url: "results",
+            dataType: "json",
+            data: {cursor: cursor},
+            success: function(page){
+                if(page.header && !result.data("shownHeader")){
+                    result.data("shownHeader", true);
+                    result.prepend(page.header);
+                }
+                if(page.columns){
+                    var table = result.find("table.repl-rows");
+                    if(!table.length){
+                        table = $("<table/>", {"class": "repl-rows"}).appendTo(result);
+                        table.append("<tr><th>" + $.map(page.columns, escapeHtml).join("</th><th>") + "</th></tr>");
+                    }
+                    var html = [];
+                    $.each(page.rows, function(i, row){
+                        html.push("<tr><td>" + $.map(row, escapeHtml).join("</td><td>") + "</td></tr>");
+                    });
+                    table.append(html.join(""));
+                }
+                if(page.next !== null){
+                    status.find(".progress").text(page.state + ": " +
+                        page.rows_read + " rows, " + page.elapsed.toFixed(1) + "s ");
+                    setTimeout(function(){
+                        fetchPage(page.next, result, status);
+                    }, page.rows.length ? 0 : POLL_INTERVAL);
+                } else {
+                    status.remove();
+                    if(page.result){
+                        result.append(page.result);
+                    }
+                    if(page.state == "failed"){
+                        result.append("<hr><h1>Oops! Quest couldn't handle your input.</h1>");
+                    } else if(page.state == "cancelled"){
+                        result.append("<br/>(Cancelled)");
+                    }
+                }
+            },
+            error: function(xhr, textStatus){
+                status.text("Lost track of the query: " + textStatus);
+            }
+        });
+    }
+
     $(document).ready(function(){
         $('#theForm').submit(function(e){
             e.preventDefault();
             var userInput = $('#query').val();
-            // third param is errorThrown for error callback
-            function onSuccessOrError(data, textStatus, xhr){
-                var replItem = $("<div/>", {
-                    "class": "repl-item",
-                    text: userInput});
-                replItem.prependTo("#mySearch");
-
-                $("<div/>", {
-                    "class": "repl-result"
-                // append so the returned value is after
-                // the user input value
-                }).html(data).appendTo(replItem);
-            }
+            var replItem = $("<div/>", {
+                "class": "repl-item",
+                text: userInput});
+            replItem.prependTo("#mySearch");
+            var status = $("<div/>", {"class": "repl-status"}).appendTo(replItem);
+            $("<span/>", {"class": "progress", text: "submitting "}).appendTo(status);
+            // append so the returned value is after the user input value
+            var result = $("<div/>", {"class": "repl-result"}).appendTo(replItem);
+
             $.ajax({
+                url: "submit",
+                dataType: "json",
                 data: {query: userInput},
-                success: onSuccessOrError,
-                error: onSuccessOrError
+                success: function(job){
+                    $("<a/>", {href: "#", text: "cancel"}).click(function(e){
+                        e.preventDefault();
+                        $.ajax({url: "cancel", data: {id: job.id}});
+                        $(this).remove();
+                    }).appendTo(status);
+                    fetchPage(job.id, result, status);
+                },
+                error: function(xhr, textStatus){
+                    status.remove();
+                    result.html(xhr.responseText);
+                }
             });
         });
     });
@@ -111,7 +194,10 @@ class WelcomePage:
 
         if query:
             try:
-                response = str(input_handler.handle(query)).strip()
+                result = input_handler.handle(query, current_session())
+                if isinstance(result, RowStream):
+                    return stream_rows_as_html(result)
+                response = str(result).strip()
                 # Add a period and <br> instead of newlines
                 return response.replace("\n", ".<br/>")
             except Exception as e:
@@ -123,6 +209,146 @@ class WelcomePage:
             else:
                 return 'No, really, enter a query.'
 
+    # Lets navigate return a generator that CherryPy sends to the browser
+    # piece by piece (see stream_rows_as_html).
+    navigate._cp_config = {'response.stream': True}
+
+    # The page uses these instead of navigate, so a slow query doesn't
+    # hold up a CherryPy thread, and can be cancelled (see quest.web.jobs).
+
+    @cherrypy.expose
+    def submit(self, query = None):
+        """Starts running query in the background. Returns its job's id."""
+        if not query:
+            raise cherrypy.HTTPError(400, 'Please enter a query.')
+        job = jobs.get_manager().submit(query, current_session())
+        return as_json({'id': job.id})
+
+    @cherrypy.expose
+    def results(self, cursor = None, page_size = None):
+        """
+        A page of a job's result, as JSON. cursor is the job's id for the
+        first page, and the "next" of the page before for the rest. The
+        page looks like
+          {"id": ..., "state": ..., "rows_read": ..., "elapsed": ...,
+           "error": ..., "header": ..., "result": ..., "columns": [...],
+           "rows": [[...], ...], "next": ...}
+        and is sent ROWS_PER_CHUNK rows at a time, so the browser starts
+        getting it before we've turned every row into JSON. next is null
+        once the job has finished and every row has been sent. Asking
+        for a page tells us the page has every row before it, so asking
+        for an earlier page again is an error.
+        """
+        job, offset = find_job_and_offset(cursor)
+        if page_size is None:
+            page_size = config.WEB_PAGE_SIZE
+        try:
+            page_size = max(int(page_size), 1)
+        except ValueError:
+            raise cherrypy.HTTPError(400, 'page_size should be a number of rows')
+        # Get the state first: once it says finished, every row is in
+        page = job.status()
+        try:
+            rows = job.take_rows(offset, page_size)
+        except jobs.RowsForgottenError as e:
+            raise cherrypy.HTTPError(410, str(e))
+        next_offset = offset + len(rows)
+        if page['state'] in jobs.FINISHED_STATES and next_offset >= page['rows_read']:
+            page['next'] = None
+        else:
+            page['next'] = "%s-%d" % (job.id, next_offset)
+        page['columns'] = job.columns
+        page['header'] = None
+        if job.header:
+            page['header'] = job.header.strip().replace("\n", ".<br/>") + "<br/>"
+        page['result'] = None
+        if job.result is not None and job.finished():
+            page['result'] = str(job.result).strip().replace("\n", ".<br/>")
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        return stream_json_page(page, rows)
+
+    results._cp_config = {'response.stream': True}
+
+    @cherrypy.expose
+    def cancel(self, id = None):
+        """Cancels job id, stopping its query in the DB."""
+        return as_json({'cancelled': find_job(id).cancel()})
+
+# How many rows results() turns into JSON and sends at a time
+ROWS_PER_CHUNK = 100
+
+def find_job(job_id):
+    """The current session's job with the given id, or a 404."""
+    job = jobs.get_manager().get(job_id, current_session())
+    if job is None:
+        raise cherrypy.HTTPError(404, 'No such job')
+    return job
+
+def find_job_and_offset(cursor):
+    """
+    Returns (job, row number) for a results() cursor: "<job id>" for the
+    first row, "<job id>-<row number>" for the rest.
+    """
+    if not cursor:
+        raise cherrypy.HTTPError(400, 'Which results?')
+    job_id, separator, offset = cursor.partition('-')
+    try:
+        offset = int(offset or 0)
+    except ValueError:
+        raise cherrypy.HTTPError(400, 'Bad cursor')
+    return (find_job(job_id), offset)
+
+def json_value(value):
+    """JSON for values json doesn't know about, e.g. dates and Decimals."""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+def stream_json_page(page, rows):
+    """
+    Generator that yields page (a dict) as JSON, with rows added as its
+    "rows", ROWS_PER_CHUNK rows at a time.
+    """
+    head = json.dumps(page)
+    # Put the rows in before the closing brace
+    yield head[:-1] + (page and ', ' or '') + '"rows": ['
+    for start in range(0, len(rows), ROWS_PER_CHUNK):
+        chunk = ", ".join([json.dumps(list(row), default = json_value) for row in rows[start:start + ROWS_PER_CHUNK]])
+        if start > 0:
+            chunk = ", " + chunk
+        yield chunk
+    yield "]}"
+
+def as_json(value):
+    """Sends value as the response, as JSON."""
+    cherrypy.response.headers['Content-Type'] = 'application/json'
+    return json.dumps(value)
+
+def current_session():
+    """
+    Returns the quest.session.Session for the browser making this request,
+    creating one if it's new. CherryPy's sessions tool finds the right
+    one by cookie.
+    """
+    session = cherrypy.session.get('quest')
+    if session is None:
+        session = Session()
+        cherrypy.session['quest'] = session
+    return session
+
+def stream_rows_as_html(row_stream):
+    """
+    Generator that turns a RowStream into HTML one batch at a time, so the
+    whole result never has to be built up as one big string.
+    """
+    if row_stream.header:
+        yield row_stream.header.strip().replace("\n", ".<br/>") + "<br/>"
+    try:
+        for batch in row_stream.batches():
+            yield "".join(["%s<br/>" % cgi.escape(str(row)) for row in batch])
+    except Exception as e:
+        # Headers are long gone by now, all we can do is say so inline.
+        yield "<hr><h1>Oops! Quest couldn't handle your input.</h1>"
 
 def run():
     # CherryPy always starts with app.root when trying to map request URIs
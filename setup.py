@@ -3,7 +3,7 @@ from distutils.core import setup
 setup(
     name='Quest',
     version='0.1.0',
-    packages=['quest','quest.test','quest.query','quest.web'],
+    packages=['quest','quest.backends','quest.test','quest.query','quest.web'],
     package_data={'quest.web': ['*.conf', '*.js']},
     license='Creative Commons Attribution-Noncommercial-Share Alike license',
     homepage="https://github.com/gabebw/quest",